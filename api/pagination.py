@@ -0,0 +1,21 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ListCursorPagination(CursorPagination):
+    """
+    Cursor pagination of list endpoints, 50 rows a page unless ?page_size= asks otherwise
+    
+    Pages are fetched by position in a fixed ordering, so later pages cost
+    the same as the first one and rows added meanwhile do not shift them.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class AssignmentPagination(ListCursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class PlagiarismResultPagination(ListCursorPagination):
+    ordering = ('-processed_at', '-id')
@@ -1,5 +1,7 @@
+import struct
+
 from rest_framework import serializers
-from detector.models import Course, Assignment, PlagiarismResult, PlagiarismMatch
+from detector.models import Course, Assignment, PlagiarismResult, PlagiarismMatch, PlagiarismCheckJob, hash_file
 from accounts.models import User
 
 
@@ -23,10 +25,16 @@ class CourseSerializer(serializers.ModelSerializer):
 
 
 class PlagiarismMatchSerializer(serializers.ModelSerializer):
+    spans = serializers.SerializerMethodField()
+    
     class Meta:
         model = PlagiarismMatch
-        fields = ['id', 'source_type', 'source_name', 'source_url', 'source_assignment', 'similarity_score', 'matched_text']
+        fields = ['id', 'source_type', 'source_name', 'source_url', 'source_assignment', 'similarity_score', 'matched_words', 'spans', 'matched_text']
         read_only_fields = ['id']
+    
+    def get_spans(self, obj):
+        """[text_start, text_end, source_start, source_end] character offsets of each copied passage"""
+        return [list(span) for span in struct.iter_unpack('<4i', obj.spans)]
 
 
 class PlagiarismResultSerializer(serializers.ModelSerializer):
@@ -34,8 +42,26 @@ class PlagiarismResultSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = PlagiarismResult
-        fields = ['id', 'assignment', 'overall_score', 'processed_at', 'matches']
-        read_only_fields = ['id', 'processed_at']
+        fields = [
+            'id', 'assignment', 'overall_score', 'compare_with_course', 'compare_with_all',
+            'previous_result', 'processed_at', 'metrics', 'matches'
+        ]
+        read_only_fields = ['id', 'compare_with_course', 'compare_with_all', 'previous_result', 'processed_at',
+                            'metrics']
+
+
+class PlagiarismResultListSerializer(serializers.ModelSerializer):
+    """Result without its matches and metrics, for listing many at once"""
+    assignment_title = serializers.CharField(source='assignment.title', read_only=True)
+    student_name = serializers.CharField(source='assignment.student_name', read_only=True)
+    
+    class Meta:
+        model = PlagiarismResult
+        fields = [
+            'id', 'assignment', 'assignment_title', 'student_name', 'overall_score', 'match_count',
+            'compare_with_course', 'compare_with_all', 'previous_result', 'processed_at'
+        ]
+        read_only_fields = fields
 
 
 class AssignmentSerializer(serializers.ModelSerializer):
@@ -48,9 +74,13 @@ class AssignmentSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'description', 'course', 'course_name', 'file', 'file_name', 
             'file_type', 'file_size', 'uploaded_by', 'uploaded_by_name', 'student_name', 
-            'student_id', 'submission_date', 'created_at', 'updated_at', 'plagiarism_results'
+            'student_id', 'submission_date', 'extraction_status', 'extraction_error',
+            'extraction_duration', 'extracted_at', 'created_at', 'updated_at', 'plagiarism_results'
+        ]
+        read_only_fields = [
+            'id', 'file_name', 'file_type', 'file_size', 'extraction_status', 'extraction_error',
+            'extraction_duration', 'extracted_at', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'file_name', 'file_type', 'file_size', 'created_at', 'updated_at']
     
     def get_course_name(self, obj):
         return obj.course.name
@@ -59,6 +89,24 @@ class AssignmentSerializer(serializers.ModelSerializer):
         return f"{obj.uploaded_by.first_name} {obj.uploaded_by.last_name}".strip() or obj.uploaded_by.username
 
 
+class AssignmentListSerializer(AssignmentSerializer):
+    """
+    Assignment with a summary of its results instead of the results themselves
+    
+    latest_score and result_count are stored on the assignment when results
+    are saved, so listing does not query per assignment.
+    """
+    plagiarism_results = None
+    
+    class Meta(AssignmentSerializer.Meta):
+        fields = [
+            field for field in AssignmentSerializer.Meta.fields if field != 'plagiarism_results'
+        ] + ['latest_result', 'latest_score', 'result_count']
+        read_only_fields = AssignmentSerializer.Meta.read_only_fields + [
+            'latest_result', 'latest_score', 'result_count'
+        ]
+
+
 class AssignmentCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Assignment
@@ -68,6 +116,20 @@ class AssignmentCreateSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id']
     
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.instance is not None:
+            # Updates keep the file, see validate_file
+            fields['file'].required = False
+        return fields
+    
+    def validate_file(self, file):
+        # The file's hash, stored path and extracted text are set once on
+        # create, so replacing it would leave them describing the old file
+        if self.instance is not None:
+            raise serializers.ValidationError("The file of an assignment cannot be replaced; upload it as a new assignment.")
+        return file
+    
     def create(self, validated_data):
         # Get the file from the request
         file = validated_data.get('file')
@@ -80,6 +142,16 @@ class AssignmentCreateSerializer(serializers.ModelSerializer):
         # Set the uploader
         validated_data['uploaded_by'] = self.context['request'].user
         
+        # Store each distinct file once and reuse what was extracted from it
+        validated_data['content_hash'] = hash_file(file)
+        original = Assignment.objects.filter(
+            content_hash=validated_data['content_hash']
+        ).order_by('id').first()
+        if original is not None and original.file and original.file.storage.exists(original.file.name):
+            validated_data['file'] = original.file.name
+            if original.extraction_status == Assignment.EXTRACTION_READY:
+                validated_data['content_text'] = original.content_text
+        
         return super().create(validated_data)
 
 
@@ -87,3 +159,25 @@ class CheckPlagiarismSerializer(serializers.Serializer):
     assignment_id = serializers.IntegerField()
     compare_with_course = serializers.BooleanField(default=True)
     compare_with_all = serializers.BooleanField(default=False)
+    incremental = serializers.BooleanField(default=False)
+    profile = serializers.BooleanField(default=False)
+
+
+class CourseSimilaritySerializer(serializers.Serializer):
+    threshold = serializers.FloatField(default=50, min_value=0, max_value=100)
+    limit = serializers.IntegerField(default=50, min_value=1, max_value=1000)
+
+
+class MatchFragmentsSerializer(serializers.Serializer):
+    match = serializers.IntegerField(required=False, min_value=1)
+    context = serializers.IntegerField(default=80, min_value=0, max_value=1000)
+
+
+class PlagiarismCheckJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PlagiarismCheckJob
+        fields = [
+            'id', 'assignment', 'compare_with_course', 'compare_with_all', 'incremental', 'profile', 'status',
+            'progress', 'result', 'error', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
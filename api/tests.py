@@ -0,0 +1,87 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from detector.models import Assignment, Course, PlagiarismResult
+
+
+class ListQueryCountTests(TestCase):
+    """The assignment and result lists run as many queries for 2N rows as for N"""
+    
+    def setUp(self):
+        self.teacher = User.objects.create_user(
+            username='teacher', email='teacher@example.com', password='password', is_teacher=True
+        )
+        self.student = User.objects.create_user(
+            username='student', email='student@example.com', password='password', is_teacher=False
+        )
+        self.course = Course.objects.create(name='Course', code='C1', teacher=self.teacher)
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+    
+    def add_assignments(self, count):
+        """Create assignments with one result each"""
+        for _ in range(count):
+            number = Assignment.objects.count()
+            assignment = Assignment.objects.create(
+                title=f"Assignment {number}",
+                course=self.course,
+                uploaded_by=self.student,
+                file=f"assignments/{number}.txt",
+                file_name=f"{number}.txt",
+                file_type='txt',
+                file_size=100,
+                content_text="Text of the assignment.",
+                extraction_status=Assignment.EXTRACTION_READY
+            )
+            PlagiarismResult.objects.create(assignment=assignment, overall_score=50.0, match_count=0)
+            assignment.refresh_latest_result()
+    
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def assert_constant_queries(self, url, rows=5):
+        """Request a list with N rows and with 2N, expecting the same number of queries"""
+        self.add_assignments(rows)
+        with CaptureQueriesContext(connection) as queries:
+            first = self.get(url)
+        self.add_assignments(rows)
+        with self.assertNumQueries(len(queries)):
+            second = self.get(url)
+        return first, second
+    
+    def test_assignment_list(self):
+        first, second = self.assert_constant_queries('/api/assignments/')
+        self.assertEqual((len(first['results']), len(second['results'])), (5, 10))
+        self.assertIsNone(second['next'])
+        self.assertEqual(second['results'][0]['result_count'], 1)
+    
+    def test_assignment_list_pages(self):
+        first, second = self.assert_constant_queries('/api/assignments/?page_size=3')
+        self.assertEqual((len(first['results']), len(second['results'])), (3, 3))
+        with self.assertNumQueries(1):
+            next_page = self.get(second['next'])
+        self.assertEqual(len(next_page['results']), 3)
+    
+    def test_result_list(self):
+        first, second = self.assert_constant_queries('/api/results/')
+        self.assertEqual((len(first['results']), len(second['results'])), (5, 10))
+        self.assertIsNone(second['next'])
+    
+    def test_result_list_pages(self):
+        first, second = self.assert_constant_queries('/api/results/?page_size=3')
+        self.assertEqual((len(first['results']), len(second['results'])), (3, 3))
+        with self.assertNumQueries(1):
+            next_page = self.get(second['next'])
+        self.assertEqual(len(next_page['results']), 3)
+    
+    def test_lists_are_paginated_by_default(self):
+        self.add_assignments(55)
+        for url in ('/api/assignments/', '/api/results/'):
+            data = self.get(url)
+            self.assertEqual(len(data['results']), 50)
+            self.assertIsNotNone(data['next'])
@@ -4,7 +4,9 @@ from .views import (
     CourseViewSet, 
     AssignmentViewSet, 
     PlagiarismResultViewSet,
+    PlagiarismCheckJobViewSet,
     CheckPlagiarismView,
+    MetricsView,
     UserProfileView
 )
 
@@ -12,9 +14,11 @@ router = DefaultRouter()
 router.register(r'courses', CourseViewSet)
 router.register(r'assignments', AssignmentViewSet)
 router.register(r'results', PlagiarismResultViewSet)
+router.register(r'check-plagiarism/jobs', PlagiarismCheckJobViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
     path('check-plagiarism/', CheckPlagiarismView.as_view(), name='check-plagiarism'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('profile/', UserProfileView.as_view(), name='user-profile'),
 ]
@@ -1,18 +1,30 @@
 from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.db.models import Prefetch, Q
+from django.utils.crypto import constant_time_compare
 
-from detector.models import Course, Assignment, PlagiarismResult, PlagiarismMatch
-from detector.utils.plagiarism_detector import PlagiarismDetector
+from detector.models import Course, Assignment, PlagiarismResult, PlagiarismCheckJob
+from detector.jobs import enqueue_plagiarism_check, cancel_job, requeue_stale_extraction
+from detector.metrics import record_request, render_prometheus
+from detector.utils.instrumentation import StageMetrics
+from .pagination import AssignmentPagination, PlagiarismResultPagination
 from .serializers import (
     CourseSerializer, 
     AssignmentSerializer, 
+    AssignmentListSerializer,
     AssignmentCreateSerializer,
     PlagiarismResultSerializer,
+    PlagiarismResultListSerializer,
+    PlagiarismCheckJobSerializer,
     CheckPlagiarismSerializer,
+    CourseSimilaritySerializer,
+    MatchFragmentsSerializer,
     UserSerializer
 )
 
@@ -30,6 +42,18 @@ class IsTeacherOrReadOnly(permissions.BasePermission):
         return request.user.is_authenticated and request.user.is_teacher
 
 
+class CanReadMetrics(permissions.BasePermission):
+    """
+    Allow staff users, and scrapers sending PLAGIARISM_METRICS_TOKEN in the
+    X-Metrics-Token header when it is set.
+    """
+    def has_permission(self, request, view):
+        if request.user.is_authenticated and request.user.is_staff:
+            return True
+        token = settings.PLAGIARISM_METRICS_TOKEN
+        return bool(token) and constant_time_compare(request.headers.get('X-Metrics-Token', ''), token)
+
+
 class UserProfileView(APIView):
     """View for retrieving and updating user profile"""
     permission_classes = [permissions.IsAuthenticated]
@@ -57,14 +81,42 @@ class CourseViewSet(viewsets.ModelViewSet):
         if user.is_authenticated:
             if user.is_teacher:
                 # Teachers can see their own courses
-                return Course.objects.filter(teacher=user)
+                return Course.objects.filter(teacher=user).select_related('teacher')
             else:
                 # Students can see all courses (read-only)
-                return Course.objects.all()
+                return Course.objects.select_related('teacher')
         return Course.objects.none()
     
     def perform_create(self, serializer):
         serializer.save(teacher=self.request.user)
+    
+    @action(detail=True, methods=['get', 'post'])
+    def similarity(self, request, pk=None):
+        """Pairwise similarity overview of the course, recomputed on POST"""
+        # The detection stack is loaded on first use rather than with the URLconf
+        from detector.services import compute_course_similarity, summarize_course_similarity
+        
+        course = self.get_object()
+        if course.teacher != request.user:
+            return Response({"detail": "Only the course teacher can view its similarity overview."},
+                            status=status.HTTP_403_FORBIDDEN)
+        
+        serializer = CourseSimilaritySerializer(
+            data=request.query_params if request.method == 'GET' else request.data
+        )
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        if request.method == 'POST':
+            matrix = compute_course_similarity(course)
+        else:
+            matrix = course.similarity_matrices.order_by('-computed_at').first()
+            if matrix is None:
+                return Response({"detail": "The course similarity has not been computed yet."},
+                                status=status.HTTP_404_NOT_FOUND)
+        
+        return Response(summarize_course_similarity(matrix, **serializer.validated_data),
+                        status=status.HTTP_201_CREATED if request.method == 'POST' else status.HTTP_200_OK)
 
 
 class AssignmentViewSet(viewsets.ModelViewSet):
@@ -72,10 +124,13 @@ class AssignmentViewSet(viewsets.ModelViewSet):
     queryset = Assignment.objects.all()
     permission_classes = [permissions.IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    pagination_class = AssignmentPagination
     
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return AssignmentCreateSerializer
+        if self.action == 'list':
+            return AssignmentListSerializer
         return AssignmentSerializer
     
     def get_queryset(self):
@@ -83,11 +138,25 @@ class AssignmentViewSet(viewsets.ModelViewSet):
         if user.is_authenticated:
             if user.is_teacher:
                 # Teachers can see assignments in their courses
-                return Assignment.objects.filter(course__teacher=user)
+                queryset = Assignment.objects.filter(course__teacher=user)
             else:
                 # Students can see their own assignments
-                return Assignment.objects.filter(uploaded_by=user)
-        return Assignment.objects.none()
+                queryset = Assignment.objects.filter(uploaded_by=user)
+        else:
+            return Assignment.objects.none()
+        
+        # The extracted text is never serialized, and can be large
+        queryset = queryset.select_related('course', 'uploaded_by').defer('content_text')
+        if self.action == 'list':
+            course = self.request.query_params.get('course')
+            if course and course.isdigit():
+                queryset = queryset.filter(course_id=course)
+            queryset = queryset.order_by('-created_at', '-id')
+        elif self.action == 'retrieve':
+            queryset = queryset.prefetch_related(
+                Prefetch('plagiarism_results', queryset=PlagiarismResult.objects.prefetch_related('matches'))
+            )
+        return queryset
 
 
 class PlagiarismResultViewSet(viewsets.ReadOnlyModelViewSet):
@@ -95,99 +164,132 @@ class PlagiarismResultViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = PlagiarismResult.objects.all()
     serializer_class = PlagiarismResultSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PlagiarismResultPagination
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return PlagiarismResultListSerializer
+        return PlagiarismResultSerializer
     
     def get_queryset(self):
         user = self.request.user
         if user.is_authenticated:
             if user.is_teacher:
                 # Teachers can see results for assignments in their courses
-                return PlagiarismResult.objects.filter(assignment__course__teacher=user)
+                queryset = PlagiarismResult.objects.filter(assignment__course__teacher=user)
             else:
                 # Students can see results for their own assignments
-                return PlagiarismResult.objects.filter(assignment__uploaded_by=user)
-        return PlagiarismResult.objects.none()
+                queryset = PlagiarismResult.objects.filter(assignment__uploaded_by=user)
+        else:
+            return PlagiarismResult.objects.none()
+        
+        if self.action == 'list':
+            # Metrics and matches are left out of the list
+            return queryset.select_related('assignment').only(
+                'id', 'assignment', 'assignment__title', 'assignment__student_name', 'overall_score',
+                'match_count', 'compare_with_course', 'compare_with_all', 'previous_result', 'processed_at'
+            ).order_by('-processed_at', '-id')
+        return queryset.prefetch_related('matches')
+    
+    @action(detail=True, methods=['get'])
+    def fragments(self, request, pk=None):
+        """Copied passages of the result's matches, cut from the checked and source texts"""
+        from detector.services import render_match_fragments
+        
+        serializer = MatchFragmentsSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(render_match_fragments(
+            self.get_object(),
+            request.user,
+            context=serializer.validated_data['context'],
+            match_id=serializer.validated_data.get('match')
+        ))
 
 
 class CheckPlagiarismView(APIView):
-    """View for checking plagiarism on an assignment"""
+    """View for queueing a plagiarism check on an assignment"""
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request):
-        serializer = CheckPlagiarismSerializer(data=request.data)
-        if serializer.is_valid():
+        metrics = StageMetrics()
+        try:
+            return self.queue_check(request, metrics)
+        finally:
+            record_request(metrics)
+    
+    def queue_check(self, request, metrics):
+        with metrics.stage('validation'):
+            serializer = CheckPlagiarismSerializer(data=request.data)
+            valid = serializer.is_valid()
+        if valid:
             assignment_id = serializer.validated_data['assignment_id']
             compare_with_course = serializer.validated_data['compare_with_course']
             compare_with_all = serializer.validated_data['compare_with_all']
+            incremental = serializer.validated_data['incremental']
+            # Profiling slows the check down, only staff can ask for it outside DEBUG
+            profile = serializer.validated_data['profile'] and (settings.DEBUG or request.user.is_staff)
             
             # Get the assignment to check
-            assignment = get_object_or_404(Assignment, id=assignment_id)
+            with metrics.stage('loading_assignment'):
+                assignment = get_object_or_404(Assignment.objects.select_related('course'), id=assignment_id)
             
             # Check permissions
-            if not (request.user.is_teacher and assignment.course.teacher == request.user) and assignment.uploaded_by != request.user:
+            if not (request.user.is_teacher and assignment.course.teacher_id == request.user.id) and assignment.uploaded_by_id != request.user.id:
                 return Response({"detail": "You do not have permission to check this assignment."}, 
                                 status=status.HTTP_403_FORBIDDEN)
             
-            # Get reference assignments to compare with
-            reference_assignments = []
+            if assignment.extraction_status != Assignment.EXTRACTION_READY:
+                requeue_stale_extraction(assignment)
+                return Response({"detail": f"The assignment text is not available yet (extraction {assignment.extraction_status})."},
+                                status=status.HTTP_409_CONFLICT)
             
-            if compare_with_course:
-                # Compare with other assignments in the same course
-                course_assignments = Assignment.objects.filter(
-                    course=assignment.course
-                ).exclude(id=assignment.id)
-                reference_assignments.extend(course_assignments)
-            
-            if compare_with_all:
-                # Compare with all assignments
-                all_assignments = Assignment.objects.exclude(
-                    Q(id=assignment.id) | Q(id__in=[a.id for a in reference_assignments])
-                )
-                reference_assignments.extend(all_assignments)
-            
-            # Prepare reference texts for plagiarism detection
-            reference_texts = []
-            for ref_assignment in reference_assignments:
-                if ref_assignment.content_text:
-                    source_info = {
-                        'id': ref_assignment.id,
-                        'title': ref_assignment.title,
-                        'student_name': ref_assignment.student_name,
-                        'type': 'assignment'
-                    }
-                    reference_texts.append((ref_assignment.content_text, source_info))
-            
-            # Initialize plagiarism detector
-            detector = PlagiarismDetector()
-            
-            # Detect plagiarism
-            result = detector.detect_plagiarism(assignment.content_text, reference_texts)
-            
-            # Save the result to the database
-            plagiarism_result = PlagiarismResult.objects.create(
-                assignment=assignment,
-                overall_score=result['overall_score']
-            )
-            
-            # Save individual matches
-            for match in result['matches']:
-                source_info = match['source_info']
-                source_assignment = None
-                
-                if source_info['type'] == 'assignment':
-                    source_assignment_id = source_info['id']
-                    source_assignment = Assignment.objects.get(id=source_assignment_id)
-                
-                PlagiarismMatch.objects.create(
-                    result=plagiarism_result,
-                    source_type=source_info['type'],
-                    source_name=source_info['title'],
-                    source_assignment=source_assignment,
-                    similarity_score=match['similarity_score'],
-                    matched_text="\n".join([m['text1_sentence'] for m in match['sentence_matches'][:5]])
+            # Queue the check, reusing an identical one that is still in flight
+            with metrics.stage('enqueueing'):
+                job, created = enqueue_plagiarism_check(
+                    assignment, request.user,
+                    compare_with_course=compare_with_course,
+                    compare_with_all=compare_with_all,
+                    incremental=incremental,
+                    profile=profile
                 )
             
-            # Return the result
-            result_serializer = PlagiarismResultSerializer(plagiarism_result)
-            return Response(result_serializer.data)
+            with metrics.stage('serialization'):
+                job_serializer = PlagiarismCheckJobSerializer(job)
+                data = job_serializer.data
+            return Response(data, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsView(APIView):
+    """View exporting plagiarism check metrics in the Prometheus text format"""
+    permission_classes = [CanReadMetrics]
+    
+    def get(self, request):
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class PlagiarismCheckJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for following and cancelling queued plagiarism checks"""
+    queryset = PlagiarismCheckJob.objects.all()
+    serializer_class = PlagiarismCheckJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_authenticated:
+            # Users can follow the checks they requested, teachers also those in their courses
+            return PlagiarismCheckJob.objects.filter(
+                Q(requested_by=user) | Q(assignment__course__teacher=user)
+            ).distinct()
+        return PlagiarismCheckJob.objects.none()
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        job = self.get_object()
+        if not cancel_job(job):
+            return Response({"detail": f"Job is already {job.status}."},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(PlagiarismCheckJobSerializer(job).data)
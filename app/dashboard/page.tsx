@@ -12,6 +12,7 @@ export default function DashboardPage() {
   const { user } = useAuth()
   const [stats, setStats] = useState({
     assignments: 0,
+    moreAssignments: false,
     courses: 0,
     recentResults: [],
     isLoading: true,
@@ -21,6 +22,8 @@ export default function DashboardPage() {
   useEffect(() => {
     const fetchDashboardData = async () => {
       try {
+        // Assignment and result lists are cursor-paginated: { next, previous, results },
+        // newest first
         const [assignments, courses, results] = await Promise.all([
           assignmentsAPI.getAssignments(),
           coursesAPI.getCourses(),
@@ -28,9 +31,10 @@ export default function DashboardPage() {
         ])
 
         setStats({
-          assignments: assignments.length,
+          assignments: assignments.results.length,
+          moreAssignments: assignments.next !== null,
           courses: courses.length,
-          recentResults: results.slice(0, 5),
+          recentResults: results.results.slice(0, 5),
           isLoading: false,
           error: null,
         })
@@ -69,7 +73,9 @@ export default function DashboardPage() {
             <FileText className="h-4 w-4 text-muted-foreground" />
           </CardHeader>
           <CardContent>
-            <div className="text-2xl font-bold">{stats.isLoading ? "..." : stats.assignments}</div>
+            <div className="text-2xl font-bold">
+              {stats.isLoading ? "..." : `${stats.assignments}${stats.moreAssignments ? "+" : ""}`}
+            </div>
             <p className="text-xs text-muted-foreground mt-1">
               {user?.is_teacher ? "Submitted by students" : "Uploaded by you"}
             </p>
@@ -139,9 +145,9 @@ export default function DashboardPage() {
                           <SeverityIcon className="h-5 w-5" />
                         </div>
                         <div>
-                          <h3 className="font-medium">{result.assignment.title}</h3>
+                          <h3 className="font-medium">{result.assignment_title}</h3>
                           <p className="text-sm text-slate-500">
-                            {result.assignment.student_name || "Unknown student"}
+                            {result.student_name || "Unknown student"}
                           </p>
                         </div>
                       </div>
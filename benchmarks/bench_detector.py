@@ -0,0 +1,181 @@
+"""
+Benchmarks for the plagiarism detection engine
+
+Times the detector's main stages on synthetic corpora of several sizes and
+writes throughput, latency percentiles and peak memory to a JSON file that a
+later run can be compared against:
+
+    python -m benchmarks.bench_detector --output baseline.json
+    python -m benchmarks.bench_detector --baseline baseline.json --output current.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from detector.utils.corpus_index import CorpusIndex
+from detector.utils.plagiarism_detector import PlagiarismDetector
+
+from .corpus import generate_corpus
+
+
+def measure(func, calls, repeat=1):
+    """
+    Time func(*args) for every args tuple in calls
+    
+    Peak memory is measured in a separate pass, as tracing allocations slows
+    the timed pass down.
+    """
+    latencies = []
+    for _ in range(repeat):
+        for args in calls:
+            started = time.perf_counter()
+            func(*args)
+            latencies.append(time.perf_counter() - started)
+    
+    tracemalloc.start()
+    for args in calls:
+        func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    latencies = np.array(latencies)
+    return {
+        'calls': len(latencies),
+        'total_seconds': float(latencies.sum()),
+        'throughput_per_second': float(len(latencies) / latencies.sum()) if latencies.sum() else None,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'peak_memory_bytes': int(peak),
+    }
+
+
+def run_scale(detector, num_documents, args):
+    """Run every benchmark on a corpus of num_documents documents"""
+    documents = generate_corpus(
+        num_documents,
+        sentences_per_document=args.sentences,
+        copy_ratio=args.copy_ratio,
+        seed=args.seed
+    )
+    query = documents[-1]
+    references = [(text, {'id': i, 'title': f'Document {i}', 'type': 'assignment'})
+                  for i, text in enumerate(documents[:-1])]
+    pairs = [(query, text) for text in documents[:-1]][:args.max_pairs]
+    
+    index = CorpusIndex()
+    index.add_many((i, text) for i, text in enumerate(documents[:-1]))
+    
+    def detect_plagiarism_indexed(text, reference_texts):
+        return detector.detect_plagiarism(text, reference_texts, corpus_index=index)
+    
+    results = {
+        # Uncached, preprocess_text would only measure memoized lookups
+        'preprocess_text': measure(detector.normalizer.apply, [(text,) for text in documents]),
+        'fingerprint_text': measure(detector.fingerprint_text, [(text,) for text in documents]),
+        'calculate_similarity': measure(detector.calculate_similarity, pairs),
+        'find_matching_sentences': measure(detector.find_matching_sentences, pairs),
+        'detect_plagiarism': measure(detector.detect_plagiarism, [(query, references)],
+                                     repeat=args.repeat),
+        'detect_plagiarism_indexed': measure(detect_plagiarism_indexed, [(query, references)],
+                                             repeat=args.repeat),
+    }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print p50 latency changes against a baseline run
+    
+    Returns:
+        list: Names of the benchmarks slower than the baseline by more than tolerance
+    """
+    regressions = []
+    for scale, benchmarks in results['scales'].items():
+        for name, current in benchmarks.items():
+            previous = baseline.get('scales', {}).get(scale, {}).get(name)
+            if not previous or not previous['p50_ms']:
+                continue
+            ratio = current['p50_ms'] / previous['p50_ms']
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  REGRESSION'
+                regressions.append(f'{scale}/{name}')
+            print(f"{scale:>6} {name:<26} {previous['p50_ms']:10.3f}ms -> "
+                  f"{current['p50_ms']:10.3f}ms  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 50, 200],
+                        help='Corpus sizes (number of documents) to benchmark')
+    parser.add_argument('--sentences', type=int, default=40,
+                        help='Sentences per synthetic document')
+    parser.add_argument('--copy-ratio', type=float, default=0.2,
+                        help='Fraction of sentences copied from other documents')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Repetitions of the full detect_plagiarism run')
+    parser.add_argument('--max-pairs', type=int, default=50,
+                        help='Cap on document pairs timed by the pairwise benchmarks')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative p50 slowdown before a benchmark counts as a regression')
+    args = parser.parse_args(argv)
+    
+    detector = PlagiarismDetector()
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'parameters': {
+            'sentences': args.sentences,
+            'copy_ratio': args.copy_ratio,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'max_pairs': args.max_pairs,
+        },
+        'scales': {},
+    }
+    
+    for num_documents in args.scales:
+        scale_results = run_scale(detector, num_documents, args)
+        results['scales'][str(num_documents)] = scale_results
+        for name, result in scale_results.items():
+            print(f"{num_documents:>6} {name:<26} p50 {result['p50_ms']:10.3f}ms  "
+                  f"p95 {result['p95_ms']:10.3f}ms  "
+                  f"{result['throughput_per_second']:10.1f}/s  "
+                  f"peak {result['peak_memory_bytes'] / 1024 / 1024:8.2f}MiB")
+    
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        print()
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
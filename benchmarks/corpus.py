@@ -0,0 +1,52 @@
+import random
+
+
+def make_vocabulary(size, rng):
+    """Create pronounceable pseudo-words so the corpus does not depend on any dictionary"""
+    consonants = 'bcdfghjklmnprstvwz'
+    vowels = 'aeiou'
+    vocabulary = set()
+    while len(vocabulary) < size:
+        syllables = rng.randint(1, 4)
+        vocabulary.add(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(syllables)))
+    return sorted(vocabulary)
+
+
+def make_sentence(vocabulary, rng, min_words=6, max_words=20):
+    words = [rng.choice(vocabulary) for _ in range(rng.randint(min_words, max_words))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def generate_corpus(num_documents, sentences_per_document=40, copy_ratio=0.2,
+                    vocabulary_size=5000, seed=0):
+    """
+    Generate a synthetic corpus with injected copying
+    
+    Each document is made of random sentences, except that roughly
+    `copy_ratio` of its sentences are copied verbatim from earlier documents.
+    
+    Args:
+        num_documents (int): Number of documents
+        sentences_per_document (int): Sentences per document
+        copy_ratio (float): Fraction of sentences copied from other documents
+        vocabulary_size (int): Number of distinct words
+        seed (int): Seed making the corpus reproducible
+        
+    Returns:
+        list: Document texts
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    documents = []
+    
+    for _ in range(num_documents):
+        sentences = []
+        for _ in range(sentences_per_document):
+            if documents and rng.random() < copy_ratio:
+                source = rng.choice(documents)
+                sentences.append(rng.choice(source))
+            else:
+                sentences.append(make_sentence(vocabulary, rng))
+        documents.append(sentences)
+    
+    return [' '.join(sentences) for sentences in documents]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Course, Assignment, PlagiarismResult, PlagiarismMatch
+from .models import Course, Assignment, PlagiarismResult, PlagiarismMatch, PlagiarismCheckJob
 
 
 class PlagiarismMatchInline(admin.TabularInline):
@@ -29,6 +29,11 @@ class AssignmentInline(admin.TabularInline):
     extra = 0
 
 
+class PlagiarismCheckJobAdmin(admin.ModelAdmin):
+    list_display = ('assignment', 'requested_by', 'status', 'progress', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+
+
 class CourseAdmin(admin.ModelAdmin):
     list_display = ('name', 'code', 'teacher', 'created_at')
     list_filter = ('teacher', 'created_at')
@@ -40,3 +45,4 @@ admin.site.register(Course, CourseAdmin)
 admin.site.register(Assignment, AssignmentAdmin)
 admin.site.register(PlagiarismResult, PlagiarismResultAdmin)
 admin.site.register(PlagiarismMatch)
+admin.site.register(PlagiarismCheckJob, PlagiarismCheckJobAdmin)
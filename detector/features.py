@@ -0,0 +1,140 @@
+import hashlib
+import json
+
+import numpy as np
+import scipy.sparse as sp
+from django.db import IntegrityError
+
+from .models import Assignment, AssignmentFeatures
+from .utils.corpus_index import get_corpus_index
+from .utils.plagiarism_detector import (
+    DocumentFeatures,
+    PlagiarismDetector,
+    fingerprint_from_bytes,
+    fingerprint_to_bytes
+)
+
+
+# Assignments whose features are recomputed per query when refreshing
+REFRESH_BATCH_SIZE = 100
+
+FEATURE_FIELDS = (
+    'config_hash', 'sentence_spans', 'fingerprint', 'fingerprint_positions', 'vector_indices', 'vector_data',
+)
+
+
+def get_config_hash(detector, index=None):
+    """Hash the parameters features are computed with, stored features with another hash are stale"""
+    index = index or get_corpus_index()
+    config = dict(detector.feature_config(), n_features=index.n_features)
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def compute_features(assignment, detector, index, config_hash):
+    """Compute the (unsaved) features of an assignment from its content_text"""
+    text = assignment.content_text
+    spans = np.asarray(detector.sentence_spans(text), dtype='<i4').reshape(-1, 2)
+    row = index.vectorize(text).tocsr()
+    row.sum_duplicates()
+    fingerprint, positions = detector.fingerprint_with_positions(text)
+    
+    return AssignmentFeatures(
+        assignment=assignment,
+        config_hash=config_hash,
+        sentence_spans=spans.tobytes(),
+        fingerprint=fingerprint_to_bytes(fingerprint),
+        fingerprint_positions=positions.astype('<i4').tobytes(),
+        vector_indices=row.indices.astype('<i4').tobytes(),
+        vector_data=row.data.astype('<f4').tobytes(),
+    )
+
+
+def store_features(assignment, detector=None):
+    """
+    Compute and save the features of an assignment, replacing stale ones
+    
+    Features of another upload of the same file are copied rather than
+    recomputed.
+    
+    Returns:
+        AssignmentFeatures: The saved features
+    """
+    detector = detector or PlagiarismDetector()
+    index = get_corpus_index()
+    config_hash = get_config_hash(detector, index)
+    
+    features = None
+    if assignment.content_hash:
+        features = AssignmentFeatures.objects.filter(
+            assignment__content_hash=assignment.content_hash,
+            assignment__content_text=assignment.content_text,
+            config_hash=config_hash
+        ).exclude(assignment_id=assignment.id).first()
+    if features is None:
+        features = compute_features(assignment, detector, index, config_hash)
+    
+    # Single statements rather than update_or_create, which holds a read lock
+    # while it decides and deadlocks concurrent extractions on SQLite
+    values = {field: getattr(features, field) for field in FEATURE_FIELDS}
+    if not AssignmentFeatures.objects.filter(assignment_id=assignment.id).update(**values):
+        try:
+            return AssignmentFeatures.objects.create(assignment_id=assignment.id, **values)
+        except IntegrityError:
+            # Stored concurrently by another worker
+            AssignmentFeatures.objects.filter(assignment_id=assignment.id).update(**values)
+    return AssignmentFeatures(assignment_id=assignment.id, **values)
+
+
+def refresh_features(assignments, detector=None):
+    """
+    Compute the missing or stale features of the assignments in a queryset
+    
+    Returns:
+        int: Number of assignments whose features were computed
+    """
+    detector = detector or PlagiarismDetector()
+    config_hash = get_config_hash(detector)
+    stale_ids = list(
+        assignments.exclude(content_text='')
+        .exclude(features__config_hash=config_hash)
+        .values_list('id', flat=True)
+    )
+    
+    for start in range(0, len(stale_ids), REFRESH_BATCH_SIZE):
+        batch = Assignment.objects.filter(id__in=stale_ids[start:start + REFRESH_BATCH_SIZE])
+        for assignment in list(batch.only('id', 'content_hash', 'content_text')):
+            store_features(assignment, detector)
+    
+    return len(stale_ids)
+
+
+def get_document_features(assignment, detector):
+    """Return the DocumentFeatures of an assignment, computing them if needed"""
+    features = AssignmentFeatures.objects.filter(
+        assignment_id=assignment.id, config_hash=get_config_hash(detector)
+    ).first()
+    if features is None:
+        features = store_features(assignment, detector)
+    return load_document_features(features, assignment.content_text)
+
+
+def load_document_features(features, text):
+    """Rebuild the detector's DocumentFeatures from stored features and the text they describe"""
+    return DocumentFeatures(
+        load_sentences(features, text),
+        fingerprint_from_bytes(features.fingerprint),
+        fingerprint_positions=np.frombuffer(features.fingerprint_positions, dtype='<i4').reshape(-1, 2)
+    )
+
+
+def load_sentences(features, text):
+    """Cut the sentences of stored features out of the text they describe"""
+    spans = np.frombuffer(features.sentence_spans, dtype='<i4').reshape(-1, 2)
+    return [text[start:end] for start, end in spans.tolist()]
+
+
+def load_vector(features, n_features):
+    """Rebuild the hashed term counts of stored features as a 1 x n_features CSR row"""
+    indices = np.frombuffer(features.vector_indices, dtype='<i4')
+    data = np.frombuffer(features.vector_data, dtype='<f4')
+    return sp.csr_matrix((data, indices, [0, len(indices)]), shape=(1, n_features))
@@ -0,0 +1,461 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Assignment, PlagiarismCheckJob
+
+
+logger = logging.getLogger(__name__)
+
+
+# Minimum number of seconds between two progress writes of the same job
+PROGRESS_INTERVAL = 1.0
+
+
+# Error recorded on running jobs failed by fail_stale_jobs
+STALE_JOB_ERROR = "The check stopped responding, most likely because its process was restarted"
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled"""
+
+
+class Heartbeat:
+    """
+    Write a running job's heartbeat from a background thread
+    
+    The heartbeat is written a few times per PLAGIARISM_JOB_STALE_AFTER for
+    as long as the job runs, so long stages without progress updates, such
+    as refreshing the features of the whole archive, never make it stale.
+    """
+    
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.interval = max(settings.PLAGIARISM_JOB_STALE_AFTER / 4, 1)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'plagiarism-heartbeat-{job_id}', daemon=True)
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+    
+    def _run(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    PlagiarismCheckJob.objects.filter(
+                        id=self.job_id, status=PlagiarismCheckJob.STATUS_RUNNING
+                    ).update(heartbeat_at=timezone.now())
+                except Exception:
+                    logger.exception("Error writing the heartbeat of job %s", self.job_id)
+        finally:
+            # The thread's own connection
+            connection.close()
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_recovered_pid = None
+
+
+def get_executor():
+    """
+    Return the process-wide pool running background jobs, or None if disabled
+    
+    A process forked after the pool was created gets a pool of its own, since
+    the threads of the parent's do not exist in it.
+    """
+    global _executor, _executor_pid
+    
+    if settings.PLAGIARISM_JOB_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor_pid = os.getpid()
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PLAGIARISM_JOB_WORKERS,
+                thread_name_prefix='plagiarism-job'
+            )
+        return _executor
+
+
+def enqueue_plagiarism_check(assignment, user, compare_with_course=True, compare_with_all=False,
+                             incremental=False, profile=False):
+    """
+    Queue a plagiarism check of an assignment
+    
+    An identical check that is still queued or running is reused instead of
+    starting a second one. Stale running jobs are failed first, so they are
+    never reused, and a reused job queued for longer than
+    PLAGIARISM_JOB_STALE_AFTER is handed to this process's pool again in case
+    the process that queued it stopped.
+    
+    Returns:
+        tuple: (job, created)
+    """
+    fail_stale_jobs()
+    existing = PlagiarismCheckJob.objects.filter(
+        assignment=assignment,
+        compare_with_course=compare_with_course,
+        compare_with_all=compare_with_all,
+        incremental=incremental,
+        profile=profile,
+        status__in=PlagiarismCheckJob.ACTIVE_STATUSES
+    ).order_by('created_at').first()
+    executor = get_executor()
+    if existing is not None:
+        if executor is not None and existing.status == PlagiarismCheckJob.STATUS_QUEUED \
+                and existing.created_at < stale_cutoff():
+            executor.submit(run_in_thread, run_job, existing.id)
+        return existing, False
+    
+    job = PlagiarismCheckJob.objects.create(
+        assignment=assignment,
+        requested_by=user,
+        compare_with_course=compare_with_course,
+        compare_with_all=compare_with_all,
+        incremental=incremental,
+        profile=profile
+    )
+    
+    # Without an in-process pool, jobs are picked up by run_plagiarism_worker
+    if executor is not None:
+        transaction.on_commit(lambda: executor.submit(run_in_thread, run_job, job.id))
+    
+    return job, True
+
+
+def cancel_job(job):
+    """
+    Cancel a queued or running job
+    
+    A running job stops at its next progress update.
+    
+    Returns:
+        bool: Whether the job was still active
+    """
+    cancelled = PlagiarismCheckJob.objects.filter(
+        id=job.id, status__in=PlagiarismCheckJob.ACTIVE_STATUSES
+    ).update(status=PlagiarismCheckJob.STATUS_CANCELLED, finished_at=timezone.now())
+    job.refresh_from_db()
+    return bool(cancelled)
+
+
+def stale_cutoff():
+    """Return the time before which a job's last heartbeat makes it stale"""
+    return timezone.now() - timedelta(seconds=settings.PLAGIARISM_JOB_STALE_AFTER)
+
+
+def fail_stale_jobs():
+    """
+    Fail running jobs whose heartbeat is older than PLAGIARISM_JOB_STALE_AFTER
+    
+    The heartbeat is written by the job's Heartbeat thread, so such a job
+    was left running by a process that crashed or restarted.
+    
+    Returns:
+        int: Number of jobs failed
+    """
+    failed = PlagiarismCheckJob.objects.filter(
+        status=PlagiarismCheckJob.STATUS_RUNNING, heartbeat_at__lt=stale_cutoff()
+    ).update(
+        status=PlagiarismCheckJob.STATUS_FAILED,
+        error=STALE_JOB_ERROR,
+        finished_at=timezone.now()
+    )
+    if failed:
+        logger.warning("Failed %d stale plagiarism check jobs", failed)
+    return failed
+
+
+def recover_jobs():
+    """
+    Fail stale running jobs and hand queued ones to the in-process pool
+    
+    Called when a process starts, so jobs left behind by a process that
+    stopped are not reported as active forever. Without an in-process pool,
+    queued jobs are picked up by run_plagiarism_worker.
+    
+    Returns:
+        tuple: (jobs failed, jobs requeued)
+    """
+    failed = fail_stale_jobs()
+    executor = get_executor()
+    if executor is None:
+        return failed, 0
+    
+    queued = list(PlagiarismCheckJob.objects.filter(
+        status=PlagiarismCheckJob.STATUS_QUEUED
+    ).order_by('created_at').values_list('id', flat=True))
+    for job_id in queued:
+        executor.submit(run_in_thread, run_job, job_id)
+    return failed, len(queued)
+
+
+def recover_on_first_request(**kwargs):
+    """
+    request_started receiver recovering extractions and jobs once per process
+    
+    Recovery runs on the pool from the first request a process handles, so
+    that servers forking workers after loading the application (such as
+    gunicorn --preload) recover in each worker rather than in the parent.
+    """
+    global _recovered_pid
+    
+    executor = get_executor()
+    if executor is None:
+        # run_plagiarism_worker recovers the queue when it starts
+        return
+    with _executor_lock:
+        if _recovered_pid == os.getpid():
+            return
+        _recovered_pid = os.getpid()
+    executor.submit(run_in_thread, recover)
+
+
+def recover():
+    """Recover the extractions and jobs left behind by stopped processes"""
+    recover_extractions()
+    recover_jobs()
+
+
+def claim_job(job_id):
+    """Mark a queued job as running, unless another worker already took it"""
+    now = timezone.now()
+    return PlagiarismCheckJob.objects.filter(
+        id=job_id, status=PlagiarismCheckJob.STATUS_QUEUED
+    ).update(status=PlagiarismCheckJob.STATUS_RUNNING, started_at=now, heartbeat_at=now) == 1
+
+
+def run_job(job_id):
+    """Run a queued job to completion, recording its outcome on the job"""
+    # The detection stack (NumPy, SciPy, scikit-learn) is imported by the jobs
+    # using it, so processes that only queue work start without it
+    from .services import run_plagiarism_check
+    
+    if not claim_job(job_id):
+        return
+    
+    job = PlagiarismCheckJob.objects.select_related('assignment__course').get(id=job_id)
+    last_update = [0.0]
+    
+    def progress(done, total):
+        now = time.monotonic()
+        if done < total and now - last_update[0] < PROGRESS_INTERVAL:
+            return
+        last_update[0] = now
+        
+        updated = PlagiarismCheckJob.objects.filter(
+            id=job_id, status=PlagiarismCheckJob.STATUS_RUNNING
+        ).update(progress=done / total * 100, heartbeat_at=timezone.now())
+        if not updated:
+            raise JobCancelled()
+    
+    try:
+        with Heartbeat(job_id):
+            result = run_plagiarism_check(
+                job.assignment,
+                compare_with_course=job.compare_with_course,
+                compare_with_all=job.compare_with_all,
+                progress=progress,
+                incremental=job.incremental,
+                profile=job.profile
+            )
+    except JobCancelled:
+        return
+    except Exception as e:
+        PlagiarismCheckJob.objects.filter(
+            id=job_id, status=PlagiarismCheckJob.STATUS_RUNNING
+        ).update(
+            status=PlagiarismCheckJob.STATUS_FAILED,
+            error=str(e),
+            finished_at=timezone.now()
+        )
+        return
+    
+    # Only complete jobs that were not cancelled in the meantime
+    finished = PlagiarismCheckJob.objects.filter(
+        id=job_id, status=PlagiarismCheckJob.STATUS_RUNNING
+    ).update(
+        status=PlagiarismCheckJob.STATUS_COMPLETED,
+        progress=100,
+        result=result,
+        finished_at=timezone.now()
+    )
+    if not finished:
+        result.delete()
+
+
+def enqueue_extraction(assignment):
+    """Queue text extraction and indexing of a newly uploaded assignment"""
+    # Without an in-process pool, extraction is picked up by run_plagiarism_worker
+    executor = get_executor()
+    if executor is not None:
+        transaction.on_commit(lambda: executor.submit(run_in_thread, run_extraction, assignment.id))
+
+
+def extraction_cutoff():
+    """
+    Return the time before which a running or pending extraction is stale
+    
+    Extractions may take up to PLAGIARISM_PDF_TIMEOUT, so they are given the
+    longer of that and PLAGIARISM_JOB_STALE_AFTER.
+    """
+    seconds = max(settings.PLAGIARISM_JOB_STALE_AFTER, settings.PLAGIARISM_PDF_TIMEOUT or 0)
+    return timezone.now() - timedelta(seconds=seconds)
+
+
+def stale_extractions(cutoff):
+    """Return the assignments whose extraction started before cutoff and never finished"""
+    return Assignment.objects.filter(
+        Q(extraction_started_at__lt=cutoff) | Q(extraction_started_at__isnull=True),
+        extraction_status=Assignment.EXTRACTION_EXTRACTING
+    )
+
+
+def reset_stale_extractions():
+    """
+    Return extractions left behind by a stopped process to pending
+    
+    Returns:
+        int: Number of assignments reset
+    """
+    reset = stale_extractions(extraction_cutoff()).update(extraction_status=Assignment.EXTRACTION_PENDING)
+    if reset:
+        logger.warning("Reset %d stale text extractions", reset)
+    return reset
+
+
+def recover_extractions():
+    """
+    Reset stale extractions and hand pending ones to the in-process pool
+    
+    Called when a process starts, like recover_jobs, so that uploads whose
+    extraction was lost can still be checked. Without an in-process pool,
+    pending extractions are picked up by run_plagiarism_worker.
+    
+    Returns:
+        tuple: (extractions reset, extractions requeued)
+    """
+    reset = reset_stale_extractions()
+    executor = get_executor()
+    if executor is None:
+        return reset, 0
+    
+    pending = list(Assignment.objects.filter(
+        extraction_status=Assignment.EXTRACTION_PENDING
+    ).order_by('created_at').values_list('id', flat=True))
+    for assignment_id in pending:
+        executor.submit(run_in_thread, run_extraction, assignment_id)
+    return reset, len(pending)
+
+
+def requeue_stale_extraction(assignment):
+    """
+    Queue an assignment's extraction again if it has been waiting too long
+    
+    Called when a check is requested before the text is ready, so that an
+    extraction lost by a process that stopped is not waited for forever.
+    """
+    cutoff = extraction_cutoff()
+    if assignment.extraction_status == Assignment.EXTRACTION_EXTRACTING:
+        reset = stale_extractions(cutoff).filter(id=assignment.id).update(
+            extraction_status=Assignment.EXTRACTION_PENDING
+        )
+        if not reset:
+            return
+    elif assignment.extraction_status != Assignment.EXTRACTION_PENDING or assignment.created_at >= cutoff:
+        return
+    enqueue_extraction(assignment)
+
+
+def run_extraction(assignment_id):
+    """
+    Extract, compute the features of and index the text of a pending assignment
+    
+    The file is read page by page (or paragraph by paragraph) and the pieces
+    are joined once. Time spent and any error are recorded on the assignment.
+    """
+    from .features import load_sentences, load_vector, store_features
+    from .utils.corpus_index import compact_corpus_index, get_corpus_index, update_corpus_index
+    from .utils.lsh_index import compact_lsh_index, update_lsh_index
+    from .utils.plagiarism_detector import fingerprint_from_bytes
+    from .utils.sentence_index import compact_sentence_index, update_sentence_index
+    from .utils.text_extractor import iter_text_from_file
+    
+    claimed = Assignment.objects.filter(
+        id=assignment_id, extraction_status=Assignment.EXTRACTION_PENDING
+    ).update(extraction_status=Assignment.EXTRACTION_EXTRACTING, extraction_started_at=timezone.now())
+    if not claimed:
+        return
+    
+    assignment = Assignment.objects.get(id=assignment_id)
+    started = time.perf_counter()
+    
+    try:
+        # Text is already set when the file is a resubmission
+        if not assignment.content_text:
+            assignment.content_text = "".join(iter_text_from_file(
+                assignment.file.path, assignment.file_type,
+                workers=settings.PLAGIARISM_PDF_WORKERS,
+                max_pages=settings.PLAGIARISM_PDF_MAX_PAGES,
+                timeout=settings.PLAGIARISM_PDF_TIMEOUT
+            ))
+        text = assignment.content_text
+        features = store_features(assignment)
+    except Exception as e:
+        logger.exception("Error extracting text of assignment %s (%s)", assignment_id, assignment.file_name)
+        Assignment.objects.filter(id=assignment_id).update(
+            extraction_status=Assignment.EXTRACTION_FAILED,
+            extraction_error=str(e) or e.__class__.__name__,
+            extraction_duration=time.perf_counter() - started,
+            extracted_at=timezone.now()
+        )
+        return
+    
+    indexed_at = None
+    try:
+        update_corpus_index(assignment_id, row=load_vector(features, get_corpus_index().n_features))
+        update_lsh_index(assignment_id, fingerprint_from_bytes(features.fingerprint))
+        update_sentence_index(assignment_id, load_sentences(features, text))
+        indexed_at = timezone.now()
+        compact_corpus_index()
+        compact_lsh_index()
+        compact_sentence_index()
+    except Exception:
+        # The indexes can be rebuilt with rebuild_corpus_index, the text is still
+        # usable and archive-wide checks compare with it until then
+        logger.exception("Error indexing assignment %s", assignment_id)
+    
+    Assignment.objects.filter(id=assignment_id).update(
+        content_text=text,
+        extraction_status=Assignment.EXTRACTION_READY,
+        extraction_error='',
+        extraction_duration=time.perf_counter() - started,
+        extracted_at=timezone.now(),
+        indexed_at=indexed_at
+    )
+    logger.info("Extracted assignment %s (%s, %d characters) in %.2fs",
+                assignment_id, assignment.file_name, len(text), time.perf_counter() - started)
+
+
+def run_in_thread(func, *args):
+    """Run a job on a pool thread, which needs its own database connection"""
+    close_old_connections()
+    try:
+        func(*args)
+    finally:
+        close_old_connections()
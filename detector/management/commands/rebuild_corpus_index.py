@@ -0,0 +1,81 @@
+import os
+
+import scipy.sparse as sp
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from detector.features import load_sentences, load_vector, refresh_features
+from detector.models import Assignment, AssignmentFeatures
+from detector.utils.corpus_index import CorpusIndex, INDEX_FILE_NAME, get_corpus_index
+from detector.utils.file_lock import file_lock
+from detector.utils.lsh_index import create_lsh_index
+from detector.utils.plagiarism_detector import PlagiarismDetector, fingerprint_from_bytes
+from detector.utils.sentence_index import create_sentence_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the TF-IDF corpus index, the MinHash LSH index and the sentence '
+        'n-gram index from the stored assignment features, computing features '
+        'that are missing or outdated'
+    )
+    
+    def handle(self, *args, **options):
+        refreshed = refresh_features(Assignment.objects.all(), PlagiarismDetector())
+        
+        # Stored vectors were hashed with the shared index's feature count
+        index = CorpusIndex(
+            os.path.join(settings.PLAGIARISM_INDEX_DIR, INDEX_FILE_NAME),
+            n_features=get_corpus_index().n_features
+        )
+        lsh_index = create_lsh_index()
+        sentence_index = create_sentence_index()
+        
+        # Uploads indexed while the rebuild runs wait for it rather than being
+        # overwritten by the rebuilt files
+        with file_lock(index.path), file_lock(lsh_index.path), file_lock(sentence_index.path):
+            started = timezone.now()
+            indexed_ids = []
+            features = AssignmentFeatures.objects.exclude(assignment__content_text='').only(
+                'assignment_id', 'fingerprint', 'vector_indices', 'vector_data', 'sentence_spans',
+                'assignment__content_text'
+            ).select_related('assignment').order_by('assignment_id')
+            batch_size = settings.PLAGIARISM_REFERENCE_CHUNK_SIZE
+            for start in range(0, features.count(), batch_size):
+                batch = list(features[start:start + batch_size])
+                indexed_ids.extend(stored.assignment_id for stored in batch)
+                index.add_rows(
+                    [stored.assignment_id for stored in batch],
+                    sp.vstack([load_vector(stored, index.n_features) for stored in batch])
+                )
+                lsh_index.add_many(
+                    (stored.assignment_id, fingerprint_from_bytes(stored.fingerprint)) for stored in batch
+                )
+                sentence_index.add_many(
+                    (stored.assignment_id, load_sentences(stored, stored.assignment.content_text))
+                    for stored in batch
+                )
+            
+            # The rebuilt indexes cover every segment written so far
+            index.segment = index.last_segment()
+            index.save()
+            lsh_index.segment = lsh_index.last_segment()
+            lsh_index.save()
+            sentence_index.segment = sentence_index.last_segment()
+            sentence_index.save()
+            
+            # Mark what the rebuilt indexes hold, archive-wide checks compare
+            # with everything else
+            for start in range(0, len(indexed_ids), batch_size):
+                Assignment.objects.filter(id__in=indexed_ids[start:start + batch_size]).update(
+                    indexed_at=timezone.now()
+                )
+            Assignment.objects.filter(indexed_at__lt=started).update(indexed_at=None)
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index)} assignments ({len(lsh_index)} with LSH signatures, "
+            f"{len(sentence_index)} by sentence), "
+            f"computed features of {refreshed}"
+        ))
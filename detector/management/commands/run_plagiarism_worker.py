@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from detector.jobs import fail_stale_jobs, reset_stale_extractions, run_extraction, run_job
+from detector.models import Assignment, PlagiarismCheckJob
+from detector.services import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Run pending text extractions and queued plagiarism checks in this process, '
+        'polling the database for new work'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait when no job is queued')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty')
+    
+    def handle(self, *args, **options):
+        warm_up()
+        # Pending extractions and queued jobs are polled for below. Those left
+        # running by a stopped process are reset or failed first.
+        reset_stale_extractions()
+        fail_stale_jobs()
+        while True:
+            # Extract new uploads first, checks need their text
+            assignment_id = Assignment.objects.filter(
+                extraction_status=Assignment.EXTRACTION_PENDING
+            ).order_by('created_at').values_list('id', flat=True).first()
+            
+            if assignment_id is not None:
+                run_extraction(assignment_id)
+                assignment = Assignment.objects.get(id=assignment_id)
+                self.stdout.write(f"Assignment {assignment.id} extraction: {assignment.extraction_status}")
+                continue
+            
+            job_id = PlagiarismCheckJob.objects.filter(
+                status=PlagiarismCheckJob.STATUS_QUEUED
+            ).order_by('created_at').values_list('id', flat=True).first()
+            
+            if job_id is None:
+                if options['once']:
+                    return
+                reset_stale_extractions()
+                fail_stale_jobs()
+                time.sleep(options['poll_interval'])
+                continue
+            
+            run_job(job_id)
+            job = PlagiarismCheckJob.objects.get(id=job_id)
+            self.stdout.write(f"Job {job.id} for assignment {job.assignment_id}: {job.status}")
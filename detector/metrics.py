@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+
+from .models import MetricTotal
+from .utils.instrumentation import peak_memory_bytes
+
+
+# Counters exported by the metrics endpoint, in order, with their help text.
+# Their totals are kept in MetricTotal rows, so every web process reports the
+# same figures and checks run by run_plagiarism_worker are included.
+COUNTERS = (
+    ('plagiarism_checks_total', None, 'Plagiarism checks completed.'),
+    ('plagiarism_check_seconds_total', None, 'Time spent running plagiarism checks.'),
+    ('plagiarism_check_stage_seconds_total', 'stage',
+     'Time spent in each stage of plagiarism checks, summed over worker processes.'),
+    ('plagiarism_check_items_total', 'item',
+     'References, sentence pairs, pair cache lookups and matches processed by plagiarism checks.'),
+    ('plagiarism_check_requests_total', None, 'Plagiarism check requests handled.'),
+    ('plagiarism_check_request_stage_seconds_total', 'stage',
+     'Time spent in each stage of handling plagiarism check requests.'),
+)
+
+
+def _add_totals(increments):
+    """Add {series: amount} to the stored totals in two queries"""
+    increments = {series: amount for series, amount in increments.items() if amount}
+    if not increments:
+        return
+    with transaction.atomic():
+        MetricTotal.objects.bulk_create(
+            [MetricTotal(series=series) for series in increments], ignore_conflicts=True
+        )
+        MetricTotal.objects.filter(series__in=increments).update(value=F('value') + Case(
+            *[When(series=series, then=Value(float(amount))) for series, amount in increments.items()],
+            default=Value(0.0), output_field=FloatField()
+        ))
+
+
+def record_check(metrics):
+    """Add the metrics stored with a PlagiarismResult to the stored totals"""
+    increments = {
+        'plagiarism_checks_total': 1,
+        'plagiarism_check_seconds_total': metrics.get('total_seconds', 0.0),
+    }
+    for stage, seconds in metrics.get('timings', {}).items():
+        increments[f'plagiarism_check_stage_seconds_total{{stage="{stage}"}}'] = seconds
+    for name, value in metrics.get('counters', {}).items():
+        increments[f'plagiarism_check_items_total{{item="{name}"}}'] = value
+    _add_totals(increments)
+
+
+def record_request(metrics):
+    """Add the StageMetrics of one check request to the stored totals"""
+    increments = {'plagiarism_check_requests_total': 1}
+    for stage, seconds in metrics.timings.items():
+        increments[f'plagiarism_check_request_stage_seconds_total{{stage="{stage}"}}'] = seconds
+    _add_totals(increments)
+
+
+def render_prometheus():
+    """
+    Render the stored totals in the Prometheus text exposition format
+    
+    Only the peak memory gauge belongs to the process answering the scrape.
+    """
+    samples = {name: [] for name, _, _ in COUNTERS}
+    for series, value in MetricTotal.objects.order_by('series').values_list('series', 'value'):
+        name, brace, labels = series.partition('{')
+        if name in samples:
+            samples[name].append((brace + labels, value))
+    
+    lines = []
+    
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {value}")
+    
+    for name, label, help_text in COUNTERS:
+        # Unlabelled counters are exported as 0 until something is recorded
+        metric(name, 'counter', help_text, samples[name] or ([] if label else [('', 0)]))
+    
+    peak = peak_memory_bytes()
+    if peak is not None:
+        metric('plagiarism_process_peak_rss_bytes', 'gauge',
+               'Highest resident set size of the process answering this scrape.', [('', peak)])
+    
+    return "\n".join(lines) + "\n"
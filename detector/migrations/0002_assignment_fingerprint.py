@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='fingerprint',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+def mark_extracted_assignments_ready(apps, schema_editor):
+    """Assignments that already have text were extracted before statuses existed"""
+    Assignment = apps.get_model('detector', 'Assignment')
+    Assignment.objects.exclude(content_text='').update(extraction_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0003_plagiarismcheckjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='extracted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='extraction_duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='extraction_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='extraction_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('extracting', 'Extracting'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20),
+        ),
+        migrations.RunPython(mark_extracted_assignments_ready, migrations.RunPython.noop),
+    ]
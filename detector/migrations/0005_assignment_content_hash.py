@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:48
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_existing_files(apps, schema_editor):
+    """Hash the files of existing assignments that are still in storage"""
+    Assignment = apps.get_model('detector', 'Assignment')
+    for assignment in Assignment.objects.exclude(file='').iterator():
+        try:
+            digest = hashlib.sha256()
+            with assignment.file.open('rb') as file:
+                for chunk in file.chunks():
+                    digest.update(chunk)
+        except OSError:
+            continue
+        Assignment.objects.filter(id=assignment.id).update(content_hash=digest.hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0004_assignment_extraction_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.RunPython(hash_existing_files, migrations.RunPython.noop),
+    ]
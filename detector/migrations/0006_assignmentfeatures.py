@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0005_assignment_content_hash'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='assignment',
+            name='fingerprint',
+        ),
+        migrations.CreateModel(
+            name='AssignmentFeatures',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('config_hash', models.CharField(db_index=True, max_length=64)),
+                ('normalized_text', models.TextField(blank=True)),
+                ('sentence_spans', models.BinaryField()),
+                ('fingerprint', models.BinaryField()),
+                ('vector_indices', models.BinaryField()),
+                ('vector_data', models.BinaryField()),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('assignment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='features', to='detector.assignment')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0006_assignmentfeatures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseSimilarityMatrix',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('assignment_ids', models.BinaryField()),
+                ('scores', models.BinaryField()),
+                ('config_hash', models.CharField(max_length=64)),
+                ('duration', models.FloatField()),
+                ('computed_at', models.DateTimeField(auto_now_add=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarity_matrices', to='detector.course')),
+            ],
+        ),
+    ]
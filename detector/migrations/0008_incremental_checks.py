@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0007_coursesimilaritymatrix'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plagiarismcheckjob',
+            name='incremental',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='plagiarismresult',
+            name='compare_with_all',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='plagiarismresult',
+            name='compare_with_course',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='plagiarismresult',
+            name='match_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='plagiarismresult',
+            name='previous_result',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='next_results', to='detector.plagiarismresult'),
+        ),
+        migrations.AddField(
+            model_name='plagiarismresult',
+            name='references_as_of',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0008_incremental_checks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('fingerprint_similarity', models.FloatField()),
+                ('sentence_pairs', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0009_pairsimilarity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plagiarismcheckjob',
+            name='profile',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='plagiarismresult',
+            name='metrics',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
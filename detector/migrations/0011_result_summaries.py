@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_result_summaries(apps, schema_editor):
+    """Copy the newest result and the result count onto assignments that have results"""
+    Assignment = apps.get_model('detector', 'Assignment')
+    PlagiarismResult = apps.get_model('detector', 'PlagiarismResult')
+    latest = {}
+    counts = {}
+    for result in PlagiarismResult.objects.order_by('processed_at', 'id').only(
+        'id', 'assignment_id', 'overall_score'
+    ).iterator():
+        latest[result.assignment_id] = result
+        counts[result.assignment_id] = counts.get(result.assignment_id, 0) + 1
+    for assignment_id, result in latest.items():
+        Assignment.objects.filter(id=assignment_id).update(
+            latest_result=result,
+            latest_score=result.overall_score,
+            result_count=counts[assignment_id]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0010_check_metrics'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='latest_result',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='detector.plagiarismresult'),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='latest_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='assignment',
+            name='result_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['course', '-created_at'], name='assignment_course_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['course', '-latest_score'], name='assignment_course_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['uploaded_by', '-created_at'], name='assignment_uploader_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='plagiarismmatch',
+            index=models.Index(fields=['result', '-similarity_score'], name='match_result_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='plagiarismresult',
+            index=models.Index(fields=['assignment', '-processed_at'], name='result_assignment_latest_idx'),
+        ),
+        migrations.RunPython(fill_result_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+def clear_pair_cache(apps, schema_editor):
+    """Drop cached pair comparisons, which only hold the Jaccard similarity"""
+    apps.get_model('detector', 'PairSimilarity').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0011_result_summaries'),
+    ]
+    
+    operations = [
+        migrations.RunPython(clear_pair_cache, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='pairsimilarity',
+            name='fingerprint_similarity',
+        ),
+        migrations.AddField(
+            model_name='pairsimilarity',
+            name='fingerprint_scores',
+            field=models.BinaryField(default=b'', editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='assignmentfeatures',
+            name='fingerprint_positions',
+            field=models.BinaryField(default=b'', editable=False),
+        ),
+        migrations.AddField(
+            model_name='plagiarismresult',
+            name='match_weight',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='plagiarismmatch',
+            name='matched_words',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0012_containment_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plagiarismmatch',
+            name='spans',
+            field=models.BinaryField(default=b''),
+        ),
+    ]
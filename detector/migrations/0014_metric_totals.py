@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0013_match_spans'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(max_length=200, unique=True)),
+                ('value', models.FloatField(default=0)),
+            ],
+        ),
+    ]
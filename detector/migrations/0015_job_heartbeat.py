@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:44
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_heartbeats(apps, schema_editor):
+    """Take the start of jobs that are already running as their last heartbeat"""
+    PlagiarismCheckJob = apps.get_model('detector', 'PlagiarismCheckJob')
+    PlagiarismCheckJob.objects.filter(status='running').update(heartbeat_at=F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0014_metric_totals'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='plagiarismcheckjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_heartbeats, migrations.RunPython.noop),
+    ]
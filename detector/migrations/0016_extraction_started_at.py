@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0015_job_heartbeat'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='extraction_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:07
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_indexed_at(apps, schema_editor):
+    """Mark the assignments already in the LSH index file as indexed"""
+    import numpy as np
+    
+    Assignment = apps.get_model('detector', 'Assignment')
+    path = os.path.join(settings.PLAGIARISM_INDEX_DIR, 'lsh_index.npz')
+    if not os.path.exists(path):
+        return
+    with np.load(path) as stored:
+        ids = stored['ids'].tolist()
+    now = timezone.now()
+    for start in range(0, len(ids), 500):
+        Assignment.objects.filter(id__in=ids[start:start + 500]).update(indexed_at=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0016_extraction_started_at'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='indexed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_indexed_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:16
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0017_assignment_indexed_at'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='assignmentfeatures',
+            name='normalized_text',
+        ),
+    ]
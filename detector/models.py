@@ -1,16 +1,26 @@
 from django.db import models
 from django.conf import settings
+import hashlib
 import uuid
 import os
 
 
 def assignment_file_path(instance, filename):
-    """Generate file path for assignment uploads"""
+    """Generate file path for assignment uploads, named by content hash when known"""
     ext = filename.split('.')[-1]
-    filename = f"{uuid.uuid4()}.{ext}"
+    filename = f"{instance.content_hash or uuid.uuid4()}.{ext}"
     return os.path.join('assignments', filename)
 
 
+def hash_file(file):
+    """Return the SHA-256 hex digest of an uploaded or stored file"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
 class Course(models.Model):
     """Course model for organizing assignments"""
     name = models.CharField(max_length=255)
@@ -26,6 +36,17 @@ class Course(models.Model):
 
 class Assignment(models.Model):
     """Assignment model for storing uploaded documents"""
+    EXTRACTION_PENDING = 'pending'
+    EXTRACTION_EXTRACTING = 'extracting'
+    EXTRACTION_READY = 'ready'
+    EXTRACTION_FAILED = 'failed'
+    EXTRACTION_STATUSES = (
+        (EXTRACTION_PENDING, 'Pending'),
+        (EXTRACTION_EXTRACTING, 'Extracting'),
+        (EXTRACTION_READY, 'Ready'),
+        (EXTRACTION_FAILED, 'Failed'),
+    )
+    
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='assignments')
@@ -33,24 +54,107 @@ class Assignment(models.Model):
     file_name = models.CharField(max_length=255)
     file_type = models.CharField(max_length=50)
     file_size = models.IntegerField()  # Size in bytes
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of the file
     content_text = models.TextField(blank=True)  # Extracted text content
+    extraction_status = models.CharField(max_length=20, choices=EXTRACTION_STATUSES, default=EXTRACTION_PENDING, db_index=True)
+    extraction_error = models.TextField(blank=True)
+    extraction_duration = models.FloatField(null=True, blank=True)  # Seconds spent extracting and indexing
+    extraction_started_at = models.DateTimeField(null=True, blank=True)  # When the current or last extraction began
+    extracted_at = models.DateTimeField(null=True, blank=True)
+    indexed_at = models.DateTimeField(null=True, blank=True, db_index=True)  # When the text was added to the shared indexes
     uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='assignments')
     student_name = models.CharField(max_length=255, blank=True)
     student_id = models.CharField(max_length=50, blank=True)
     submission_date = models.DateField(null=True, blank=True)
+    # Copied from the newest result when results are saved or deleted, for listing and sorting
+    latest_result = models.ForeignKey('PlagiarismResult', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    latest_score = models.FloatField(null=True, blank=True)
+    result_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', '-created_at'], name='assignment_course_created_idx'),
+            models.Index(fields=['course', '-latest_score'], name='assignment_course_score_idx'),
+            models.Index(fields=['uploaded_by', '-created_at'], name='assignment_uploader_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.title} - {self.student_name or 'Unknown'}"
+    
+    def refresh_latest_result(self):
+        """Recompute latest_result, latest_score and result_count from the stored results"""
+        results = PlagiarismResult.objects.filter(assignment_id=self.id)
+        latest = results.order_by('-processed_at', '-id').only('id', 'overall_score').first()
+        self.latest_result = latest
+        self.latest_score = latest.overall_score if latest is not None else None
+        self.result_count = results.count()
+        Assignment.objects.filter(id=self.id).update(
+            latest_result=self.latest_result,
+            latest_score=self.latest_score,
+            result_count=self.result_count
+        )
+
+
+class AssignmentFeatures(models.Model):
+    """Model to store what the detector derives from an assignment's text, computed once"""
+    assignment = models.OneToOneField(Assignment, on_delete=models.CASCADE, related_name='features')
+    config_hash = models.CharField(max_length=64, db_index=True)  # Detector parameters the features were computed with
+    sentence_spans = models.BinaryField(editable=False)  # (start, end) offsets into content_text
+    fingerprint = models.BinaryField(editable=False)  # Winnowed k-gram hashes
+    fingerprint_positions = models.BinaryField(editable=False, default=b'')  # Fingerprint index and first word of each k-gram
+    vector_indices = models.BinaryField(editable=False)  # Hashed term columns
+    vector_data = models.BinaryField(editable=False)  # Term counts
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Features of {self.assignment_id}"
+
+
+class CourseSimilarityMatrix(models.Model):
+    """Model to store the pairwise similarity of all assignments in a course"""
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='similarity_matrices')
+    assignment_ids = models.BinaryField(editable=False)  # Assignment of each row, int64
+    scores = models.BinaryField(editable=False)  # Pairs above the diagonal, float16 percentages
+    config_hash = models.CharField(max_length=64)  # Detector parameters the scores were computed with
+    duration = models.FloatField()  # Seconds spent computing
+    computed_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Similarity of {self.course} ({self.computed_at})"
+
+
+class PairSimilarity(models.Model):
+    """Model to cache the comparison of two distinct files, least recently used rows are evicted"""
+    key = models.CharField(max_length=64, unique=True)  # Both content hashes and the detector configuration
+    fingerprint_scores = models.BinaryField(editable=False)  # FingerprintScores of both files, in content hash order
+    sentence_pairs = models.BinaryField(editable=False)  # Matching sentence indices, in content hash order
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"Pair {self.key[:12]}"
 
 
 class PlagiarismResult(models.Model):
     """Model to store plagiarism detection results"""
     assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='plagiarism_results')
     overall_score = models.FloatField()  # Overall plagiarism percentage
+    match_count = models.IntegerField(null=True, blank=True)  # Significant matches averaged into overall_score
+    match_weight = models.FloatField(null=True, blank=True)  # Sum of the matches' weights in overall_score
+    compare_with_course = models.BooleanField(default=True)
+    compare_with_all = models.BooleanField(default=False)
+    references_as_of = models.DateTimeField(null=True, blank=True)  # When the compared references were selected
+    previous_result = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='next_results')  # Result an incremental check built on
+    metrics = models.JSONField(default=dict, blank=True)  # Stage timings, counters and peak memory of the check
     processed_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['assignment', '-processed_at'], name='result_assignment_latest_idx'),
+        ]
+    
     def __str__(self):
         return f"Result for {self.assignment} - {self.overall_score}%"
 
@@ -69,7 +173,58 @@ class PlagiarismMatch(models.Model):
     source_url = models.URLField(blank=True, null=True)
     source_assignment = models.ForeignKey(Assignment, on_delete=models.SET_NULL, null=True, blank=True, related_name='matches_as_source')
     similarity_score = models.FloatField()  # Match percentage
-    matched_text = models.TextField(blank=True)  # The text that matched
+    matched_words = models.IntegerField(null=True, blank=True)  # Words of the checked text in shared k-grams, its weight
+    spans = models.BinaryField(editable=False, default=b'')  # (start, end) offsets of copied passages in both texts, int32
+    matched_text = models.TextField(blank=True)  # The text that matched, for matches without spans
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['result', '-similarity_score'], name='match_result_score_idx'),
+        ]
     
     def __str__(self):
         return f"Match: {self.source_name} ({self.similarity_score}%)"
+
+
+class PlagiarismCheckJob(models.Model):
+    """Model to track plagiarism checks running in the background"""
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    )
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+    
+    assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='check_jobs')
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='check_jobs')
+    compare_with_course = models.BooleanField(default=True)
+    compare_with_all = models.BooleanField(default=False)
+    incremental = models.BooleanField(default=False)  # Only compare with references added since the last result
+    profile = models.BooleanField(default=False)  # Run the check under cProfile
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    progress = models.FloatField(default=0)  # Percentage of references compared
+    result = models.ForeignKey(PlagiarismResult, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Last sign of life of a running job
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Check of {self.assignment} ({self.status})"
+
+
+class MetricTotal(models.Model):
+    """Model to store the metrics endpoint's counters, shared by every web and worker process"""
+    series = models.CharField(max_length=200, unique=True)  # Metric name and labels, as exported
+    value = models.FloatField(default=0)
+    
+    def __str__(self):
+        return f"{self.series} {self.value}"
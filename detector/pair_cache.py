@@ -0,0 +1,146 @@
+import hashlib
+import json
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PairSimilarity
+from .utils.plagiarism_detector import FingerprintScores, PairComparison
+
+
+# (sentence index in the first file, index in the second, similarity)
+SENTENCE_PAIR_DTYPE = np.dtype([('first', '<i4'), ('second', '<i4'), ('similarity', '<f8')])
+
+# FingerprintScores fields as stored from the first file's side, and as read
+# from the second's
+SCORE_FIELDS = FingerprintScores._fields
+SWAPPED_SCORE_FIELDS = (
+    'jaccard', 'reference_containment', 'containment', 'reference_coverage', 'coverage',
+    'reference_matched_words', 'matched_words'
+)
+
+# Entries deleted per query when evicting
+EVICTION_BATCH_SIZE = 500
+
+class PairCache:
+    """
+    Database cache of the pair comparisons of one checked file
+    
+    Entries are keyed by both files' content hashes and the detector's
+    comparison parameters, so a pair compared from either side is found
+    again. Fingerprint scores and sentence indices are stored in content
+    hash order and swapped on the way in and out when the checked file sorts
+    second.
+    """
+    
+    def __init__(self, content_hash, detector, max_size=None):
+        self.content_hash = content_hash
+        self.config_hash = hashlib.sha256(
+            json.dumps(detector.comparison_config(), sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        self.max_size = settings.PLAGIARISM_PAIR_CACHE_SIZE if max_size is None else max_size
+        self.hits = 0
+        self.misses = 0
+    
+    def key(self, ref_content_hash):
+        """
+        Return the cache key of a pair and whether the checked file sorts second
+        
+        Pairs without both content hashes, or of identical files, are not cached.
+        """
+        if not self.content_hash or not ref_content_hash or ref_content_hash == self.content_hash:
+            return None, False
+        first, second = sorted((self.content_hash, ref_content_hash))
+        key = hashlib.sha256(f"{first}:{second}:{self.config_hash}".encode('utf-8')).hexdigest()
+        return key, self.content_hash != first
+    
+    def get_many(self, source_infos):
+        """Return the cached PairComparison, or None, of each reference"""
+        keys = [self.key(source_info.get('content_hash')) for source_info in source_infos]
+        wanted = {key for key, _ in keys if key is not None}
+        
+        rows = {}
+        if wanted:
+            rows = PairSimilarity.objects.filter(key__in=wanted).only(
+                'key', 'fingerprint_scores', 'sentence_pairs'
+            ).in_bulk(field_name='key')
+            if rows:
+                PairSimilarity.objects.filter(key__in=list(rows)).update(last_used=timezone.now())
+        
+        pairs = [
+            self._decode(rows[key], swapped) if key in rows else None
+            for key, swapped in keys
+        ]
+        hits = sum(pair is not None for pair in pairs)
+        self._count(hits, len(pairs) - hits)
+        return pairs
+    
+    def set_many(self, comparisons):
+        """Store (source_info, PairComparison) tuples, keeping existing entries"""
+        now = timezone.now()
+        entries = {}
+        for source_info, pair in comparisons:
+            key, swapped = self.key(source_info.get('content_hash'))
+            if key is not None:
+                entries[key] = PairSimilarity(
+                    key=key,
+                    fingerprint_scores=self._encode_scores(pair.fingerprint_scores, swapped),
+                    sentence_pairs=self._encode(pair.sentence_pairs, swapped),
+                    last_used=now
+                )
+        if entries:
+            PairSimilarity.objects.bulk_create(entries.values(), ignore_conflicts=True)
+    
+    def evict(self):
+        """Delete the least recently used entries beyond max_size"""
+        excess = PairSimilarity.objects.count() - self.max_size
+        if excess <= 0:
+            return 0
+        stale = list(
+            PairSimilarity.objects.order_by('last_used', 'id').values_list('id', flat=True)[:excess]
+        )
+        for start in range(0, len(stale), EVICTION_BATCH_SIZE):
+            PairSimilarity.objects.filter(id__in=stale[start:start + EVICTION_BATCH_SIZE]).delete()
+        return len(stale)
+    
+    def _count(self, hits, misses):
+        self.hits += hits
+        self.misses += misses
+    
+    @staticmethod
+    def _encode_scores(scores, swapped):
+        fields = SWAPPED_SCORE_FIELDS if swapped else SCORE_FIELDS
+        return np.array([getattr(scores, field) for field in fields], dtype='<f8').tobytes()
+    
+    @staticmethod
+    def _decode_scores(data, swapped):
+        values = dict(zip(SWAPPED_SCORE_FIELDS if swapped else SCORE_FIELDS,
+                          np.frombuffer(data, dtype='<f8').tolist()))
+        values['matched_words'] = int(values['matched_words'])
+        values['reference_matched_words'] = int(values['reference_matched_words'])
+        return FingerprintScores(**values)
+    
+    @staticmethod
+    def _encode(sentence_pairs, swapped):
+        pairs = np.array(sentence_pairs, dtype=SENTENCE_PAIR_DTYPE)
+        return (_swap(pairs) if swapped else pairs).tobytes()
+    
+    @staticmethod
+    def _decode(row, swapped):
+        pairs = np.frombuffer(row.sentence_pairs, dtype=SENTENCE_PAIR_DTYPE)
+        if swapped:
+            pairs = _swap(pairs)
+        return PairComparison(
+            PairCache._decode_scores(row.fingerprint_scores, swapped),
+            [(int(first), int(second), float(similarity)) for first, second, similarity in pairs.tolist()]
+        )
+
+
+def _swap(pairs):
+    """Exchange the sides of sentence pairs, keeping them ordered by sentence"""
+    swapped = np.empty(len(pairs), dtype=SENTENCE_PAIR_DTYPE)
+    swapped['first'] = pairs['second']
+    swapped['second'] = pairs['first']
+    swapped['similarity'] = pairs['similarity']
+    return np.sort(swapped, order=['first', 'second'])
@@ -0,0 +1,638 @@
+import cProfile
+import io
+import logging
+import math
+import pstats
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .features import (
+    get_config_hash,
+    get_document_features,
+    load_document_features,
+    load_vector,
+    refresh_features
+)
+from .models import Assignment, AssignmentFeatures, CourseSimilarityMatrix, PlagiarismResult, PlagiarismMatch
+from .metrics import record_check
+from .pair_cache import PairCache
+from .utils.corpus_index import get_corpus_index
+from .utils.instrumentation import StageMetrics, peak_memory_bytes
+from .utils.lsh_index import get_lsh_index
+from .utils.plagiarism_detector import (
+    Passage,
+    PlagiarismDetector,
+    fingerprint_from_bytes,
+    match_weight,
+    spans_from_bytes,
+    spans_to_bytes
+)
+from .utils.sentence_index import get_sentence_index
+from .utils.similarity_matrix import (
+    cosine_matrix,
+    fingerprint_containment_matrix,
+    pack_upper_triangle,
+    similarity_clusters,
+    top_pairs,
+    unpack_upper_triangle
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Matches inserted per INSERT statement
+MATCH_BATCH_SIZE = 500
+
+# Lines of cProfile output kept with a profiled result
+PROFILE_LINES = 40
+
+# Most characters of context around a passage for users other than the
+# teacher of the checked assignment's course
+STUDENT_FRAGMENT_CONTEXT = 80
+
+# Most LSH candidates selected by id, larger sets keep those sharing the most
+# bands with the checked text. SQLite allows 32766 parameters per query.
+MAX_CANDIDATE_IDS = 30000
+
+# Held by the profiled check, newer Pythons allow one active profiler per process
+_profile_lock = threading.Lock()
+
+
+def warm_up():
+    """
+    Load the detection stack and the shared indexes ahead of the first check
+    
+    Importing this module loads NumPy, SciPy and scikit-learn. Running a tiny
+    detection also loads what they import on first use, and the indexes are
+    read from disk, so the first real check does not pay for any of it.
+    """
+    started = time.perf_counter()
+    sample = "Warm up the plagiarism detector. It compares this text with itself."
+    PlagiarismDetector().detect_plagiarism(sample, [(sample, {'id': None, 'type': 'assignment', 'title': ''})])
+    get_corpus_index()
+    get_lsh_index()
+    get_sentence_index()
+    logger.info("Warmed up the plagiarism detector in %.2fs", time.perf_counter() - started)
+
+
+def get_source_info(assignment):
+    """Describe a reference assignment for the detector"""
+    return {
+        'id': assignment.id,
+        'title': assignment.title,
+        'student_name': assignment.student_name,
+        'content_hash': assignment.content_hash,
+        'type': 'assignment'
+    }
+
+
+def get_archive_candidates(text_fingerprint):
+    """
+    Return a condition selecting the archive assignments likely similar to a text
+    
+    LSH candidates are joined by the ready assignments that are not in the
+    shared indexes, such as those whose indexing failed, so that they are
+    compared with rather than skipped. Those are found by their unset
+    indexed_at rather than by scanning the archive. Before the indexes are
+    built every assignment is missing from them.
+    
+    Returns:
+        Q: Condition on assignments
+    """
+    candidates = get_lsh_index().query(text_fingerprint, limit=MAX_CANDIDATE_IDS)
+    return Q(id__in=candidates) | Q(extraction_status=Assignment.EXTRACTION_READY, indexed_at__isnull=True)
+
+
+def get_reference_querysets(assignment, text_fingerprint, compare_with_course=True, compare_with_all=False):
+    """
+    Select the assignments to compare an assignment with
+    
+    Returns:
+        tuple: (references, duplicates) querysets. Duplicates are references
+        whose file is identical to the assignment's and need no comparison.
+    """
+    conditions = Q(pk__in=[])
+    
+    if compare_with_course:
+        # Compare with other assignments in the same course
+        conditions |= Q(course_id=assignment.course_id)
+    
+    if compare_with_all:
+        # Narrow the archive down to likely-similar candidates
+        conditions |= get_archive_candidates(text_fingerprint)
+    
+    references = Assignment.objects.filter(conditions).exclude(id=assignment.id).exclude(content_text='')
+    duplicates = Assignment.objects.none()
+    
+    if assignment.content_hash:
+        # Exact resubmissions of the same file, whether or not LSH returned them
+        duplicates = Assignment.objects.filter(content_hash=assignment.content_hash).exclude(id=assignment.id)
+        if not compare_with_all:
+            duplicates = duplicates.filter(conditions)
+        references = references.exclude(content_hash=assignment.content_hash)
+    
+    return references.order_by('id'), duplicates.order_by('id')
+
+
+def iter_reference_texts(references, config_hash):
+    """
+    Stream (text, source_info, features) tuples from a reference queryset
+    
+    Rows are fetched REFERENCE_CHUNK_SIZE at a time with only the columns the
+    detector needs, so the whole reference set is never held in memory.
+    Stored features are joined in with each row. References without features
+    computed with config_hash are yielded without them.
+    """
+    references = references.select_related('features').only(
+        'id', 'title', 'student_name', 'content_hash', 'content_text',
+        'features__config_hash', 'features__sentence_spans', 'features__fingerprint',
+        'features__fingerprint_positions'
+    ).iterator(chunk_size=settings.PLAGIARISM_REFERENCE_CHUNK_SIZE)
+    
+    for ref_assignment in references:
+        ref_features = None
+        try:
+            stored = ref_assignment.features
+        except AssignmentFeatures.DoesNotExist:
+            stored = None
+        if stored is not None and stored.config_hash == config_hash:
+            ref_features = load_document_features(stored, ref_assignment.content_text)
+        yield ref_assignment.content_text, get_source_info(ref_assignment), ref_features
+
+
+def get_previous_result(assignment, compare_with_course=True, compare_with_all=False):
+    """Return the latest result of the same kind of check an incremental check can build on"""
+    return assignment.plagiarism_results.filter(
+        compare_with_course=compare_with_course,
+        compare_with_all=compare_with_all,
+        references_as_of__isnull=False,
+        match_count__isnull=False,
+        match_weight__isnull=False
+    ).order_by('-references_as_of', '-id').first()
+
+
+def merge_previous_result(previous, result, max_matches=None):
+    """
+    Merge the stored matches of a previous result into a detection result
+    
+    The new result's matches replace stored matches of the same source, and
+    stored matches whose source assignment has been deleted are dropped. The
+    overall score is the weighted mean over both sets of significant matches.
+    
+    Returns:
+        dict: The merged result, in the format of detect_plagiarism
+    """
+    compared = {
+        match['source_info']['id'] for match in result['matches']
+        if match['source_info']['type'] == 'assignment'
+    }
+    
+    carried = []
+    dropped = []
+    for match in previous.matches.order_by('-similarity_score', 'id'):
+        if match.source_type == 'assignment' and (
+                match.source_assignment_id is None or match.source_assignment_id in compared):
+            dropped.append((match.similarity_score, match_weight({'matched_words': match.matched_words})))
+            continue
+        carried.append({
+            'source_info': {
+                'id': match.source_assignment_id,
+                'title': match.source_name,
+                'type': match.source_type
+            },
+            'similarity_score': match.similarity_score,
+            'matched_words': match.matched_words,
+            'passages': [Passage(*span, None) for span in spans_from_bytes(match.spans).tolist()],
+            'sentence_matches': [],
+            'matched_text': match.matched_text
+        })
+    
+    match_count = previous.match_count - len(dropped) + result['match_count']
+    weight_total = previous.match_weight - math.fsum(weight for _, weight in dropped) + result['match_weight']
+    score_total = (
+        previous.overall_score * previous.match_weight - math.fsum(score * weight for score, weight in dropped)
+        + result['overall_score'] * result['match_weight']
+    )
+    
+    matches = sorted(result['matches'] + carried, key=lambda match: match['similarity_score'], reverse=True)
+    if max_matches is not None:
+        matches = matches[:max_matches]
+    
+    return {
+        'overall_score': max(score_total / weight_total, 0) if match_count > 0 and weight_total > 0 else 0,
+        'match_count': match_count,
+        'match_weight': max(weight_total, 0) if match_count > 0 else 0,
+        'matches': matches
+    }
+
+
+def run_plagiarism_check(assignment, compare_with_course=True, compare_with_all=False, progress=None,
+                         incremental=False, profile=False):
+    """
+    Check an assignment against its reference assignments and store the result
+    
+    The time spent in each stage and counts of the references and sentence
+    pairs compared are stored in the result's metrics and added to the totals
+    exported by the metrics endpoint. The metrics also hold the process's
+    peak resident set size and how far the check raised it, which is 0 for a
+    check fitting in memory the process already used and is shared by checks
+    running in the same process at the same time.
+    
+    Args:
+        assignment (Assignment): The assignment to check
+        compare_with_course (bool): Compare with the other assignments of its course
+        compare_with_all (bool): Compare with likely-similar assignments across the archive
+        progress (callable): Optional progress(done, total) callback, see
+            PlagiarismDetector.detect_plagiarism
+        incremental (bool): Reuse the matches of the previous result of the
+            same kind of check, comparing only with references added since.
+            Without a previous result every reference is compared.
+        profile (bool): Run the check under cProfile and store the most
+            expensive calls in metrics['profile']. Parallel detection workers
+            are not profiled, nor is a check started while another one is.
+        
+    Returns:
+        PlagiarismResult: The saved result
+    """
+    metrics = StageMetrics()
+    peak_before = peak_memory_bytes()
+    profiler = None
+    if profile and _profile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+    started = time.perf_counter()
+    
+    if profiler is not None:
+        profiler.enable()
+    try:
+        plagiarism_result = _run_plagiarism_check(
+            assignment, compare_with_course, compare_with_all, progress, incremental, metrics
+        )
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+    
+    peak = peak_memory_bytes()
+    stored = dict(
+        metrics.as_dict(),
+        total_seconds=time.perf_counter() - started,
+        process_peak_rss_bytes=peak,
+        peak_rss_growth_bytes=peak - peak_before if peak is not None else None
+    )
+    if profiler is not None:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        stored['profile'] = stream.getvalue()
+    
+    # Saving is timed as a stage too, so the metrics are written once it is done
+    PlagiarismResult.objects.filter(id=plagiarism_result.id).update(metrics=stored)
+    plagiarism_result.metrics = stored
+    record_check(stored)
+    
+    return plagiarism_result
+
+
+def _run_plagiarism_check(assignment, compare_with_course, compare_with_all, progress, incremental, metrics):
+    """Run the stages of run_plagiarism_check, timing them in metrics"""
+    # Initialize plagiarism detector
+    detector = PlagiarismDetector(
+        workers=settings.PLAGIARISM_DETECTION_WORKERS,
+        chunk_size=settings.PLAGIARISM_DETECTION_CHUNK_SIZE,
+        max_matches=settings.PLAGIARISM_MAX_MATCHES
+    )
+    
+    with metrics.stage('loading_text'):
+        text_features = get_document_features(assignment, detector)
+    
+    with metrics.stage('selecting_references'):
+        previous = None
+        if incremental:
+            previous = get_previous_result(assignment, compare_with_course, compare_with_all)
+        
+        # Get reference assignments to compare with
+        references_as_of = timezone.now()
+        references, duplicates = get_reference_querysets(
+            assignment, text_features.fingerprint,
+            compare_with_course=compare_with_course,
+            compare_with_all=compare_with_all
+        )
+        if previous is not None:
+            # References uploaded, or whose text became available, after the previous result
+            added = Q(created_at__gt=previous.references_as_of) | Q(extracted_at__gt=previous.references_as_of)
+            references = references.filter(added)
+            duplicates = duplicates.filter(added)
+        total = references.count()
+        duplicate_infos = [
+            get_source_info(duplicate)
+            for duplicate in duplicates.only('id', 'title', 'student_name', 'content_hash')
+        ]
+    
+    # Features are computed once per assignment, only new or outdated ones are built here
+    with metrics.stage('refreshing_features'):
+        refreshed = refresh_features(references, detector)
+    metrics.count('features_computed', refreshed)
+    if refreshed:
+        logger.info("Computed features of %d reference assignments", refreshed)
+    
+    pair_cache = None
+    if settings.PLAGIARISM_PAIR_CACHE_SIZE > 0:
+        pair_cache = PairCache(assignment.content_hash, detector)
+    
+    # Detect plagiarism
+    with metrics.stage('detection'):
+        result = detector.detect_plagiarism(
+            assignment.content_text, iter_reference_texts(references, get_config_hash(detector)),
+            corpus_index=get_corpus_index(),
+            progress=progress,
+            duplicates=duplicate_infos,
+            total=total,
+            text_features=text_features,
+            pair_cache=pair_cache,
+            sentence_index=get_sentence_index(),
+            metrics=metrics
+        )
+    
+    if pair_cache is not None:
+        with metrics.stage('pair_cache'):
+            pair_cache.evict()
+        metrics.count('pair_cache_hits', pair_cache.hits)
+        metrics.count('pair_cache_misses', pair_cache.misses)
+        logger.info("Pair cache for assignment %s: %d hits, %d misses",
+                    assignment.id, pair_cache.hits, pair_cache.misses)
+    
+    if previous is not None:
+        with metrics.stage('merging'):
+            result = merge_previous_result(previous, result, max_matches=detector.max_matches)
+    
+    with metrics.stage('saving'):
+        plagiarism_result, write_stats = save_detection_result(
+            assignment, result,
+            compare_with_course=compare_with_course,
+            compare_with_all=compare_with_all,
+            references_as_of=references_as_of,
+            previous_result=previous
+        )
+    metrics.count('rows_written', write_stats['rows'])
+    logger.info("Saved plagiarism result %s for assignment %s: %d rows in %.3fs",
+                plagiarism_result.id, assignment.id, write_stats['rows'], write_stats['seconds'])
+    
+    return plagiarism_result
+
+
+def save_detection_result(assignment, result, **fields):
+    """
+    Store a detect_plagiarism result and its matches in one transaction
+    
+    Source assignments are looked up with a single query and the matches are
+    inserted with bulk_create, so the number of queries does not grow with
+    the number of matches. Matches with copied passages store only their
+    offsets, the others up to five of their matching sentences. The
+    assignment's latest_result, latest_score and result_count are updated
+    in the same transaction. Extra keyword arguments are set on the
+    PlagiarismResult.
+    
+    Returns:
+        tuple: (PlagiarismResult, {'rows': rows written, 'seconds': time taken})
+    """
+    started = time.perf_counter()
+    
+    with transaction.atomic():
+        # Save the result to the database
+        plagiarism_result = PlagiarismResult.objects.create(
+            assignment=assignment,
+            overall_score=result['overall_score'],
+            match_count=result.get('match_count'),
+            match_weight=result.get('match_weight'),
+            **fields
+        )
+        
+        # Sources deleted since the check started are stored without a link
+        source_ids = [
+            match['source_info']['id'] for match in result['matches']
+            if match['source_info']['type'] == 'assignment'
+        ]
+        source_assignments = Assignment.objects.only('id').in_bulk(source_ids)
+        
+        # Save individual matches
+        plagiarism_matches = []
+        for match in result['matches']:
+            source_info = match['source_info']
+            source_assignment = None
+            
+            if source_info['type'] == 'assignment':
+                source_assignment = source_assignments.get(source_info['id'])
+            
+            passages = match.get('passages')
+            matched_text = ''
+            if not passages:
+                matched_text = match.get('matched_text') or "\n".join(
+                    [m['text1_sentence'] for m in match['sentence_matches'][:5]]
+                )
+            
+            plagiarism_matches.append(PlagiarismMatch(
+                result=plagiarism_result,
+                source_type=source_info['type'],
+                source_name=source_info['title'],
+                source_assignment=source_assignment,
+                similarity_score=match['similarity_score'],
+                matched_words=match.get('matched_words'),
+                spans=spans_to_bytes(passages or []),
+                matched_text=matched_text
+            ))
+        PlagiarismMatch.objects.bulk_create(plagiarism_matches, batch_size=MATCH_BATCH_SIZE)
+        
+        # Keep the assignment's result summary in step with the new result
+        Assignment.objects.filter(id=assignment.id).update(
+            latest_result=plagiarism_result,
+            latest_score=plagiarism_result.overall_score,
+            result_count=F('result_count') + 1
+        )
+    
+    return plagiarism_result, {
+        'rows': 1 + len(plagiarism_matches),
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def compute_course_similarity(course):
+    """
+    Score every pair of assignments in a course in one pass and store the matrix
+    
+    Pairs are scored like a single check scores a reference (the mean of the
+    corpus TF-IDF cosine and the fingerprint containment), but from the stored
+    features and with two matrix products instead of one comparison per pair.
+    A check takes the containment of the checked text, which depends on the
+    side a pair is seen from, so a pair here takes the larger of its two.
+    Sentence matching is left to individual checks.
+    
+    Returns:
+        CourseSimilarityMatrix: The saved matrix, replacing the course's previous ones
+    """
+    started = time.perf_counter()
+    detector = PlagiarismDetector()
+    index = get_corpus_index()
+    
+    assignments = course.assignments.filter(extraction_status=Assignment.EXTRACTION_READY)
+    refresh_features(assignments, detector)
+    config_hash = get_config_hash(detector, index)
+    stored = AssignmentFeatures.objects.filter(
+        assignment__in=assignments, config_hash=config_hash
+    ).exclude(assignment__content_text='').only(
+        'assignment_id', 'fingerprint', 'vector_indices', 'vector_data'
+    ).order_by('assignment_id')
+    
+    assignment_ids = []
+    fingerprints = []
+    rows = []
+    for features in stored.iterator(chunk_size=settings.PLAGIARISM_REFERENCE_CHUNK_SIZE):
+        assignment_ids.append(features.assignment_id)
+        fingerprints.append(fingerprint_from_bytes(features.fingerprint))
+        rows.append(load_vector(features, index.n_features))
+    
+    if rows:
+        weighted = index.weight(sp.vstack(rows))
+        scores = (cosine_matrix(weighted) + fingerprint_containment_matrix(fingerprints)) / 2
+    else:
+        scores = np.zeros((0, 0))
+    
+    with transaction.atomic():
+        course.similarity_matrices.all().delete()
+        matrix = CourseSimilarityMatrix.objects.create(
+            course=course,
+            assignment_ids=np.asarray(assignment_ids, dtype='<i8').tobytes(),
+            scores=pack_upper_triangle(scores),
+            config_hash=config_hash,
+            duration=time.perf_counter() - started
+        )
+    
+    logger.info("Computed similarity of %d assignments in course %s in %.2fs",
+                len(assignment_ids), course.id, matrix.duration)
+    return matrix
+
+
+def summarize_course_similarity(matrix, threshold=50, limit=50):
+    """
+    Describe the most similar pairs and clusters of a stored course matrix
+    
+    Args:
+        matrix (CourseSimilarityMatrix): The stored matrix
+        threshold (float): Minimum similarity percentage of a reported pair,
+            clusters are groups of assignments connected by such pairs
+        limit (int): Maximum number of pairs reported
+        
+    Returns:
+        dict: Pairs and clusters, with the assignments' id, title and student name
+    """
+    ids = np.frombuffer(matrix.assignment_ids, dtype='<i8').tolist()
+    scores = unpack_upper_triangle(matrix.scores)
+    
+    pairs = top_pairs(scores, len(ids), threshold, limit)
+    clusters = similarity_clusters(scores, len(ids), threshold)
+    
+    shown = {ids[row] for pair in pairs for row in pair[:2]}
+    shown.update(ids[row] for cluster in clusters for row in cluster)
+    assignments = Assignment.objects.only('id', 'title', 'student_name').in_bulk(shown)
+    
+    def describe(row):
+        assignment = assignments.get(ids[row])
+        if assignment is None:
+            # Deleted since the matrix was computed
+            return {'id': ids[row], 'title': None, 'student_name': None}
+        return {'id': assignment.id, 'title': assignment.title, 'student_name': assignment.student_name}
+    
+    return {
+        'course': matrix.course_id,
+        'computed_at': matrix.computed_at,
+        'duration': matrix.duration,
+        'assignment_count': len(ids),
+        'threshold': threshold,
+        'pairs': [
+            {'assignment1': describe(i), 'assignment2': describe(j), 'similarity_score': round(score, 2)}
+            for i, j, score in pairs
+        ],
+        'clusters': [
+            {'assignments': [describe(row) for row in cluster]}
+            for cluster in clusters
+        ],
+    }
+
+
+def cut_fragment(text, start, end, context):
+    """Cut text[start:end] out of a text with up to context characters on either side"""
+    start = min(max(start, 0), len(text))
+    end = min(max(end, start), len(text))
+    return {
+        'start': start,
+        'end': end,
+        'before': text[max(start - context, 0):start],
+        'match': text[start:end],
+        'after': text[end:end + context],
+    }
+
+
+def render_match_fragments(result, user, context=80, match_id=None):
+    """
+    Render the copied passages of a result's matches from the stored texts
+    
+    Passages are stored as offsets only, so their text is cut from the
+    checked and source assignments' content_text when asked for. Source
+    text is only shown to the teacher of the source assignment's course and
+    to its uploader, and is None for everyone else and for matches whose
+    source assignment has been deleted. Users other than the teacher of the
+    checked assignment's course get at most STUDENT_FRAGMENT_CONTEXT
+    characters of context.
+    
+    Args:
+        result (PlagiarismResult): The result, its matches prefetched or not
+        user (User): The user the fragments are shown to
+        context (int): Characters shown before and after each passage
+        match_id (int): Only render this match
+        
+    Returns:
+        dict: The fragments of each match, in descending score order
+    """
+    matches = sorted(result.matches.all(), key=lambda match: (-match.similarity_score, match.id))
+    if match_id is not None:
+        matches = [match for match in matches if match.id == match_id]
+    
+    checked = Assignment.objects.select_related('course').only(
+        'id', 'content_text', 'course__teacher_id'
+    ).get(id=result.assignment_id)
+    text = checked.content_text
+    if checked.course.teacher_id != user.id:
+        context = min(context, STUDENT_FRAGMENT_CONTEXT)
+    
+    # Only the sources the user may read are loaded at all
+    sources = Assignment.objects.filter(
+        Q(course__teacher=user) | Q(uploaded_by=user),
+        id__in={match.source_assignment_id for match in matches if match.source_assignment_id is not None}
+    ).only('id', 'content_text').in_bulk()
+    
+    rendered = []
+    for match in matches:
+        source = sources.get(match.source_assignment_id)
+        rendered.append({
+            'id': match.id,
+            'source_name': match.source_name,
+            'source_assignment': match.source_assignment_id,
+            'similarity_score': match.similarity_score,
+            'fragments': [
+                {
+                    'text': cut_fragment(text, text_start, text_end, context),
+                    'source': cut_fragment(source.content_text, source_start, source_end, context)
+                    if source is not None else None,
+                }
+                for text_start, text_end, source_start, source_end in spans_from_bytes(match.spans).tolist()
+            ],
+            'matched_text': match.matched_text,
+        })
+    
+    return {'result': result.id, 'assignment': result.assignment_id, 'matches': rendered}
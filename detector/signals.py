@@ -1,17 +1,41 @@
-from django.db.models.signals import post_save
+import logging
+
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Assignment
-from .utils.text_extractor import extract_text_from_file
+from .models import Assignment, PlagiarismResult
+from .jobs import enqueue_extraction
+
+
+logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=Assignment)
 def extract_text_on_save(sender, instance, created, **kwargs):
-    """Extract text from uploaded files when a new assignment is created"""
-    if created and not instance.content_text:
-        try:
-            text = extract_text_from_file(instance.file.path, instance.file_type)
-            instance.content_text = text
-            # Use update to avoid triggering the signal again
-            Assignment.objects.filter(id=instance.id).update(content_text=text)
-        except Exception as e:
-            print(f"Error extracting text: {e}")
+    """Queue text extraction and indexing when a new assignment is created"""
+    if created:
+        enqueue_extraction(instance)
+
+
+@receiver(post_delete, sender=Assignment)
+def remove_from_index_on_delete(sender, instance, **kwargs):
+    """Drop a deleted assignment from the corpus, LSH and sentence indexes"""
+    # Imported here so that loading the app does not load the detection stack
+    from .utils.corpus_index import remove_from_corpus_index
+    from .utils.lsh_index import remove_from_lsh_index
+    from .utils.sentence_index import remove_from_sentence_index
+    
+    try:
+        remove_from_corpus_index(instance.id)
+        remove_from_lsh_index(instance.id)
+        remove_from_sentence_index(instance.id)
+    except Exception:
+        logger.exception("Error removing assignment %s from the indexes", instance.id)
+
+
+@receiver(post_delete, sender=PlagiarismResult)
+def refresh_latest_result_on_delete(sender, instance, origin=None, **kwargs):
+    """Recompute the result summary of an assignment when one of its results is deleted"""
+    # Results deleted along with their assignment leave nothing to update
+    if not (isinstance(origin, PlagiarismResult) or getattr(origin, 'model', None) is PlagiarismResult):
+        return
+    Assignment(id=instance.assignment_id).refresh_latest_result()
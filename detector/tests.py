@@ -0,0 +1,333 @@
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from accounts.models import User
+from .models import Assignment, Course, PairSimilarity, PlagiarismMatch, PlagiarismResult
+from .pair_cache import PairCache
+from .services import merge_previous_result
+from .utils import sentence_index
+from .utils.plagiarism_detector import FingerprintScores, PairComparison, Passage, PlagiarismDetector, spans_to_bytes
+from .utils.sentence_index import SentenceIndex, compact_sentence_index
+
+
+DOCUMENTS = {
+    1: ["the quick brown fox jumps over the lazy dog", "students write essays about research"],
+    2: ["a network model learns from data", "the quick brown fox jumps over the lazy cat"],
+    3: ["theory and method of the analysis", "results of the learning system"],
+    4: ["essays about research are written by students", "a model learns from the data"],
+}
+
+QUERIES = [
+    ["the quick brown fox jumps over the lazy dog"],
+    ["students write essays about research", "a network model learns from data"],
+    ["results of the learning system and theory of the analysis"],
+]
+
+
+class SentenceIndexSegmentTests(SimpleTestCase):
+    """Changes to the sentence index are appended as segments other processes catch up with"""
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(self.directory, sentence_index.INDEX_FILE_NAME)
+        self.detector = PlagiarismDetector()
+    
+    def lookups(self, index):
+        """Sentence pairs of every query with every document, None for documents not indexed"""
+        results = []
+        for query in QUERIES:
+            lookup = index.candidate_lookup(self.detector.sentence_ngrams(query))
+            for doc_id in DOCUMENTS:
+                pairs = lookup(doc_id)
+                results.append(None if pairs is None else pairs.tolist())
+        return results
+    
+    def expected(self, doc_ids):
+        """Lookups of an index holding the given documents, built in memory"""
+        index = SentenceIndex()
+        index.add_many((doc_id, DOCUMENTS[doc_id]) for doc_id in doc_ids)
+        return self.lookups(index)
+    
+    def run_in_process(self, code):
+        """Run code with the index path as `path` in a separate Python process"""
+        code = f"from detector.utils.sentence_index import SentenceIndex\npath = {self.path!r}\n{code}"
+        subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, check=True)
+    
+    def test_append_writes_segments_applied_by_other_indexes(self):
+        writer = SentenceIndex(self.path).load()
+        reader = SentenceIndex(self.path).load()
+        writer.append(documents=[(1, DOCUMENTS[1]), (2, DOCUMENTS[2])])
+        writer.append(documents=[(3, DOCUMENTS[3])])
+        writer.append(removed=[2])
+        writer.append(removed=[4])  # Not indexed, writes nothing
+        
+        self.assertEqual(writer.segment_numbers(), [1, 2, 3])
+        self.assertFalse(os.path.exists(self.path))
+        with mock.patch.object(reader, 'load', wraps=reader.load) as load:
+            reader.refresh()
+        load.assert_not_called()
+        self.assertEqual(reader.segment, 3)
+        self.assertEqual(reader.ids, {1, 3})
+        self.assertEqual(self.lookups(reader), self.expected([1, 3]))
+        self.assertEqual(self.lookups(SentenceIndex(self.path).load()), self.expected([1, 3]))
+    
+    def test_replacing_a_document(self):
+        writer = SentenceIndex(self.path).load()
+        writer.append(documents=[(1, DOCUMENTS[1])])
+        writer.append(documents=[(1, DOCUMENTS[4])])
+        
+        index = SentenceIndex()
+        index.add(1, DOCUMENTS[4])
+        self.assertEqual(self.lookups(SentenceIndex(self.path).load()), self.lookups(index))
+    
+    @mock.patch.object(sentence_index, 'MAX_SEGMENTS', 2)
+    def test_compact_folds_segments_into_the_index_file(self):
+        SentenceIndex(self.path).save()
+        writer = SentenceIndex(self.path).load()
+        reader = SentenceIndex(self.path).load()
+        
+        with override_settings(PLAGIARISM_INDEX_DIR=self.directory):
+            writer.append(documents=[(1, DOCUMENTS[1])])
+            self.assertFalse(compact_sentence_index())
+            writer.append(documents=[(2, DOCUMENTS[2])])
+            self.assertTrue(compact_sentence_index())
+            self.assertEqual(writer.uncovered_segments(), 0)
+            # Kept until the next compaction for indexes that have not applied them yet
+            self.assertEqual(writer.segment_numbers(), [1, 2])
+            
+            # Indexes of the same lineage take the compacted file without reading it
+            writer.append(documents=[(3, DOCUMENTS[3])])
+            with mock.patch.object(reader, 'load', wraps=reader.load) as load:
+                reader.refresh()
+            load.assert_not_called()
+            
+            writer.append(documents=[(4, DOCUMENTS[4])], removed=[1])
+            self.assertTrue(compact_sentence_index())
+            self.assertEqual(writer.segment_numbers(), [3, 4])
+        
+        reader.refresh()
+        self.assertEqual(self.lookups(reader), self.expected([2, 3, 4]))
+        self.assertEqual(self.lookups(SentenceIndex(self.path).load()), self.expected([2, 3, 4]))
+    
+    def test_lineage_across_processes(self):
+        reader = SentenceIndex(self.path).load()
+        self.run_in_process(
+            f"index = SentenceIndex(path).load()\n"
+            f"index.append(documents=[(1, {DOCUMENTS[1]!r})])\n"
+            f"index.append(documents=[(2, {DOCUMENTS[2]!r})])"
+        )
+        reader.refresh()
+        self.assertEqual(self.lookups(reader), self.expected([1, 2]))
+        
+        # A rebuild starts a new lineage, its file is read again and covers the old segments
+        self.run_in_process(
+            f"index = SentenceIndex(path)\n"
+            f"index.add_many([(3, {DOCUMENTS[3]!r})])\n"
+            f"index.segment = index.last_segment()\n"
+            f"index.save()"
+        )
+        lineage = reader.lineage
+        reader.refresh()
+        self.assertNotEqual(reader.lineage, lineage)
+        self.assertEqual(reader.segment_numbers(), [])
+        self.assertEqual(self.lookups(reader), self.expected([3]))
+        
+        # Segments appended after the rebuild are applied on top of it
+        self.run_in_process(
+            f"index = SentenceIndex(path).load()\n"
+            f"index.append(documents=[(4, {DOCUMENTS[4]!r})])"
+        )
+        with mock.patch.object(reader, 'load', wraps=reader.load) as load:
+            reader.refresh()
+        load.assert_not_called()
+        self.assertEqual(reader.segment_numbers(), [3])
+        self.assertEqual(self.lookups(reader), self.expected([3, 4]))
+
+
+class DetectorTestCase(TestCase):
+    """Creates a teacher, a course and assignments to check and compare with"""
+    
+    def setUp(self):
+        self.teacher = User.objects.create_user(
+            username='teacher', email='teacher@example.com', password='password', is_teacher=True
+        )
+        self.course = Course.objects.create(name='Course', code='C1', teacher=self.teacher)
+    
+    def add_assignment(self, title):
+        number = Assignment.objects.count()
+        return Assignment.objects.create(
+            title=title,
+            course=self.course,
+            uploaded_by=self.teacher,
+            file=f"assignments/{number}.txt",
+            file_name=f"{number}.txt",
+            file_type='txt',
+            file_size=100,
+            content_text=f"Text of {title}.",
+            extraction_status=Assignment.EXTRACTION_READY
+        )
+
+
+class MergePreviousResultTests(DetectorTestCase):
+    """An incremental check carries over the matches its new comparisons do not replace"""
+    
+    def setUp(self):
+        super().setUp()
+        self.checked = self.add_assignment('Checked')
+        self.replaced = self.add_assignment('Replaced')
+        self.carried = self.add_assignment('Carried')
+        self.added = self.add_assignment('Added')
+        deleted = self.add_assignment('Deleted')
+        
+        # (source, score, matched words), stored as every significant match of the result
+        stored = [
+            (self.replaced, 40.0, 100),
+            (self.carried, 20.0, 50),
+            (deleted, 60.0, 30),
+            (None, 30.0, 10),
+        ]
+        self.previous = PlagiarismResult.objects.create(
+            assignment=self.checked,
+            overall_score=sum(score * words for _, score, words in stored) / sum(words for *_, words in stored),
+            match_count=len(stored),
+            match_weight=sum(words for *_, words in stored)
+        )
+        for source, score, words in stored:
+            PlagiarismMatch.objects.create(
+                result=self.previous,
+                source_type='assignment' if source is not None else 'internet',
+                source_name=source.title if source is not None else 'Web page',
+                source_assignment=source,
+                similarity_score=score,
+                matched_words=words,
+                spans=spans_to_bytes([Passage(0, 10, 5, 15, 3)]) if source is self.carried else b''
+            )
+        deleted.delete()
+    
+    def match(self, source, score, words):
+        return {
+            'source_info': {'id': source.id, 'title': source.title, 'type': 'assignment'},
+            'similarity_score': score,
+            'matched_words': words,
+            'passages': [],
+            'sentence_matches': []
+        }
+    
+    def test_merge(self):
+        # A match without matched words still weighs 1
+        matches = [self.match(self.replaced, 80.0, 120), self.match(self.added, 10.0, 0)]
+        result = {'overall_score': (80.0 * 120 + 10.0 * 1) / 121, 'match_count': 2, 'match_weight': 121,
+                  'matches': matches}
+        
+        merged = merge_previous_result(self.previous, result)
+        
+        # The replaced and the deleted source's matches are dropped, the others carried
+        self.assertEqual(merged['match_count'], 4)
+        self.assertAlmostEqual(merged['match_weight'], 120 + 1 + 50 + 10)
+        self.assertAlmostEqual(merged['overall_score'], (80.0 * 120 + 10.0 * 1 + 20.0 * 50 + 30.0 * 10) / 181)
+        self.assertEqual(
+            [(match['source_info']['title'], match['similarity_score']) for match in merged['matches']],
+            [('Replaced', 80.0), ('Web page', 30.0), ('Carried', 20.0), ('Added', 10.0)]
+        )
+        carried = merged['matches'][2]
+        self.assertEqual(carried['source_info']['id'], self.carried.id)
+        self.assertEqual(carried['passages'], [Passage(0, 10, 5, 15, None)])
+    
+    def test_merge_keeps_max_matches_but_scores_all(self):
+        result = {'overall_score': 80.0, 'match_count': 1, 'match_weight': 120,
+                  'matches': [self.match(self.replaced, 80.0, 120)]}
+        
+        merged = merge_previous_result(self.previous, result, max_matches=2)
+        
+        self.assertEqual([match['similarity_score'] for match in merged['matches']], [80.0, 30.0])
+        self.assertEqual(merged['match_count'], 3)
+        self.assertAlmostEqual(merged['overall_score'], (80.0 * 120 + 20.0 * 50 + 30.0 * 10) / 180)
+    
+    def test_merge_without_new_matches(self):
+        result = {'overall_score': 0, 'match_count': 0, 'match_weight': 0, 'matches': []}
+        
+        merged = merge_previous_result(self.previous, result)
+        
+        # Only the deleted source's match is dropped
+        self.assertEqual(merged['match_count'], 3)
+        self.assertAlmostEqual(merged['overall_score'], (40.0 * 100 + 20.0 * 50 + 30.0 * 10) / 160)
+    
+    def test_merge_without_matches_left(self):
+        self.previous.matches.exclude(source_assignment=self.replaced).delete()
+        self.previous.overall_score, self.previous.match_count, self.previous.match_weight = 40.0, 1, 100
+        # The replacing match is below the significance threshold, so it is kept but not scored
+        result = {'overall_score': 0, 'match_count': 0, 'match_weight': 0,
+                  'matches': [self.match(self.replaced, 5.0, 0)]}
+        
+        merged = merge_previous_result(self.previous, result)
+        
+        self.assertEqual((merged['overall_score'], merged['match_count'], merged['match_weight']), (0, 0, 0))
+        self.assertEqual([match['similarity_score'] for match in merged['matches']], [5.0])
+
+
+class PairCacheTests(DetectorTestCase):
+    """Pair comparisons are cached by content hash, from either side of the pair"""
+    
+    def setUp(self):
+        super().setUp()
+        self.detector = PlagiarismDetector()
+        # 'a' sorts before 'b', so the second file's side is stored swapped
+        self.first = {'id': 1, 'content_hash': 'a' * 64}
+        self.second = {'id': 2, 'content_hash': 'b' * 64}
+        self.third = {'id': 3, 'content_hash': 'c' * 64}
+        self.scores = FingerprintScores(
+            jaccard=0.25, containment=0.5, reference_containment=0.3, coverage=0.6,
+            reference_coverage=0.4, matched_words=60, reference_matched_words=40
+        )
+        self.comparison = PairComparison(self.scores, [(0, 2, 0.9), (1, 0, 0.85)])
+    
+    def cache(self, source_info, **kwargs):
+        return PairCache(source_info['content_hash'], self.detector, **kwargs)
+    
+    def test_hit_and_miss(self):
+        self.cache(self.first).set_many([(self.second, self.comparison)])
+        
+        cache = self.cache(self.first)
+        self.assertEqual(cache.get_many([self.second, self.third]), [self.comparison, None])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+    
+    def test_swapped_when_read_from_the_other_side(self):
+        swapped = PairComparison(
+            FingerprintScores(
+                jaccard=0.25, containment=0.3, reference_containment=0.5, coverage=0.4,
+                reference_coverage=0.6, matched_words=40, reference_matched_words=60
+            ),
+            [(0, 1, 0.85), (2, 0, 0.9)]
+        )
+        
+        # Stored by the file sorting first and read by the second, and the reverse
+        self.cache(self.first).set_many([(self.second, self.comparison)])
+        self.assertEqual(self.cache(self.second).get_many([self.first]), [swapped])
+        PairSimilarity.objects.all().delete()
+        self.cache(self.second).set_many([(self.first, swapped)])
+        self.assertEqual(self.cache(self.first).get_many([self.second]), [self.comparison])
+        self.assertEqual(self.cache(self.second).get_many([self.first]), [swapped])
+    
+    def test_identical_and_unhashed_files_are_not_cached(self):
+        cache = self.cache(self.first)
+        cache.set_many([(self.first, self.comparison), ({'id': 4, 'content_hash': ''}, self.comparison)])
+        self.assertEqual(PairSimilarity.objects.count(), 0)
+        self.assertEqual(cache.get_many([self.first]), [None])
+    
+    def test_evicts_least_recently_used(self):
+        cache = self.cache(self.first, max_size=2)
+        for source_info in (self.second, self.third, {'id': 4, 'content_hash': 'd' * 64}):
+            cache.set_many([(source_info, self.comparison)])
+        self.assertEqual(cache.get_many([self.second]), [self.comparison])
+        
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(cache.evict(), 0)
+        self.assertEqual(cache.get_many([self.second, self.third]), [self.comparison, None])
@@ -0,0 +1,142 @@
+import heapq
+from collections import namedtuple
+
+import numpy as np
+
+
+# Base of the polynomial hash of token id k-grams
+KGRAM_HASH_BASE = np.uint64(1099511628211)
+
+# k-grams occurring more often than this in either document are not used as
+# anchors, so repeated boilerplate cannot make the alignment quadratic
+MAX_ANCHOR_OCCURRENCES = 32
+
+# A run of identical tokens in two documents, by token index
+Tile = namedtuple('Tile', ['start1', 'start2', 'length'])
+
+
+def token_ids(words1, words2):
+    """Number the distinct words of two documents, giving each document an int64 id array"""
+    vocabulary = {}
+    
+    def ids(words):
+        return np.fromiter(
+            (vocabulary.setdefault(word, len(vocabulary)) for word in words),
+            dtype=np.int64, count=len(words)
+        )
+    
+    return ids(words1), ids(words2)
+
+
+def kgram_keys(ids, k):
+    """Hash every k-gram of token ids to a uint64"""
+    count = len(ids) - k + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.uint64)
+    values = ids.astype(np.uint64)
+    keys = np.zeros(count, dtype=np.uint64)
+    for offset in range(k):
+        keys = keys * KGRAM_HASH_BASE + values[offset:offset + count]
+    return keys
+
+
+def anchor_pairs(keys1, keys2):
+    """
+    Find the (position in first, position in second) pairs of equal k-gram keys
+    
+    Keys occurring more than MAX_ANCHOR_OCCURRENCES times in either document
+    are left out.
+    """
+    order = np.argsort(keys2, kind='stable')
+    sorted2 = keys2[order]
+    starts = np.searchsorted(sorted2, keys1, side='left')
+    counts = np.searchsorted(sorted2, keys1, side='right') - starts
+    
+    _, inverse, frequency = np.unique(keys1, return_inverse=True, return_counts=True)
+    counts[(counts > MAX_ANCHOR_OCCURRENCES) | (frequency[inverse] > MAX_ANCHOR_OCCURRENCES)] = 0
+    
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(starts, counts) + (np.arange(total) - offsets)
+    return np.repeat(np.arange(len(keys1)), counts), order[positions]
+
+
+def maximal_runs(ids1, ids2, k):
+    """
+    Find the maximal runs of at least k identical tokens the documents share
+    
+    Consecutive anchors on the same diagonal (equal position difference)
+    are joined into one run, and runs are checked token by token so that
+    hash collisions never produce a tile.
+    
+    Returns:
+        list: Tile of every run, by diagonal then position
+    """
+    first, second = anchor_pairs(kgram_keys(ids1, k), kgram_keys(ids2, k))
+    if not len(first):
+        return []
+    
+    diagonals = first - second
+    order = np.lexsort((first, diagonals))
+    first, diagonals = first[order], diagonals[order]
+    breaks = np.flatnonzero((np.diff(diagonals) != 0) | (np.diff(first) != 1)) + 1
+    run_starts = np.concatenate(([0], breaks))
+    run_ends = np.concatenate((breaks, [len(first)]))
+    
+    runs = []
+    for start, end in zip(run_starts.tolist(), run_ends.tolist()):
+        start1 = int(first[start])
+        start2 = start1 - int(diagonals[start])
+        end1 = int(first[end - 1]) + k
+        if runs and runs[-1].start1 - runs[-1].start2 == start1 - start2 \
+                and start1 <= runs[-1].start1 + runs[-1].length:
+            # Runs split by a skipped anchor still overlap on their diagonal
+            previous = runs.pop()
+            start1, start2 = previous.start1, previous.start2
+            end1 = max(end1, previous.start1 + previous.length)
+        runs.append(Tile(start1, start2, end1 - start1))
+    
+    return [
+        run for run in runs
+        if np.array_equal(ids1[run.start1:run.start1 + run.length], ids2[run.start2:run.start2 + run.length])
+    ]
+
+
+def tile(ids1, ids2, min_length):
+    """
+    Greedy string tiling of two token id arrays
+    
+    The longest shared run is taken as a tile first, and the tokens it
+    covers are marked in both documents. Runs overlapping marked tokens are
+    cut down to their unmarked parts, which compete again if they are still
+    at least min_length tokens long. Anchoring runs on k-gram hashes keeps
+    this close to linear in the documents' length instead of comparing
+    every pair of positions.
+    
+    Returns:
+        list: Non-overlapping Tile tuples, ordered by position in the first document
+    """
+    heap = [(-run.length, run.start1, run.start2) for run in maximal_runs(ids1, ids2, min_length)]
+    heapq.heapify(heap)
+    marked1 = np.zeros(len(ids1), dtype=bool)
+    marked2 = np.zeros(len(ids2), dtype=bool)
+    
+    tiles = []
+    while heap:
+        length, start1, start2 = heapq.heappop(heap)
+        length = -length
+        free = ~(marked1[start1:start1 + length] | marked2[start2:start2 + length])
+        if free.all():
+            tiles.append(Tile(start1, start2, length))
+            marked1[start1:start1 + length] = True
+            marked2[start2:start2 + length] = True
+            continue
+        
+        edges = np.diff(np.concatenate(([0], free.view(np.int8), [0])))
+        for start, end in zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()):
+            if end - start >= min_length:
+                heapq.heappush(heap, (start - end, start1 + start, start2 + start))
+    
+    return sorted(tiles)
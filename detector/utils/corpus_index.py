@@ -0,0 +1,334 @@
+import os
+import threading
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from .file_lock import file_lock
+from .normalization import normalize_text
+from .segments import SegmentedIndex, compact_segments
+
+
+INDEX_FILE_NAME = 'corpus_index.npz'
+
+# Segment files compact_corpus_index waits for before folding them into the
+# index file
+MAX_SEGMENTS = 64
+
+
+class CorpusIndex(SegmentedIndex):
+    """
+    Corpus-level TF-IDF index over assignment texts
+    
+    Term counts are hashed into a fixed feature space, so adding a document
+    never changes the columns of the documents already stored. Document
+    frequencies are kept up to date as documents come and go, and the IDF
+    weights and row norms derived from them are recomputed lazily after the
+    index changes, without reweighting the stored counts.
+    
+    Rows are held in blocks of decreasing size, merged two at a time once the
+    newer one is as large as the one before it, so adding one document at a
+    time copies each row a logarithmic number of times. Changes are appended
+    as segment files holding the counts of the documents they add and the
+    ids of those they remove, and folded into the index file by
+    compact_corpus_index.
+    """
+    
+    def __init__(self, path=None, n_features=2 ** 20):
+        super().__init__(path)
+        self.n_features = n_features
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features, alternate_sign=False, norm=None
+        )
+        self._clear()
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __contains__(self, doc_id):
+        return doc_id in self._positions
+    
+    @property
+    def counts(self):
+        """Hashed term counts of the indexed documents, one CSR row per id"""
+        if not self._blocks:
+            return sp.csr_matrix((0, self.n_features), dtype=np.float32)
+        if len(self._blocks) == 1:
+            return self._blocks[0]
+        return sp.vstack(self._blocks, format='csr')
+    
+    def vectorize(self, text):
+        """Hash the term counts of a text into a sparse row"""
+        return self.vectorizer.transform([normalize_text(text)]).astype(np.float32)
+    
+    def add(self, doc_id, text):
+        """Add a document to the index, replacing any previous version"""
+        self.add_many([(doc_id, text)])
+    
+    def add_many(self, documents):
+        """Add (doc_id, text) pairs to the index in a single batch"""
+        documents = list(documents)
+        if not documents:
+            return
+        
+        rows = self.vectorizer.transform(
+            [normalize_text(text) for _, text in documents]
+        ).astype(np.float32)
+        self.add_rows([doc_id for doc_id, _ in documents], rows)
+    
+    def add_rows(self, doc_ids, rows):
+        """Add documents whose term counts were already hashed with vectorize"""
+        doc_ids = list(doc_ids)
+        if doc_ids:
+            self._apply(doc_ids, [], self._rows(rows))
+    
+    def remove(self, doc_id):
+        """Remove a document from the index"""
+        self._apply([], [doc_id], self._rows(None))
+    
+    def append(self, documents=(), removed=(), rows=None):
+        """
+        Add and remove documents, persisting the change as a new segment file
+        
+        Added documents are (doc_id, text) pairs, or their ids when their term
+        counts are passed as rows. The caller must hold the index file's lock
+        and have applied every segment written so far, so that the new one is
+        numbered after them.
+        """
+        documents = list(documents)
+        if rows is None and documents:
+            rows = self.vectorizer.transform(
+                [normalize_text(text) for _, text in documents]
+            ).astype(np.float32)
+            documents = [doc_id for doc_id, _ in documents]
+        rows = self._rows(rows if documents else None)
+        removed = [doc_id for doc_id in removed if doc_id in self]
+        if not documents and not removed:
+            return
+        self._append_segment(
+            ids=np.asarray(documents, dtype=np.int64),
+            removed=np.asarray(removed, dtype=np.int64),
+            data=rows.data,
+            indices=rows.indices,
+            indptr=rows.indptr,
+            n_features=np.asarray(self.n_features),
+        )
+        self._apply(documents, removed, rows)
+    
+    def similarities(self, text, doc_ids=None):
+        """
+        Calculate the cosine similarity of a text against indexed documents
+        
+        Args:
+            text (str): The text to score
+            doc_ids (iterable): Documents to score against, all when omitted
+            
+        Returns:
+            dict: Similarity percentage keyed by document id. Ids that are
+            not in the index are left out.
+        """
+        if doc_ids is None:
+            doc_ids = self.ids
+        lookup = self.similarity_lookup(text)
+        similarities = {doc_id: lookup(doc_id) for doc_id in doc_ids}
+        return {doc_id: score for doc_id, score in similarities.items() if score is not None}
+    
+    def similarity_lookup(self, text):
+        """
+        Score a text against every indexed document with one sparse product
+        
+        The stored counts are multiplied by the normalized TF-IDF query, IDF
+        weighted once more, and divided by the norms of their TF-IDF rows,
+        which gives the cosine similarity without reweighting stored rows.
+        
+        Returns:
+            callable: lookup(doc_id) giving the similarity percentage, or None
+            for documents that are not in the index
+        """
+        if not self.ids:
+            return lambda doc_id: None
+        
+        idf, norms = self._weights()
+        query = normalize(self.vectorize(text).multiply(idf).tocsr()).multiply(idf).tocsr()
+        products = np.concatenate([(block @ query.T).toarray().ravel() for block in self._blocks])
+        scores = np.divide(products, norms, out=np.zeros_like(products), where=norms > 0) * 100
+        # Positions as of this product, the index may change while scores are looked up
+        positions = dict(self._positions)
+        
+        def lookup(doc_id):
+            position = positions.get(doc_id)
+            return None if position is None else float(scores[position])
+        
+        return lookup
+    
+    def weight(self, rows):
+        """Apply the corpus IDF to hashed term-count rows and L2-normalize them"""
+        idf, _ = self._weights()
+        return normalize(sp.csr_matrix(rows).multiply(idf).tocsr())
+    
+    def _clear(self):
+        self.ids = []
+        self._positions = {}
+        self._blocks = []
+        self._squares = []  # Squared counts of each block, for the row norms
+        self._df = np.zeros(self.n_features, dtype=np.int64)
+        self._invalidate()
+    
+    def _rows(self, rows):
+        """Return hashed term-count rows as canonical float32 CSR, each term stored once"""
+        if rows is None:
+            return sp.csr_matrix((0, self.n_features), dtype=np.float32)
+        rows = sp.csr_matrix(rows, dtype=np.float32)
+        if not rows.has_canonical_format:
+            # Rows of stored features can be read-only views of their bytes
+            rows = rows.copy()
+            rows.sum_duplicates()
+        return rows
+    
+    def _apply(self, added, removed, rows):
+        """Drop the added and removed documents, then append the rows of the added ones"""
+        # Replaced documents are dropped and appended again, and only the
+        # last of repeated ids is kept
+        last = {doc_id: position for position, doc_id in enumerate(added)}
+        if len(last) < len(added):
+            rows = rows[sorted(last.values())]
+            added = [added[position] for position in sorted(last.values())]
+        
+        dropped = {doc_id for doc_id in list(added) + list(removed) if doc_id in self._positions}
+        if dropped:
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[[self._positions[doc_id] for doc_id in dropped]] = False
+            blocks = []
+            squares = []
+            offset = 0
+            for block, square in zip(self._blocks, self._squares):
+                kept = keep[offset:offset + block.shape[0]]
+                offset += block.shape[0]
+                if not kept.all():
+                    self._df -= np.bincount(block[~kept].indices, minlength=self.n_features)
+                    block, square = block[kept], square[kept]
+                if block.shape[0]:
+                    blocks.append(block)
+                    squares.append(square)
+            self._blocks, self._squares = blocks, squares
+            self.ids = [doc_id for doc_id, kept in zip(self.ids, keep.tolist()) if kept]
+            self._positions = {doc_id: position for position, doc_id in enumerate(self.ids)}
+        
+        if added:
+            for doc_id in added:
+                self._positions[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+            self._df += np.bincount(rows.indices, minlength=self.n_features)
+            self._blocks.append(rows)
+            self._squares.append(sp.csr_matrix((rows.data ** 2, rows.indices, rows.indptr), shape=rows.shape))
+            while len(self._blocks) > 1 and self._blocks[-2].shape[0] <= self._blocks[-1].shape[0]:
+                block, square = self._blocks.pop(), self._squares.pop()
+                self._blocks[-1] = sp.vstack([self._blocks[-1], block], format='csr')
+                self._squares[-1] = sp.vstack([self._squares[-1], square], format='csr')
+        
+        if dropped or added:
+            self._invalidate()
+    
+    def _weights(self):
+        """Return the IDF vector and the L2 norms of the TF-IDF rows"""
+        if self._idf is None:
+            # Smoothed IDF, the same formula TfidfVectorizer uses
+            self._idf = (np.log((1 + len(self.ids)) / (1 + self._df)) + 1).astype(np.float32)
+            squared_idf = self._idf ** 2
+            self._norms = np.sqrt(np.concatenate(
+                [square @ squared_idf for square in self._squares] or [np.zeros(0, dtype=np.float32)]
+            ))
+        return self._idf, self._norms
+    
+    def _invalidate(self):
+        self._idf = None
+        self._norms = None
+    
+    def _file_arrays(self):
+        counts = self.counts
+        return {
+            'ids': np.asarray(self.ids, dtype=np.int64),
+            'data': counts.data,
+            'indices': counts.indices,
+            'indptr': counts.indptr,
+            'n_features': np.asarray(self.n_features),
+        }
+    
+    def _load_file(self, stored):
+        self.n_features = int(stored['n_features'])
+        self.vectorizer.set_params(n_features=self.n_features)
+        self._clear()
+        ids = stored['ids'].tolist()
+        self._apply(ids, [], self._rows(sp.csr_matrix(
+            (stored['data'], stored['indices'], stored['indptr']),
+            shape=(len(ids), self.n_features)
+        )))
+    
+    def _apply_segment(self, stored):
+        if int(stored['n_features']) == self.n_features:
+            self._apply(stored['ids'].tolist(), stored['removed'].tolist(), sp.csr_matrix(
+                (stored['data'], stored['indices'], stored['indptr']),
+                shape=(len(stored['ids']), self.n_features)
+            ))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def create_corpus_index():
+    """Create an empty corpus index stored in the Django settings' index directory"""
+    from django.conf import settings
+    
+    return CorpusIndex(os.path.join(settings.PLAGIARISM_INDEX_DIR, INDEX_FILE_NAME))
+
+
+def get_corpus_index():
+    """Return the process-wide corpus index, catching up with changes saved on disk"""
+    global _index
+    
+    with _index_lock:
+        if _index is None:
+            _index = create_corpus_index().load()
+        else:
+            _index.refresh()
+        return _index
+
+
+def update_corpus_index(doc_id, text=None, row=None):
+    """
+    Add or replace a document in the shared index and persist it
+    
+    Pass either the document's text or its term counts as hashed by
+    CorpusIndex.vectorize. The change is written as a segment file. The index
+    file stays locked from catching up to writing it, so segments from other
+    processes are not overwritten.
+    """
+    with file_lock(get_corpus_index().path):
+        index = get_corpus_index()
+        with _index_lock:
+            if row is not None:
+                index.append([doc_id], rows=row)
+            else:
+                index.append([(doc_id, text)])
+
+
+def remove_from_corpus_index(doc_id):
+    """Remove a document from the shared index and persist it"""
+    with file_lock(get_corpus_index().path):
+        index = get_corpus_index()
+        with _index_lock:
+            index.append(removed=[doc_id])
+
+
+def compact_corpus_index():
+    """
+    Fold the corpus index's segment files into its index file once
+    MAX_SEGMENTS are not in it
+    
+    Returns:
+        bool: Whether the index was compacted
+    """
+    return compact_segments(create_corpus_index(), MAX_SEGMENTS)
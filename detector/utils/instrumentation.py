@@ -0,0 +1,59 @@
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class StageMetrics:
+    """
+    Timers and counters of the stages of one plagiarism check
+    
+    Time spent in a stage accumulates over every time it is entered, so
+    per-reference stages report their total. Metrics collected in worker
+    processes are merged in with merge, their times adding up to more than
+    the wall-clock time when references are compared in parallel.
+    """
+    
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.counters = defaultdict(int)
+    
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as part of a stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - started
+    
+    def count(self, name, value=1):
+        """Increment a counter"""
+        self.counters[name] += value
+    
+    def merge(self, other):
+        """Add the timings and counters of another StageMetrics or its as_dict()"""
+        if isinstance(other, StageMetrics):
+            other = other.as_dict()
+        for name, seconds in other.get('timings', {}).items():
+            self.timings[name] += seconds
+        for name, value in other.get('counters', {}).items():
+            self.counters[name] += value
+    
+    def as_dict(self):
+        """Return the metrics as plain, JSON-serializable dicts"""
+        return {'timings': dict(self.timings), 'counters': dict(self.counters)}
+
+
+def peak_memory_bytes():
+    """Return the highest resident set size this process has reached so far, if known"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
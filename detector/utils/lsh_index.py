@@ -0,0 +1,330 @@
+import os
+import threading
+
+import numpy as np
+
+from .file_lock import file_lock
+from .segments import SegmentedIndex, compact_segments
+
+
+INDEX_FILE_NAME = 'lsh_index.npz'
+
+# Segment files compact_lsh_index waits for before folding them into the
+# index file
+MAX_SEGMENTS = 64
+
+# Bumped whenever the fingerprint hashing changes, which invalidates the
+# stored signatures
+SIGNATURE_VERSION = 2
+
+# Permutations are computed modulo a Mersenne prime small enough that
+# a * x + b never overflows uint64
+MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+
+
+class MinHasher:
+    """Compute MinHash signatures of hashed k-gram fingerprints"""
+    
+    def __init__(self, num_perm=128, seed=1):
+        self.num_perm = num_perm
+        self.seed = seed
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, int(MERSENNE_PRIME), size=(num_perm, 1)).astype(np.uint64)
+        self.b = generator.randint(0, int(MERSENNE_PRIME), size=(num_perm, 1)).astype(np.uint64)
+    
+    def signature(self, fingerprint):
+        """
+        Return the MinHash signature of a fingerprint
+        
+        Args:
+            fingerprint (numpy.ndarray): uint64 k-gram hashes
+            
+        Returns:
+            numpy.ndarray: num_perm uint32 values, or None for an empty fingerprint
+        """
+        if not len(fingerprint):
+            return None
+        hashes = np.asarray(fingerprint, dtype=np.uint64) % MERSENNE_PRIME
+        permuted = (self.a * hashes + self.b) % MERSENNE_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+    
+    @staticmethod
+    def estimate_jaccard(signature1, signature2):
+        """Estimate the Jaccard similarity of two signatures"""
+        return float(np.mean(signature1 == signature2))
+
+
+class LSHIndex(SegmentedIndex):
+    """
+    Locality-sensitive hashing index over MinHash signatures
+    
+    Signatures are split into `bands` bands of `rows` values. Two documents
+    become candidates when at least one band is identical, which happens with
+    probability 1 - (1 - J ** rows) ** bands for Jaccard similarity J. More
+    bands or fewer rows raise recall at the cost of more candidates.
+    
+    Each band keeps its bucket hashes in a sorted array, so a lookup is a
+    binary search per band instead of a scan over the archive. New documents
+    are merged in at their sorted positions rather than sorting again.
+    
+    Changes are appended as segment files holding the signatures of the
+    documents they add and the ids of those they remove, and folded into the
+    index file by compact_lsh_index. Signatures of a different length or
+    version are ignored until the index is rebuilt.
+    """
+    
+    def __init__(self, path=None, bands=64, rows=2, seed=1):
+        super().__init__(path)
+        self.bands = bands
+        self.rows = rows
+        self.hasher = MinHasher(num_perm=bands * rows, seed=seed)
+        self._band_multipliers = np.random.RandomState(seed + 1).randint(
+            1, 2 ** 62, size=rows, dtype=np.int64
+        ).astype(np.uint64)
+        self._clear()
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __contains__(self, doc_id):
+        return doc_id in self._positions
+    
+    @property
+    def signatures(self):
+        """Signatures of the indexed documents, one row per id"""
+        return self._rows[:len(self.ids)]
+    
+    def add(self, doc_id, fingerprint):
+        """Add a document's fingerprint to the index, replacing any previous version"""
+        self.add_many([(doc_id, fingerprint)])
+    
+    def add_many(self, documents):
+        """Add (doc_id, fingerprint) pairs to the index in a single batch"""
+        self._apply(*self._signatures(documents), [])
+    
+    def remove(self, doc_id):
+        """Remove a document from the index"""
+        self._apply([], [], [doc_id])
+    
+    def append(self, documents=(), removed=()):
+        """
+        Add and remove documents, persisting the change as a new segment file
+        
+        The caller must hold the index file's lock and have applied every
+        segment written so far, so that the new one is numbered after them.
+        """
+        added, signatures = self._signatures(documents)
+        removed = [doc_id for doc_id in removed if doc_id in self]
+        if not added and not removed:
+            return
+        self._append_segment(
+            ids=np.asarray(added, dtype=np.int64),
+            removed=np.asarray(removed, dtype=np.int64),
+            signatures=signatures,
+            seed=np.asarray(self.hasher.seed),
+            version=np.asarray(SIGNATURE_VERSION),
+        )
+        self._apply(added, signatures, removed)
+    
+    def query(self, fingerprint, limit=None):
+        """
+        Find indexed documents likely to be similar to a fingerprint
+        
+        Args:
+            fingerprint (numpy.ndarray): uint64 k-gram hashes
+            limit (int): Most candidates returned, keeping those sharing the
+                most bands with the fingerprint
+            
+        Returns:
+            set: Ids of the candidate documents
+        """
+        signature = self.hasher.signature(fingerprint)
+        if signature is None or not self.ids:
+            return set()
+        
+        buckets = self._bucket_index()
+        query_keys = self._band_keys(signature[np.newaxis, :])[0]
+        
+        hits = []
+        for band, (keys, order) in enumerate(buckets):
+            start = np.searchsorted(keys, query_keys[band], side='left')
+            end = np.searchsorted(keys, query_keys[band], side='right')
+            hits.append(order[start:end])
+        positions, counts = np.unique(np.concatenate(hits), return_counts=True)
+        if limit is not None and len(positions) > limit:
+            positions = positions[np.argsort(-counts, kind='stable')[:limit]]
+        
+        return {self.ids[position] for position in positions.tolist()}
+    
+    def _clear(self):
+        self.ids = []
+        self._rows = np.empty((0, self.hasher.num_perm), dtype=np.uint32)
+        self._positions = {}
+        self._buckets = None
+    
+    def _signatures(self, documents):
+        """Compute the ids and signature rows of (doc_id, fingerprint) pairs, skipping empty fingerprints"""
+        ids = []
+        signatures = []
+        for doc_id, fingerprint in documents:
+            signature = self.hasher.signature(fingerprint)
+            if signature is not None:
+                ids.append(doc_id)
+                signatures.append(signature)
+        return ids, np.asarray(signatures, dtype=np.uint32).reshape(len(ids), self.hasher.num_perm)
+    
+    def _apply(self, added, signatures, removed):
+        """Drop the removed documents, then add or replace the signatures of the added ones"""
+        removed = [doc_id for doc_id in removed if doc_id in self._positions]
+        if removed:
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[[self._positions[doc_id] for doc_id in removed]] = False
+            self._rows = self.signatures[keep]
+            self.ids = [doc_id for doc_id, kept in zip(self.ids, keep.tolist()) if kept]
+            self._positions = {doc_id: position for position, doc_id in enumerate(self.ids)}
+            if self._buckets is not None:
+                # Renumber the remaining rows in place of sorting again
+                renumbered = np.cumsum(keep) - 1
+                self._buckets = [
+                    (keys[keep[order]], renumbered[order[keep[order]]]) for keys, order in self._buckets
+                ]
+        
+        new = {}
+        for doc_id, signature in zip(added, signatures):
+            if doc_id in self._positions:
+                self._rows[self._positions[doc_id]] = signature
+                self._buckets = None
+            else:
+                new[doc_id] = signature
+        if not new:
+            return
+        
+        start = len(self.ids)
+        rows = np.asarray(list(new.values()), dtype=np.uint32)
+        if start + len(rows) > len(self._rows):
+            # Grown geometrically, so adding one document at a time copies
+            # the signatures a constant number of times on average
+            grown = np.empty((max(start + len(rows), 2 * len(self._rows)), self.hasher.num_perm), dtype=np.uint32)
+            grown[:start] = self.signatures
+            self._rows = grown
+        self._rows[start:start + len(rows)] = rows
+        for offset, doc_id in enumerate(new):
+            self._positions[doc_id] = start + offset
+        self.ids.extend(new)
+        
+        if self._buckets is not None:
+            keys = self._band_keys(rows)
+            positions = np.arange(start, start + len(rows))
+            for band, (band_keys, order) in enumerate(self._buckets):
+                new_order = np.argsort(keys[:, band], kind='stable')
+                at = np.searchsorted(band_keys, keys[new_order, band], side='right')
+                self._buckets[band] = (
+                    np.insert(band_keys, at, keys[new_order, band]),
+                    np.insert(order, at, positions[new_order])
+                )
+    
+    def _band_keys(self, signatures):
+        """Hash every band of every signature to one uint64 key"""
+        banded = signatures.astype(np.uint64).reshape(len(signatures), self.bands, self.rows)
+        return (banded * self._band_multipliers).sum(axis=2)
+    
+    def _bucket_index(self):
+        """Return (sorted keys, row order) for every band"""
+        if self._buckets is None:
+            keys = self._band_keys(self.signatures)
+            self._buckets = []
+            for band in range(self.bands):
+                order = np.argsort(keys[:, band], kind='stable')
+                self._buckets.append((keys[order, band], order))
+        return self._buckets
+    
+    def _compatible(self, stored):
+        """
+        Whether stored signatures were computed like this index's
+        
+        Band buckets are derived from the signatures, so bands and rows can be
+        retuned without a rebuild as long as their product stays the same.
+        """
+        return ('version' in stored.files
+                and int(stored['version']) == SIGNATURE_VERSION
+                and stored['signatures'].shape[1] == self.hasher.num_perm
+                and int(stored['seed']) == self.hasher.seed)
+    
+    def _file_arrays(self):
+        return {
+            'ids': np.asarray(self.ids, dtype=np.int64),
+            'signatures': self.signatures,
+            'seed': np.asarray(self.hasher.seed),
+            'version': np.asarray(SIGNATURE_VERSION),
+        }
+    
+    def _load_file(self, stored):
+        if not self._compatible(stored):
+            return
+        self.ids = stored['ids'].tolist()
+        self._rows = stored['signatures']
+        self._positions = {doc_id: position for position, doc_id in enumerate(self.ids)}
+    
+    def _apply_segment(self, stored):
+        if self._compatible(stored):
+            self._apply(stored['ids'].tolist(), stored['signatures'], stored['removed'].tolist())
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def create_lsh_index():
+    """Create an empty LSH index configured from the Django settings"""
+    from django.conf import settings
+    
+    return LSHIndex(
+        os.path.join(settings.PLAGIARISM_INDEX_DIR, INDEX_FILE_NAME),
+        bands=settings.PLAGIARISM_LSH_BANDS,
+        rows=settings.PLAGIARISM_LSH_ROWS,
+    )
+
+
+def get_lsh_index():
+    """Return the process-wide LSH index, catching up with changes saved on disk"""
+    global _index
+    
+    with _index_lock:
+        if _index is None:
+            _index = create_lsh_index().load()
+        else:
+            _index.refresh()
+        return _index
+
+
+def update_lsh_index(doc_id, fingerprint):
+    """
+    Add or replace a document in the shared LSH index and persist it
+    
+    The change is written as a segment file. The index file stays locked from
+    catching up to writing it, so segments from other processes are not
+    overwritten.
+    """
+    with file_lock(get_lsh_index().path):
+        index = get_lsh_index()
+        with _index_lock:
+            index.append(documents=[(doc_id, fingerprint)])
+
+
+def remove_from_lsh_index(doc_id):
+    """Remove a document from the shared LSH index and persist it"""
+    with file_lock(get_lsh_index().path):
+        index = get_lsh_index()
+        with _index_lock:
+            index.append(removed=[doc_id])
+
+
+def compact_lsh_index():
+    """
+    Fold the LSH index's segment files into its index file once MAX_SEGMENTS
+    are not in it
+    
+    Returns:
+        bool: Whether the index was compacted
+    """
+    return compact_segments(create_lsh_index(), MAX_SEGMENTS)
@@ -0,0 +1,90 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+
+
+# Characters that are neither word characters nor whitespace, dropped in place
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]+')
+
+# Whitespace-delimited chunks of the original text
+CHUNK_PATTERN = re.compile(r'\S+')
+
+# Chunks with a word character, those that leave a word once punctuation is dropped
+WORD_CHUNK_PATTERN = re.compile(r'\S*\w\S*')
+
+
+class TextNormalizer:
+    """
+    Normalize text for comparison: lowercase, drop punctuation, collapse whitespace
+    
+    Punctuation is removed with one precompiled pattern and whitespace is
+    collapsed by splitting, so a text is scanned once by the regex engine.
+    Results are memoized per instance, documents and sentences in separate
+    caches so the many short sentences of a check do not evict its documents.
+    Documents' words with their offsets are memoized too, by tokenize.
+    """
+    
+    def __init__(self, unicode_form=None, casefold=False, cache_size=32, sentence_cache_size=4096):
+        # Optional unicodedata normalization form applied first, e.g. 'NFKC'
+        self.unicode_form = unicode_form
+        # Casefold rather than lowercase, which also folds e.g. 'ß' to 'ss'
+        self.casefold = casefold
+        self.normalize = lru_cache(maxsize=cache_size)(self.apply)
+        self.normalize_sentence = lru_cache(maxsize=sentence_cache_size)(self.apply)
+        self.tokenize = lru_cache(maxsize=cache_size)(self.words_with_offsets)
+    
+    def config(self):
+        """Options that determine the output of apply"""
+        return {'unicode_form': self.unicode_form, 'casefold': self.casefold}
+    
+    def apply(self, text):
+        """Normalize a text without consulting the caches"""
+        if self.unicode_form:
+            text = unicodedata.normalize(self.unicode_form, text)
+        text = text.casefold() if self.casefold else text.lower()
+        return ' '.join(PUNCTUATION_PATTERN.sub('', text).split())
+    
+    def normalize_with_offsets(self, text):
+        """
+        Normalize a text, keeping where each normalized word came from
+        
+        Whitespace-delimited chunks of the text are normalized on their own,
+        which gives the same words as normalizing the whole text. When case
+        folding keeps every character in place, the whole text is normalized
+        at once instead and matched up with its chunks.
+        
+        Returns:
+            tuple: (normalized text, int64 array of the (start, end) offsets
+            in text of the chunk each normalized word came from)
+        """
+        if not self.unicode_form:
+            folded = text.casefold() if self.casefold else text.lower()
+            if len(folded) == len(text):
+                words = PUNCTUATION_PATTERN.sub('', folded).split()
+                spans = [chunk.span() for chunk in WORD_CHUNK_PATTERN.finditer(folded)]
+                if len(words) == len(spans):
+                    return ' '.join(words), np.array(spans, dtype=np.int64).reshape(-1, 2)
+        
+        words = []
+        spans = []
+        for chunk in CHUNK_PATTERN.finditer(text):
+            for word in self.apply(chunk.group()).split():
+                words.append(word)
+                spans.append(chunk.span())
+        return ' '.join(words), np.array(spans, dtype=np.int64).reshape(-1, 2)
+    
+    def words_with_offsets(self, text):
+        """Return the normalized words of a text and the offsets they came from, see normalize_with_offsets"""
+        normalized, spans = self.normalize_with_offsets(text)
+        return normalized.split(), spans
+
+
+# Normalizer shared by the detector and the corpus index
+default_normalizer = TextNormalizer()
+
+
+def normalize_text(text):
+    """Normalize a document with the shared normalizer, memoized"""
+    return default_normalizer.normalize(text)
@@ -1,36 +1,201 @@
-import nltk
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import re
+import heapq
+import math
+import multiprocessing
+import zlib
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
 
-# Download necessary NLTK data
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
+from .alignment import tile, token_ids
+from .instrumentation import StageMetrics
+from .normalization import TextNormalizer, default_normalizer
+from .sentences import split_sentences
+
+
+# Bump when feature extraction changes in a way the parameters do not capture
+FEATURES_VERSION = 3
+
+# Bump when comparing two documents' features changes in a way the parameters do not capture
+COMPARISON_VERSION = 3
+
+# Sentences shorter than this many characters are never matched
+MIN_SENTENCE_LENGTH = 20
+
+# Characters of copied passages kept as a match's matched_text
+MATCHED_TEXT_LENGTH = 1000
+
+# Per-document inputs of a comparison that depend only on the document itself.
+# sentence_ngrams is a (hashes, sentence indices) pair, computed when needed.
+# fingerprint_positions holds a (fingerprint index, first word) int32 row per
+# winnowed k-gram, in text order.
+DocumentFeatures = namedtuple('DocumentFeatures',
+                              ['sentences', 'fingerprint', 'sentence_ngrams', 'fingerprint_positions'],
+                              defaults=(None, None))
+
+# Fingerprint overlap of two documents as percentages: the Jaccard similarity,
+# the share of each document's k-grams found in the other (containment) and
+# the share of each document's fingerprinted words inside shared k-grams
+# (coverage), with those words counted too
+FingerprintScores = namedtuple('FingerprintScores', [
+    'jaccard', 'containment', 'reference_containment', 'coverage', 'reference_coverage',
+    'matched_words', 'reference_matched_words'
+])
+
+# Outputs of a comparison that depend only on the two documents, with
+# sentence_pairs as (index in text, index in reference, similarity) tuples
+PairComparison = namedtuple('PairComparison', ['fingerprint_scores', 'sentence_pairs'])
+
+# A passage copied word for word, as character offsets into both texts
+Passage = namedtuple('Passage', ['text_start', 'text_end', 'source_start', 'source_end', 'words'])
+
+# Base of the polynomial rolling hash over word hashes (the 64-bit FNV prime)
+ROLLING_HASH_BASE = np.uint64(1099511628211)
+
+
+def mix_hashes(hashes):
+    """Scramble uint64 hashes with the splitmix64 finalizer"""
+    hashes = hashes ^ (hashes >> np.uint64(30))
+    hashes = hashes * np.uint64(0xbf58476d1ce4e5b9)
+    hashes = hashes ^ (hashes >> np.uint64(27))
+    hashes = hashes * np.uint64(0x94d049bb133111eb)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def shared_hashes(fingerprint1, fingerprint2):
+    """
+    Merge two sorted, duplicate-free fingerprints in one pass
+    
+    Returns:
+        tuple: Boolean masks of the hashes of each fingerprint that the other has
+    """
+    shared1 = np.zeros(len(fingerprint1), dtype=bool)
+    shared2 = np.zeros(len(fingerprint2), dtype=bool)
+    if not len(fingerprint1) or not len(fingerprint2):
+        return shared1, shared2
+    positions = np.searchsorted(fingerprint2, fingerprint1)
+    np.minimum(positions, len(fingerprint2) - 1, out=positions)
+    shared1 = fingerprint2[positions] == fingerprint1
+    shared2[positions[shared1]] = True
+    return shared1, shared2
+
+
+def covered_words(starts, k):
+    """Count the words in the union of the k-word spans starting at sorted word positions"""
+    if not len(starts):
+        return 0
+    return k + int(np.minimum(np.diff(starts), k).sum())
+
+
+def match_weight(match):
+    """Weight of a match in the overall score: its matched words, at least one"""
+    return max(match.get('matched_words') or 0, 1)
+
+
+def fingerprint_to_bytes(fingerprint):
+    """Serialize a fingerprint for storage"""
+    return np.asarray(fingerprint, dtype='<u8').tobytes()
+
+
+def fingerprint_from_bytes(data):
+    """Deserialize a fingerprint stored with fingerprint_to_bytes"""
+    return np.frombuffer(data, dtype='<u8').astype(np.uint64)
+
+
+def spans_to_bytes(passages):
+    """Pack the (text_start, text_end, source_start, source_end) offsets of passages for storage"""
+    spans = [passage[:4] for passage in passages]
+    return np.array(spans, dtype='<i4').reshape(-1, 4).tobytes()
+
+
+def spans_from_bytes(data):
+    """Unpack offsets stored with spans_to_bytes into an (n, 4) array"""
+    return np.frombuffer(data, dtype='<i4').reshape(-1, 4)
+
+
+def expand_ranges(starts, counts):
+    """Concatenate the ranges start, ..., start + count - 1 without a Python loop"""
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + (np.arange(total) - offsets)
+
+
+def unique_pairs(first, second):
+    """Return the distinct (first, second) pairs of two int64 arrays as sorted rows"""
+    if not len(first):
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.stack([first, second], axis=1), axis=0)
 
 
 class PlagiarismDetector:
     """Class for detecting plagiarism in text documents"""
     
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer()
+    def __init__(self, workers=1, chunk_size=16, max_matches=None, k=5, window=4, sentence_threshold=0.8,
+                 normalizer=None, sentence_ngram_size=3, passage_length=8):
+        # Shared so that texts normalized once are not normalized again in the same process
+        self.normalizer = normalizer or default_normalizer
+        # Words per hashed k-gram and k-grams per winnowing window
+        self.k = k
+        self.window = window
+        # Minimum similarity (0-1) of a matching sentence pair
+        self.sentence_threshold = sentence_threshold
+        # Words per n-gram two sentences must share to be scored at all
+        self.sentence_ngram_size = sentence_ngram_size
+        # Fewest identical consecutive words reported as a copied passage
+        self.passage_length = passage_length
+        # Processes comparing references in parallel, 1 keeps everything in-process
+        self.workers = workers
+        # References sent to a worker per task
+        self.chunk_size = chunk_size
+        # Highest-scoring matches kept per check, None keeps them all
+        self.max_matches = max_matches
     
     def preprocess_text(self, text):
-        """Preprocess text for plagiarism detection"""
-        # Convert to lowercase
-        text = text.lower()
-        
-        # Remove special characters and extra whitespace
-        text = re.sub(r'[^\w\s]', '', text)
-        text = re.sub(r'\s+', ' ', text).strip()
-        
-        return text
+        """Preprocess text for plagiarism detection (lowercase, cleaned, memoized)"""
+        return self.normalizer.normalize(text)
     
     def get_sentences(self, text):
         """Split text into sentences"""
-        return nltk.sent_tokenize(text)
+        return split_sentences(text)
+    
+    def sentence_spans(self, text):
+        """Return the (start, end) character offsets of the text's sentences"""
+        spans = []
+        position = 0
+        for sent in self.get_sentences(text):
+            start = text.find(sent, position)
+            if start < 0:
+                # The tokenizer rewrote the sentence, keep what it returned in place
+                start = position
+            spans.append((start, start + len(sent)))
+            position = spans[-1][1]
+        return spans
+    
+    def feature_config(self):
+        """Parameters that determine the output of extract_features"""
+        return {
+            'version': FEATURES_VERSION,
+            'k': self.k,
+            'window': self.window,
+            'normalization': self.normalizer.config()
+        }
+    
+    def comparison_config(self):
+        """Parameters that determine the output of compare_pair"""
+        return dict(self.feature_config(), comparison_version=COMPARISON_VERSION,
+                    sentence_threshold=self.sentence_threshold,
+                    sentence_ngram_size=self.sentence_ngram_size)
+    
+    def sentence_ngram_config(self):
+        """Parameters that determine the output of sentence_ngrams"""
+        return dict(self.feature_config(), sentence_ngram_size=self.sentence_ngram_size)
+    
+    def extract_features(self, text):
+        """Compute the sentences and fingerprint of a text once for all its comparisons"""
+        fingerprint, positions = self.fingerprint_with_positions(text)
+        return DocumentFeatures(self.get_sentences(text), fingerprint, fingerprint_positions=positions)
     
     def calculate_similarity(self, text1, text2):
         """Calculate cosine similarity between two texts"""
@@ -38,107 +203,731 @@ class PlagiarismDetector:
         text1 = self.preprocess_text(text1)
         text2 = self.preprocess_text(text2)
         
+        # scikit-learn takes a second to import, it is loaded on first use
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.metrics.pairwise import cosine_similarity
+        
         # Create TF-IDF matrix
-        tfidf_matrix = self.vectorizer.fit_transform([text1, text2])
+        tfidf_matrix = TfidfVectorizer().fit_transform([text1, text2])
         
         # Calculate cosine similarity
         similarity = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0]
         
         return similarity * 100  # Convert to percentage
     
-    def find_matching_sentences(self, text1, text2, threshold=0.8):
-        """Find matching sentences between two texts"""
-        sentences1 = self.get_sentences(text1)
-        sentences2 = self.get_sentences(text2)
+    def find_matching_sentences(self, text1, text2, threshold=0.8, sentences1=None, sentences2=None):
+        """Find matching sentences between two texts, optionally already split"""
+        if sentences1 is None:
+            sentences1 = self.get_sentences(text1)
+        if sentences2 is None:
+            sentences2 = self.get_sentences(text2)
         
-        matches = []
+        return [
+            {
+                'text1_sentence': sentences1[i],
+                'text2_sentence': sentences2[j],
+                'similarity': similarity
+            }
+            for i, j, similarity in self.match_sentence_indices(sentences1, sentences2, threshold)
+        ]
+    
+    def find_passages(self, text1, text2):
+        """
+        Find the passages copied word for word between two texts
         
-        for i, sent1 in enumerate(sentences1):
-            for j, sent2 in enumerate(sentences2):
-                if len(sent1) < 20 or len(sent2) < 20:  # Skip very short sentences
-                    continue
-                
-                similarity = self.calculate_similarity(sent1, sent2)
-                
-                if similarity >= threshold * 100:
-                    matches.append({
-                        'text1_sentence': sent1,
-                        'text2_sentence': sent2,
-                        'similarity': similarity
-                    })
+        The normalized word streams are aligned by greedy string tiling, so
+        passages may cross sentence boundaries and are found in time close
+        to linear in the texts' length. Offsets span whole whitespace-delimited
+        chunks of the original texts, punctuation included.
         
-        return matches
+        Returns:
+            list: Non-overlapping Passage tuples of at least passage_length
+            words, in the order they appear in text1
+        """
+        words1, spans1 = self.normalizer.tokenize(text1)
+        words2, spans2 = self.normalizer.tokenize(text2)
+        ids1, ids2 = token_ids(words1, words2)
+        return [
+            Passage(
+                int(spans1[start1][0]), int(spans1[start1 + length - 1][1]),
+                int(spans2[start2][0]), int(spans2[start2 + length - 1][1]),
+                length
+            )
+            for start1, start2, length in tile(ids1, ids2, self.passage_length)
+        ]
     
-    def fingerprint_text(self, text, k=5):
-        """Create a fingerprint of the text using k-grams"""
-        text = self.preprocess_text(text)
-        words = text.split()
+    def passage_text(self, text, passages):
+        """Join the passages' text, cut to MATCHED_TEXT_LENGTH characters"""
+        matched_text = "\n".join(text[passage.text_start:passage.text_end] for passage in passages)
+        return matched_text[:MATCHED_TEXT_LENGTH]
+    
+    def match_sentence_indices(self, sentences1, sentences2, threshold=0.8, candidates=None):
+        """
+        Find matching sentences between two lists of sentences
         
-        # Generate k-grams
-        k_grams = []
-        for i in range(len(words) - k + 1):
-            k_grams.append(' '.join(words[i:i+k]))
+        Args:
+            candidates (numpy.ndarray): Optional (index in sentences1, index in
+                sentences2) rows, sorted. Only these pairs are scored.
+        
+        Returns:
+            list: (index in sentences1, index in sentences2, similarity) tuples
+        """
+        if candidates is not None:
+            if not len(candidates):
+                return []
+            # Only sentences that take part in a candidate pair are vectorized
+            index1, rows = np.unique(candidates[:, 0], return_inverse=True)
+            index2, cols = np.unique(candidates[:, 1], return_inverse=True)
+            index1 = index1.tolist()
+            index2 = index2.tolist()
+        else:
+            # Skip very short sentences
+            index1 = [i for i, sent in enumerate(sentences1) if len(sent) >= MIN_SENTENCE_LENGTH]
+            index2 = [j for j, sent in enumerate(sentences2) if len(sent) >= MIN_SENTENCE_LENGTH]
+        
+        if not index1 or not index2:
+            return []
+        
+        similarities = self.sentence_similarity_matrix(
+            [sentences1[i] for i in index1],
+            [sentences2[j] for j in index2]
+        )
         
-        return k_grams
+        if candidates is not None:
+            # Candidates are sorted, which keeps the matches in nested-loop order
+            scores = similarities[rows, cols]
+            selected = np.flatnonzero(scores >= threshold * 100)
+            return [
+                (index1[rows[position]], index2[cols[position]], float(scores[position]))
+                for position in selected.tolist()
+            ]
+        
+        # np.nonzero walks the matrix in row-major order, which keeps the
+        # matches in the same order as a nested loop over the sentences
+        rows, cols = np.nonzero(similarities >= threshold * 100)
+        
+        return [
+            (index1[row], index2[col], float(similarities[row, col]))
+            for row, col in zip(rows.tolist(), cols.tolist())
+        ]
     
-    def compare_fingerprints(self, fingerprint1, fingerprint2):
-        """Compare two fingerprints and calculate similarity"""
-        set1 = set(fingerprint1)
-        set2 = set(fingerprint2)
+    def sentence_ngrams(self, sentences):
+        """
+        Hash the word n-grams of every sentence long enough to be matched
         
-        # Calculate Jaccard similarity
-        intersection = len(set1.intersection(set2))
-        union = len(set1.union(set2))
+        Sentences of fewer than sentence_ngram_size words are hashed whole.
         
-        if union == 0:
-            return 0
+        Returns:
+            tuple: (uint64 n-gram hashes, int32 index of the sentence of each),
+            each hash listed once per sentence
+        """
+        hashes = []
+        owners = []
+        for index, sent in enumerate(sentences):
+            if len(sent) < MIN_SENTENCE_LENGTH:
+                continue
+            words = self.normalizer.normalize_sentence(sent).split()
+            if not words:
+                continue
+            sentence_hashes = np.unique(
+                self.hash_word_kgrams(words, min(self.sentence_ngram_size, len(words)))
+            )
+            hashes.append(sentence_hashes)
+            owners.append(np.full(len(sentence_hashes), index, dtype=np.int32))
         
-        return (intersection / union) * 100
+        if not hashes:
+            return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int32)
+        return np.concatenate(hashes), np.concatenate(owners)
     
-    def detect_plagiarism(self, text, reference_texts):
+    def candidate_sentence_pairs(self, ngrams1, ngrams2):
         """
-        Detect plagiarism by comparing text with reference texts
+        Find the sentence pairs of two documents that share a word n-gram
         
         Args:
-            text (str): The text to check for plagiarism
-            reference_texts (list): List of (text, source_info) tuples to compare against
+            ngrams1 (tuple): sentence_ngrams of the first document
+            ngrams2 (tuple): sentence_ngrams of the second document
             
         Returns:
-            dict: Plagiarism detection results
+            numpy.ndarray: Sorted, unique (index in first, index in second) rows
         """
-        overall_score = 0
-        matches = []
+        hashes1, owners1 = ngrams1
+        hashes2, owners2 = ngrams2
+        order = np.argsort(hashes2, kind='stable')
+        sorted_hashes = hashes2[order]
+        
+        starts = np.searchsorted(sorted_hashes, hashes1, side='left')
+        counts = np.searchsorted(sorted_hashes, hashes1, side='right') - starts
+        first = np.repeat(owners1.astype(np.int64), counts)
+        second = owners2[order[expand_ranges(starts, counts)]].astype(np.int64)
+        
+        return unique_pairs(first, second)
+    
+    def sentence_similarity_matrix(self, sentences1, sentences2):
+        """
+        Calculate the similarity of every sentence pair in one pass
+        
+        calculate_similarity fits a TF-IDF model on just the two sentences it
+        compares, so a term gets an IDF of 1 when both sentences contain it and
+        1 + ln(3/2) when only one does. Both sentence lists are counted once
+        and the shared/unshared parts of every pair's norms are derived with
+        sparse matrix products, which gives the same scores without refitting
+        a vectorizer per pair.
+        
+        Returns:
+            numpy.ndarray: len(sentences1) x len(sentences2) similarity percentages
+        """
+        from sklearn.feature_extraction.text import CountVectorizer
+        
+        counter = CountVectorizer()
+        try:
+            counts = counter.fit_transform(
+                [self.normalizer.normalize_sentence(sent) for sent in sentences1 + sentences2]
+            ).astype(np.float64)
+        except ValueError:
+            # No sentence contains a single token
+            return np.zeros((len(sentences1), len(sentences2)))
         
-        # Create fingerprint of the text
-        text_fingerprint = self.fingerprint_text(text)
+        counts1 = counts[:len(sentences1)]
+        counts2 = counts[len(sentences1):]
+        present1 = (counts1 > 0).astype(np.float64)
+        present2 = (counts2 > 0).astype(np.float64)
+        squares1 = counts1.multiply(counts1)
+        squares2 = counts2.multiply(counts2)
         
-        for ref_text, source_info in reference_texts:
-            # Calculate overall similarity
+        # Dot product over shared terms (IDF is 1 for those)
+        dot = (counts1 @ counts2.T).toarray()
+        
+        # Squared norm of each sentence, split into shared and unshared terms
+        shared1 = (squares1 @ present2.T).toarray()
+        shared2 = (present1 @ squares2.T).toarray()
+        total1 = np.asarray(squares1.sum(axis=1))
+        total2 = np.asarray(squares2.sum(axis=1)).T
+        
+        unshared_weight = (1 + np.log(1.5)) ** 2
+        norm1 = shared1 + unshared_weight * (total1 - shared1)
+        norm2 = shared2 + unshared_weight * (total2 - shared2)
+        denominator = np.sqrt(norm1 * norm2)
+        
+        similarities = np.zeros_like(dot)
+        np.divide(dot, denominator, out=similarities, where=denominator > 0)
+        
+        return similarities * 100  # Convert to percentage
+    
+    def hash_kgrams(self, text, k=5):
+        """
+        Hash every k-gram of words in the text to a 64-bit value
+        
+        Words are hashed once and combined with a polynomial rolling hash,
+        so the k-gram strings are never built.
+        """
+        return self.hash_word_kgrams(self.preprocess_text(text).split(), k)
+    
+    def hash_word_kgrams(self, words, k):
+        """Hash every k-gram of a list of normalized words"""
+        if len(words) < k:
+            return np.empty(0, dtype=np.uint64)
+        
+        word_hashes = np.fromiter(
+            (zlib.crc32(word.encode('utf-8')) for word in words),
+            dtype=np.uint64, count=len(words)
+        )
+        count = len(words) - k + 1
+        hashes = np.zeros(count, dtype=np.uint64)
+        for offset in range(k):
+            hashes = hashes * ROLLING_HASH_BASE + word_hashes[offset:offset + count]
+        
+        return mix_hashes(hashes)
+    
+    def winnow(self, hashes, window=4):
+        """
+        Select a position-tagged sample of k-gram hashes by winnowing
+        
+        Keeps the minimum hash of every window of consecutive hashes (the
+        rightmost one on ties), as in MOSS. Any copied run of at least
+        window + k - 1 words is guaranteed to share a selected hash.
+        
+        Returns:
+            tuple: (positions, hashes) of the selected k-grams
+        """
+        if len(hashes) <= window:
+            if not len(hashes):
+                return np.empty(0, dtype=np.int64), hashes
+            positions = np.array([len(hashes) - 1 - np.argmin(hashes[::-1])])
+            return positions, hashes[positions]
+        
+        windows = np.lib.stride_tricks.sliding_window_view(hashes, window)
+        rightmost = window - 1 - np.argmin(windows[:, ::-1], axis=1)
+        positions = np.unique(np.arange(len(windows)) + rightmost)
+        
+        return positions, hashes[positions]
+    
+    def fingerprint_text(self, text, k=None, window=None):
+        """
+        Create a fingerprint of the text from winnowed k-gram hashes
+        
+        Returns:
+            numpy.ndarray: Sorted, duplicate-free uint64 hashes
+        """
+        return self.fingerprint_with_positions(text, k, window)[0]
+    
+    def fingerprint_with_positions(self, text, k=None, window=None):
+        """
+        Create a fingerprint of the text and locate its k-grams in the text
+        
+        Returns:
+            tuple: (fingerprint, positions) with positions an (n, 2) int32 array
+            of the fingerprint index and first word of each winnowed k-gram
+        """
+        k = self.k if k is None else k
+        window = self.window if window is None else window
+        positions, hashes = self.winnow(self.hash_kgrams(text, k), window)
+        fingerprint, owners = np.unique(hashes, return_inverse=True)
+        return fingerprint, np.stack([owners, positions], axis=1).astype(np.int32).reshape(-1, 2)
+    
+    def score_fingerprints(self, features1, features2):
+        """
+        Measure the fingerprint overlap of two documents from one merge of their hashes
+        
+        Coverage is the share of the words spanned by a document's winnowed
+        k-grams that lie in a k-gram the other document shares, and falls
+        back to containment for features without fingerprint positions.
+        
+        Returns:
+            FingerprintScores: The overlap, from features1's side first
+        """
+        shared1, shared2 = shared_hashes(features1.fingerprint, features2.fingerprint)
+        intersection = int(np.count_nonzero(shared1))
+        size1, size2 = len(shared1), len(shared2)
+        union = size1 + size2 - intersection
+        
+        def percentage(part, whole):
+            return part / whole * 100 if whole else 0
+        
+        def coverage(features, shared):
+            if features.fingerprint_positions is None:
+                return percentage(int(np.count_nonzero(shared)), len(shared)), int(np.count_nonzero(shared))
+            positions = features.fingerprint_positions
+            matched = covered_words(positions[shared[positions[:, 0]], 1], self.k)
+            return percentage(matched, covered_words(positions[:, 1], self.k)), matched
+        
+        coverage1, matched1 = coverage(features1, shared1)
+        coverage2, matched2 = coverage(features2, shared2)
+        return FingerprintScores(
+            percentage(intersection, union), percentage(intersection, size1), percentage(intersection, size2),
+            coverage1, coverage2, matched1, matched2
+        )
+    
+    def fingerprinted_words(self, features):
+        """Count the words spanned by a document's winnowed k-grams"""
+        if features.fingerprint_positions is None:
+            return len(features.fingerprint)
+        return covered_words(features.fingerprint_positions[:, 1], self.k)
+    
+    def compare_pair(self, text_features, ref_features, candidates=None, metrics=None):
+        """
+        Compare what depends only on the two documents: fingerprints and sentences
+        
+        Only sentence pairs sharing a word n-gram are scored. They are taken
+        from candidates when given (e.g. from a SentenceIndex), and found
+        from both documents' sentence n-grams otherwise.
+        
+        Args:
+            metrics (StageMetrics): Optional collector of the time spent per stage
+        """
+        if metrics is None:
+            metrics = StageMetrics()
+        
+        if candidates is None:
+            with metrics.stage('sentence_candidates'):
+                candidates = self.candidate_sentence_pairs(
+                    self.with_sentence_ngrams(text_features).sentence_ngrams,
+                    self.with_sentence_ngrams(ref_features).sentence_ngrams
+                )
+        with metrics.stage('fingerprinting'):
+            fingerprint_scores = self.score_fingerprints(text_features, ref_features)
+        with metrics.stage('sentence_matching'):
+            sentence_pairs = self.match_sentence_indices(
+                text_features.sentences, ref_features.sentences, self.sentence_threshold,
+                candidates=candidates
+            )
+        metrics.count('sentence_pairs_scored', len(candidates))
+        metrics.count('sentence_matches', len(sentence_pairs))
+        
+        return PairComparison(fingerprint_scores, sentence_pairs)
+    
+    def with_sentence_ngrams(self, features):
+        """Return features with their sentence n-grams computed"""
+        if features.sentence_ngrams is None:
+            features = features._replace(sentence_ngrams=self.sentence_ngrams(features.sentences))
+        return features
+    
+    def compare_reference(self, text, text_features, ref_text, source_info,
+                          similarity=None, ref_features=None, pair=None, metrics=None):
+        """
+        Compare the text with one reference text
+        
+        Passages copied word for word are only aligned for significant matches.
+        
+        Args:
+            text_features (DocumentFeatures): Features of the text
+            similarity (float): Precomputed TF-IDF similarity, if available
+            ref_features (DocumentFeatures): Precomputed reference features, if available
+            pair (PairComparison): Previously computed compare_pair output, if available
+            metrics (StageMetrics): Optional collector of the time spent per stage
+            
+        Returns:
+            dict: The match, or None if the similarity is not significant
+        """
+        if metrics is None:
+            metrics = StageMetrics()
+        
+        # Calculate overall similarity
+        if similarity is None:
             similarity = self.calculate_similarity(text, ref_text)
+        
+        if ref_features is None:
+            ref_features = self.extract_features(ref_text)
+        
+        # Calculate fingerprint similarity and find matching sentences
+        if pair is None:
+            pair = self.compare_pair(text_features, ref_features)
+        
+        # Combine different similarity measures. Containment rather than
+        # Jaccard, so a text copied whole into a longer one still scores high.
+        scores = pair.fingerprint_scores
+        combined_similarity = (similarity + scores.containment) / 2
+        
+        if combined_similarity > 20:  # Only include significant matches
+            with metrics.stage('passage_alignment'):
+                passages = self.find_passages(text, ref_text)
+            metrics.count('passages', len(passages))
+            return {
+                'source_info': source_info,
+                'similarity_score': combined_similarity,
+                'matched_words': scores.matched_words,
+                'scores': dict(scores._asdict(), cosine=similarity),
+                'passages': passages,
+                'matched_text': self.passage_text(text, passages),
+                'sentence_matches': [
+                    {
+                        'text1_sentence': text_features.sentences[i],
+                        'text2_sentence': ref_features.sentences[j],
+                        'similarity': sentence_similarity
+                    }
+                    for i, j, sentence_similarity in pair.sentence_pairs
+                ]
+            }
+        return None
+    
+    def compare_cached(self, text, text_features, ref_text, source_info,
+                       similarity=None, ref_features=None, pair=None, candidates=None, metrics=None):
+        """
+        Compare the text with one reference text, reporting new pair comparisons
+        
+        Args:
+            candidates (numpy.ndarray): Sentence pairs to score if the pair is
+                compared, see compare_pair
+            metrics (StageMetrics): Optional collector of the time spent per stage
             
-            # Find matching sentences
-            sentence_matches = self.find_matching_sentences(text, ref_text)
+        Returns:
+            tuple: (match or None, (source_info, PairComparison) if the pair
+            was compared rather than given, else None)
+        """
+        if metrics is None:
+            metrics = StageMetrics()
+        metrics.count('references')
+        
+        if similarity is None:
+            with metrics.stage('vectorizing'):
+                similarity = self.calculate_similarity(text, ref_text)
+        
+        if ref_features is None:
+            with metrics.stage('reference_features'):
+                ref_features = self.extract_features(ref_text)
+        
+        computed = None
+        if pair is None:
+            pair = self.compare_pair(text_features, ref_features, candidates, metrics)
+            computed = (source_info, pair)
+            metrics.count('pairs_compared')
+        else:
+            metrics.count('pairs_cached')
+        match = self.compare_reference(text, text_features, ref_text, source_info,
+                                       similarity, ref_features, pair, metrics)
+        return match, computed
+    
+    def exact_match(self, text, text_features, source_info):
+        """Build the 100% match for a reference known to be identical to the text"""
+        # The whole text is one passage, at the same offsets in the reference
+        words, spans = self.normalizer.tokenize(text)
+        passages = []
+        if words:
+            start, end = int(spans[0][0]), int(spans[-1][1])
+            passages.append(Passage(start, end, start, end, len(words)))
+        sentence_matches = [
+            {'text1_sentence': sent, 'text2_sentence': sent, 'similarity': 100.0}
+            for sent in text_features.sentences if len(sent) >= MIN_SENTENCE_LENGTH
+        ]
+        words = self.fingerprinted_words(text_features)
+        return {
+            'source_info': source_info,
+            'similarity_score': 100.0,
+            'matched_words': words,
+            'scores': dict(
+                FingerprintScores(100.0, 100.0, 100.0, 100.0, 100.0, words, words)._asdict(), cosine=100.0
+            ),
+            'passages': passages,
+            'matched_text': self.passage_text(text, passages),
+            'sentence_matches': sentence_matches
+        }
+    
+    def detect_plagiarism(self, text, reference_texts, corpus_index=None, progress=None,
+                          duplicates=None, total=None, text_features=None, pair_cache=None,
+                          sentence_index=None, metrics=None):
+        """
+        Detect plagiarism by comparing text with reference texts
+        
+        References are consumed lazily, chunk_size at a time, and only the
+        max_matches highest-scoring matches are kept, so memory use does not
+        grow with the number of references.
+        
+        Args:
+            text (str): The text to check for plagiarism
+            reference_texts (iterable): (text, source_info) tuples to compare
+                against, optionally with the reference's precomputed
+                DocumentFeatures as a third element
+            corpus_index (CorpusIndex): Optional index holding the references'
+                TF-IDF rows, keyed by source_info['id']. Indexed references are
+                scored with one sparse product against the shared corpus IDF
+                instead of refitting the vectorizer per reference.
+            progress (callable): Optional progress(done, total) callback, called
+                after each reference (each chunk when running in parallel).
+                Exceptions it raises abort the detection.
+            duplicates (list): Optional source_info dicts of references known
+                to be identical to the text, reported as 100% matches without
+                being compared
+            total (int): Number of references, for progress reports when
+                reference_texts has no length
+            text_features (DocumentFeatures): Precomputed features of the text
+            pair_cache: Optional cache of pair comparisons. Its
+                get_many(source_infos) returns a PairComparison or None per
+                reference and set_many([(source_info, PairComparison)]) stores
+                the ones computed. It is consulted a chunk at a time, in this
+                process only.
+            sentence_index (SentenceIndex): Optional index of the references'
+                sentence n-grams, keyed by source_info['id']. The sentence
+                pairs worth scoring against indexed references are then found
+                with one lookup instead of hashing every reference's sentences.
+            metrics (StageMetrics): Optional collector of the time spent per
+                stage and of counts of the references and sentence pairs
+                compared, including those of worker processes
             
-            # Calculate fingerprint similarity
-            ref_fingerprint = self.fingerprint_text(ref_text)
-            fingerprint_similarity = self.compare_fingerprints(text_fingerprint, ref_fingerprint)
+        Returns:
+            dict: Plagiarism detection results, matches sorted by descending
+            score. overall_score is the mean score of the significant matches
+            weighted by their matched words, match_count the number of them
+            and match_weight the sum of their weights. max_matches may have
+            left some of them out of matches.
+        """
+        overall_score = 0
+        if metrics is None:
+            metrics = StageMetrics()
+        
+        # Split and fingerprint the text once for all references
+        with metrics.stage('text_features'):
+            if text_features is None:
+                text_features = self.extract_features(text)
+            text_features = self.with_sentence_ngrams(text_features)
+        
+        indexed_similarity = None
+        if corpus_index is not None:
+            with metrics.stage('vectorizing'):
+                indexed_similarity = corpus_index.similarity_lookup(text)
+        
+        indexed_candidates = None
+        if sentence_index is not None and sentence_index.config == self.sentence_ngram_config():
+            with metrics.stage('sentence_candidates'):
+                indexed_candidates = sentence_index.candidate_lookup(text_features.sentence_ngrams)
+        
+        if total is None and hasattr(reference_texts, '__len__'):
+            total = len(reference_texts)
+        
+        def prepare(reference):
+            ref_text, source_info = reference[:2]
+            ref_features = reference[2] if len(reference) > 2 else None
+            similarity = None
+            if indexed_similarity is not None:
+                similarity = indexed_similarity(source_info.get('id'))
+            candidates = None
+            if indexed_candidates is not None:
+                with metrics.stage('sentence_candidates'):
+                    candidates = indexed_candidates(source_info.get('id'))
+            return ref_text, source_info, similarity, ref_features, None, candidates
+        
+        references = _timed(reference_texts, metrics, 'loading_references')
+        chunks = _chunked((prepare(reference) for reference in references), self.chunk_size)
+        if pair_cache is not None:
+            chunks = _with_cached_pairs(chunks, pair_cache, metrics)
+        
+        top_matches = []
+        scores = []
+        weights = []
+        done = [0]
+        
+        def keep(match, index):
+            scores.append(match['similarity_score'])
+            weights.append(match_weight(match))
+            # Ties keep the earlier reference, so results do not depend on scheduling
+            entry = (match['similarity_score'], -index, match)
+            if self.max_matches is None or len(top_matches) < self.max_matches:
+                heapq.heappush(top_matches, entry)
+            elif entry[:2] > top_matches[0][:2]:
+                heapq.heapreplace(top_matches, entry)
+        
+        def collect(start, chunk_results):
+            for offset, (match, _) in enumerate(chunk_results):
+                if match is not None:
+                    keep(match, start + offset)
             
-            # Combine different similarity measures
-            combined_similarity = (similarity + fingerprint_similarity) / 2
+            if pair_cache is not None:
+                computed = [pair for _, pair in chunk_results if pair is not None]
+                if computed:
+                    with metrics.stage('pair_cache'):
+                        pair_cache.set_many(computed)
             
-            if combined_similarity > 20:  # Only include significant matches
-                matches.append({
-                    'source_info': source_info,
-                    'similarity_score': combined_similarity,
-                    'sentence_matches': sentence_matches
-                })
+            done[0] += len(chunk_results)
+            if progress is not None:
+                progress(done[0], max(total or 0, done[0]))
+        
+        # Duplicates get negative indices, ahead of every compared reference
+        for position, source_info in enumerate(duplicates or []):
+            keep(self.exact_match(text, text_features, source_info), position - len(duplicates))
+        
+        if self.workers > 1 and (total is None or total > self.chunk_size):
+            self._compare_in_parallel(text, text_features, chunks, collect, metrics)
+        else:
+            for start, chunk in chunks:
+                collect(start, [self.compare_cached(text, text_features, *reference, metrics=metrics)
+                                for reference in chunk])
+        
+        matches = [match for _, _, match in sorted(top_matches, key=lambda entry: entry[:2], reverse=True)]
         
         # Calculate overall plagiarism score
-        if matches:
-            # Weight by the length of the reference texts
-            overall_score = sum(match['similarity_score'] for match in matches) / len(matches)
+        if scores:
+            # Weight by the length of text each match covers
+            overall_score = math.fsum(
+                score * weight for score, weight in zip(scores, weights)
+            ) / math.fsum(weights)
+        metrics.count('duplicates', len(duplicates or []))
+        metrics.count('matches', len(scores))
         
         return {
             'overall_score': overall_score,
+            'match_count': len(scores),
+            'match_weight': math.fsum(weights),
             'matches': matches
         }
+    
+    def _compare_in_parallel(self, text, text_features, chunks, collect, metrics):
+        """
+        Compare chunks of references on a process pool
+        
+        The checked text and its features are sent to each worker once when
+        it starts rather than with every chunk. Only a couple of chunks per
+        worker are in flight at a time, so references are read no faster than
+        they are compared. Workers send their metrics back with each chunk.
+        """
+        # Spawned rather than forked: checks run in threads of a web or worker
+        # process, and a forked child would inherit locks other threads hold
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(text, text_features, self.k, self.window, self.sentence_threshold,
+                      self.sentence_ngram_size, self.passage_length, self.normalizer.config())
+        )
+        try:
+            pending = {}
+            for start, chunk in chunks:
+                pending[executor.submit(_compare_chunk, chunk)] = start
+                if len(pending) >= self.workers * 2:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self._collect_chunk(pending.pop(future), future.result(), collect, metrics)
+            
+            for future in list(pending):
+                self._collect_chunk(pending.pop(future), future.result(), collect, metrics)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    @staticmethod
+    def _collect_chunk(start, output, collect, metrics):
+        results, chunk_metrics = output
+        metrics.merge(chunk_metrics)
+        collect(start, results)
+
+
+def _with_cached_pairs(chunks, pair_cache, metrics):
+    """Fill in the cached pair comparison of each reference, one lookup per chunk"""
+    for start, chunk in chunks:
+        with metrics.stage('pair_cache'):
+            cached = pair_cache.get_many([reference[1] for reference in chunk])
+        yield start, [reference[:4] + (pair,) + reference[5:] for reference, pair in zip(chunk, cached)]
+
+
+# Sentinel marking the end of an iterator
+_DONE = object()
+
+
+def _timed(iterable, metrics, stage):
+    """Iterate, adding the time spent producing each item to a stage"""
+    iterator = iter(iterable)
+    while True:
+        with metrics.stage(stage):
+            item = next(iterator, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+
+def _chunked(iterable, size):
+    """Yield (start index, list) chunks of at most size items"""
+    iterator = iter(iterable)
+    start = 0
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+
+# State of a parallel detection worker process, set up by _init_worker
+_worker_state = {}
+
+
+def _init_worker(text, text_features, k, window, sentence_threshold, sentence_ngram_size, passage_length,
+                 normalization):
+    """Receive the checked text once per worker process"""
+    normalizer = None
+    if normalization != default_normalizer.config():
+        normalizer = TextNormalizer(**normalization)
+    _worker_state['detector'] = PlagiarismDetector(
+        k=k, window=window, sentence_threshold=sentence_threshold,
+        sentence_ngram_size=sentence_ngram_size, passage_length=passage_length, normalizer=normalizer
+    )
+    _worker_state['text'] = text
+    _worker_state['text_features'] = text_features
+
+
+def _compare_chunk(references):
+    """Compare the worker's text with a chunk of references, returning the chunk's metrics too"""
+    detector = _worker_state['detector']
+    metrics = StageMetrics()
+    results = [
+        detector.compare_cached(
+            _worker_state['text'], _worker_state['text_features'], *reference, metrics=metrics
+        )
+        for reference in references
+    ]
+    return results, metrics.as_dict()
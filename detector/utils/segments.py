@@ -0,0 +1,202 @@
+import os
+import re
+import uuid
+
+import numpy as np
+
+from .file_lock import file_lock, file_stamp
+
+
+class SegmentedIndex:
+    """
+    Base of the indexes persisted as an index file and numbered segment files
+    
+    Changes are appended as segment files next to the index file, numbered
+    from the last one the index file covers, so indexing an upload never
+    rewrites the archive. Processes catch up by applying the segments they
+    have not applied yet. compact_segments folds the segments into the index
+    file from time to time.
+    
+    Subclasses implement _clear, _load_file(stored), _file_arrays() and
+    _apply_segment(stored).
+    """
+    
+    # Whether the index file is written with np.savez_compressed
+    compressed = False
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.lineage = uuid.uuid4().hex  # Shared by the index files compacted from one another
+        self.segment = 0  # Number of the last segment applied
+        self._stamp = None
+    
+    def _clear(self):
+        """Empty the index"""
+        raise NotImplementedError
+    
+    def _load_file(self, stored):
+        """Load the contents of an opened index file"""
+        raise NotImplementedError
+    
+    def _file_arrays(self):
+        """Return the arrays saved in the index file"""
+        raise NotImplementedError
+    
+    def _apply_segment(self, stored):
+        """Apply an opened segment file"""
+        raise NotImplementedError
+    
+    def _append_segment(self, **arrays):
+        """
+        Write arrays as the segment after the last one applied
+        
+        The caller must hold the index file's lock and have applied every
+        segment written so far.
+        """
+        self._write(self.segment_path(self.segment + 1), np.savez, **arrays)
+        self.segment += 1
+    
+    def segment_path(self, number):
+        """Return the path of a numbered segment file"""
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{number:08d}{ext}"
+    
+    def segment_numbers(self):
+        """Return the numbers of the segment files on disk, in order"""
+        directory, name = os.path.split(self.path)
+        root, ext = os.path.splitext(name)
+        pattern = re.compile(rf"{re.escape(root)}\.(\d{{8}}){re.escape(ext)}$")
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(match.group(1)) for match in map(pattern.match, names) if match)
+    
+    def last_segment(self):
+        """Return the number of the last segment written, whether or not it was applied"""
+        _, through = self._read_header()
+        return max(self.segment_numbers() + [through, self.segment])
+    
+    def uncovered_segments(self):
+        """Return the number of segment files the index file does not cover"""
+        _, covered = self._read_header()
+        return sum(number > covered for number in self.segment_numbers())
+    
+    def _write(self, path, save, **arrays):
+        """Write arrays atomically to an npz file with np.savez or np.savez_compressed"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            save(file, **arrays)
+        os.replace(tmp_path, path)
+    
+    def save(self):
+        """
+        Persist the index atomically to its npz file
+        
+        The file covers the segments applied so far. Those the replaced file
+        already covered are deleted, the newer ones are kept for indexes that
+        have not applied them yet to catch up with, unless the replaced file
+        was of another lineage and no index can catch up from it.
+        """
+        lineage, covered = self._read_header()
+        if lineage != self.lineage:
+            covered = self.segment
+        self._write(
+            self.path, np.savez_compressed if self.compressed else np.savez,
+            segment=np.asarray(self.segment),
+            lineage=np.asarray(self.lineage),
+            **self._file_arrays()
+        )
+        self._stamp = file_stamp(self.path)
+        for number in self.segment_numbers():
+            if number <= covered:
+                try:
+                    os.remove(self.segment_path(number))
+                except FileNotFoundError:
+                    pass
+    
+    def load(self):
+        """Load the index from its npz file and the segments written after it"""
+        if not self.path:
+            return self
+        self._clear()
+        self.segment = 0
+        # Stamped before reading, so a save landing in between is reloaded later
+        self._stamp = file_stamp(self.path)
+        if self._stamp is not None:
+            with np.load(self.path) as stored:
+                lineage, self.segment = self._header(stored)
+                self.lineage = lineage or self.lineage
+                self._load_file(stored)
+        if not self._apply_segments():
+            return self.load()
+        return self
+    
+    @staticmethod
+    def _header(stored):
+        """Return the (lineage, last segment covered) of a stored index file"""
+        if 'lineage' not in stored.files:
+            return None, 0
+        return str(stored['lineage']), int(stored['segment'])
+    
+    def _read_header(self):
+        try:
+            with np.load(self.path) as stored:
+                return self._header(stored)
+        except FileNotFoundError:
+            return None, 0
+    
+    def _apply_segments(self):
+        """Apply the segment files after the last one applied, returning False if one was deleted"""
+        for number in self.segment_numbers():
+            if number <= self.segment:
+                continue
+            if number != self.segment + 1:
+                return False
+            try:
+                with np.load(self.segment_path(number)) as stored:
+                    self._apply_segment(stored)
+            except FileNotFoundError:
+                return False
+            self.segment = number
+        return True
+    
+    def refresh(self):
+        """
+        Catch up with the changes other processes have saved
+        
+        New segments are applied on top of the loaded index. The index file
+        is read again only when it was replaced by anything but a compaction
+        of this index's segments, or when segments it has not applied yet
+        have been deleted since.
+        """
+        if not self.path:
+            return self
+        stamp = file_stamp(self.path)
+        if stamp != self._stamp:
+            lineage, _ = self._read_header()
+            if lineage is None or lineage != self.lineage:
+                return self.load()
+            self._stamp = stamp
+        if not self._apply_segments():
+            return self.load()
+        return self
+
+
+def compact_segments(index, max_segments):
+    """
+    Fold the segment files into the index file once max_segments are not in it
+    
+    The index should be loaded apart from the process-wide one, so checks are
+    not held up while it is written, and indexes that have applied the
+    segments take the compacted file without reading it.
+    
+    Returns:
+        bool: Whether the index was compacted
+    """
+    with file_lock(index.path):
+        if index.uncovered_segments() < max_segments:
+            return False
+        index.load().save()
+    return True
@@ -0,0 +1,267 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from .file_lock import file_lock
+from .plagiarism_detector import PlagiarismDetector, expand_ranges, unique_pairs
+from .segments import SegmentedIndex, compact_segments
+
+
+INDEX_FILE_NAME = 'sentence_index.npz'
+
+# Segment files compact_sentence_index waits for before folding them into
+# the index file
+MAX_SEGMENTS = 64
+
+
+class SentenceIndex(SegmentedIndex):
+    """
+    Inverted index from sentence word n-grams to the sentences containing them
+    
+    Every indexed sentence contributes one (n-gram hash, document, sentence)
+    entry per distinct n-gram. Entries are kept in parallel arrays sorted by
+    hash, so finding the sentences a text shares n-grams with is a binary
+    search per n-gram of the text. New entries are merged in at their sorted
+    positions rather than sorting the whole index again.
+    
+    On disk the entries are grouped by hash: each distinct hash is stored once
+    with its entry count, and the documents of a group as deltas from the
+    previous entry, which compress well. Changes are appended as numbered
+    segment files next to the index file, each holding the entries of the
+    documents it adds and the ids of those it removes, so indexing an upload
+    never rewrites the archive. Segments are folded into the index file by
+    compact_sentence_index. An index file or segment built with different
+    n-gram parameters is ignored until the index is rebuilt.
+    """
+    
+    compressed = True
+    
+    def __init__(self, path=None, detector=None):
+        super().__init__(path)
+        self.detector = detector or PlagiarismDetector()
+        self.config = self.detector.sentence_ngram_config()
+        self._clear()
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __contains__(self, doc_id):
+        return doc_id in self.ids
+    
+    def add(self, doc_id, sentences):
+        """Add a document's sentences to the index, replacing any previous version"""
+        self.add_many([(doc_id, sentences)])
+    
+    def add_many(self, documents):
+        """Add (doc_id, sentences) pairs to the index in a single batch"""
+        documents = list(documents)
+        if documents:
+            self._apply([doc_id for doc_id, _ in documents], [], *self._entries(documents))
+    
+    def remove(self, doc_id):
+        """Remove a document from the index"""
+        self._apply([], [doc_id], *self._entries([]))
+    
+    def append(self, documents=(), removed=()):
+        """
+        Add and remove documents, persisting the change as a new segment file
+        
+        The caller must hold the index file's lock and have applied every
+        segment written so far, so that the new one is numbered after them.
+        """
+        documents = list(documents)
+        removed = [doc_id for doc_id in removed if doc_id in self.ids]
+        if not documents and not removed:
+            return
+        
+        added = [doc_id for doc_id, _ in documents]
+        hashes, docs, sentences = self._entries(documents)
+        self._append_segment(
+            ids=np.asarray(added, dtype=np.int64),
+            removed=np.asarray(removed, dtype=np.int64),
+            hashes=hashes,
+            docs=docs,
+            sentences=sentences,
+            config=np.asarray(json.dumps(self.config, sort_keys=True)),
+        )
+        self._apply(added, removed, hashes, docs, sentences)
+    
+    def candidate_lookup(self, ngrams):
+        """
+        Find the indexed sentences sharing an n-gram with each sentence of a text
+        
+        Args:
+            ngrams (tuple): The text's sentence n-grams, as returned by
+                PlagiarismDetector.sentence_ngrams
+        
+        Returns:
+            callable: lookup(doc_id) giving the sorted (index in text, index in
+            document) sentence pairs, as compare_pair takes them, or None for
+            documents that are not in the index
+        """
+        text_hashes, owners = ngrams
+        self._sort()
+        starts = np.searchsorted(self.hashes, text_hashes, side='left')
+        counts = np.searchsorted(self.hashes, text_hashes, side='right') - starts
+        positions = expand_ranges(starts, counts)
+        
+        # Group the shared entries by document
+        docs = self.docs[positions]
+        order = np.argsort(docs, kind='stable')
+        docs = docs[order]
+        text_sentences = np.repeat(owners.astype(np.int64), counts)[order]
+        doc_sentences = self.sentences[positions][order].astype(np.int64)
+        # Documents as of this lookup, the index may change while pairs are looked up
+        ids = frozenset(self.ids)
+        
+        def lookup(doc_id):
+            if doc_id not in ids:
+                return None
+            start = np.searchsorted(docs, doc_id, side='left')
+            end = np.searchsorted(docs, doc_id, side='right')
+            return unique_pairs(text_sentences[start:end], doc_sentences[start:end])
+        
+        return lookup
+    
+    def _clear(self):
+        self.ids = set()
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.docs = np.empty(0, dtype=np.int64)
+        self.sentences = np.empty(0, dtype=np.int32)
+        self._sorted = True
+    
+    def _entries(self, documents):
+        """Compute the (hashes, docs, sentences) entry arrays of (doc_id, sentences) pairs"""
+        hashes = [np.empty(0, dtype=np.uint64)]
+        docs = [np.empty(0, dtype=np.int64)]
+        sentences = [np.empty(0, dtype=np.int32)]
+        for doc_id, doc_sentences in documents:
+            doc_hashes, owners = self.detector.sentence_ngrams(doc_sentences)
+            hashes.append(doc_hashes)
+            docs.append(np.full(len(doc_hashes), doc_id, dtype=np.int64))
+            sentences.append(owners)
+        return np.concatenate(hashes), np.concatenate(docs), np.concatenate(sentences)
+    
+    def _apply(self, added, removed, hashes, docs, sentences):
+        """Drop the entries of the added and removed documents, then insert the new entries"""
+        dropped = [doc_id for doc_id in list(added) + list(removed) if doc_id in self.ids]
+        if dropped:
+            self._keep(~np.isin(self.docs, dropped))
+            self.ids.difference_update(dropped)
+        
+        if self._sorted and len(self.hashes):
+            order = np.lexsort((sentences, docs, hashes))
+            at = np.searchsorted(self.hashes, hashes[order], side='right')
+            self.hashes = np.insert(self.hashes, at, hashes[order])
+            self.docs = np.insert(self.docs, at, docs[order])
+            self.sentences = np.insert(self.sentences, at, sentences[order])
+        else:
+            self.hashes = np.concatenate([self.hashes, hashes])
+            self.docs = np.concatenate([self.docs, docs])
+            self.sentences = np.concatenate([self.sentences, sentences])
+            self._sorted = False
+        self.ids.update(added)
+    
+    def _keep(self, mask):
+        self.hashes = self.hashes[mask]
+        self.docs = self.docs[mask]
+        self.sentences = self.sentences[mask]
+    
+    def _sort(self):
+        """Order the entries by hash, then document and sentence"""
+        if not self._sorted:
+            order = np.lexsort((self.sentences, self.docs, self.hashes))
+            self._keep(order)
+            self._sorted = True
+    
+    def _file_arrays(self):
+        self._sort()
+        keys, group_starts, counts = np.unique(self.hashes, return_index=True, return_counts=True)
+        deltas = np.diff(self.docs, prepend=0)
+        deltas[group_starts] = self.docs[group_starts]
+        return {
+            'ids': np.asarray(sorted(self.ids), dtype=np.int64),
+            'keys': keys,
+            'counts': counts.astype(np.int64),
+            'doc_deltas': deltas,
+            'sentences': self.sentences,
+            'config': np.asarray(json.dumps(self.config, sort_keys=True)),
+        }
+    
+    def _load_file(self, stored):
+        if json.loads(str(stored['config'])) != self.config:
+            return
+        counts = stored['counts']
+        deltas = stored['doc_deltas']
+        self.ids = set(stored['ids'].tolist())
+        self.hashes = np.repeat(stored['keys'], counts)
+        self.sentences = stored['sentences']
+        
+        # Undo the per-group delta encoding with one running sum
+        totals = np.cumsum(deltas)
+        group_starts = np.cumsum(counts) - counts
+        before = np.concatenate(([0], totals))[group_starts]
+        self.docs = totals - np.repeat(before, counts)
+    
+    def _apply_segment(self, stored):
+        if json.loads(str(stored['config'])) == self.config:
+            self._apply(stored['ids'].tolist(), stored['removed'].tolist(),
+                        stored['hashes'], stored['docs'], stored['sentences'])
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def create_sentence_index():
+    """Create an empty sentence index configured from the Django settings"""
+    from django.conf import settings
+    
+    return SentenceIndex(os.path.join(settings.PLAGIARISM_INDEX_DIR, INDEX_FILE_NAME))
+
+
+def get_sentence_index():
+    """Return the process-wide sentence index, catching up with changes saved on disk"""
+    global _index
+    
+    with _index_lock:
+        if _index is None:
+            _index = create_sentence_index().load()
+        else:
+            _index.refresh()
+        return _index
+
+
+def update_sentence_index(doc_id, sentences):
+    """
+    Add or replace a document in the shared sentence index and persist it
+    
+    The change is written as a segment file. The index file stays locked from
+    catching up to writing it, so segments from other processes are not
+    overwritten.
+    """
+    with file_lock(get_sentence_index().path):
+        index = get_sentence_index()
+        with _index_lock:
+            index.append(documents=[(doc_id, sentences)])
+
+
+def remove_from_sentence_index(doc_id):
+    """Remove a document from the shared sentence index and persist it"""
+    with file_lock(get_sentence_index().path):
+        index = get_sentence_index()
+        with _index_lock:
+            index.append(removed=[doc_id])
+
+
+def compact_sentence_index():
+    """
+    Fold the sentence index's segment files into its index file once
+    MAX_SEGMENTS are not in it
+    
+    Returns:
+        bool: Whether the index was compacted
+    """
+    return compact_segments(create_sentence_index(), MAX_SEGMENTS)
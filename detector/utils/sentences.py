@@ -0,0 +1,65 @@
+import re
+
+
+# Words that end in a period without ending the sentence, compared lowercased
+# with inner periods removed (so "e.g." is "eg")
+ABBREVIATIONS = frozenset("""
+    mr mrs ms dr prof sr jr st rev gen col capt lt sgt hon
+    vs etc eg ie cf al approx ca viz resp
+    fig figs eq eqs ref refs ch sec no nos vol vols pp ed eds trans
+    dept univ inc ltd co corp assn bros
+    jan feb mar apr jun jul aug sep sept oct nov dec
+""".split())
+
+# Sentence-final punctuation with any closing quotes or brackets, and the
+# first character of what follows. Paragraph breaks end a sentence too.
+BOUNDARY_PATTERN = re.compile(
+    r"""(?P<end>[.!?]+)["'”’)\]]*\s+(?=(?P<next>\S))"""
+    r"""|\n[ \t]*\n\s*"""
+)
+
+# Characters before a period searched for the word it ends
+WORD_WINDOW = 32
+
+
+def is_sentence_end(text, match):
+    """Whether a BOUNDARY_PATTERN match in text ends a sentence"""
+    if match.group('end') is None:
+        # Paragraph break
+        return True
+    if match.group('next').islower():
+        return False
+    if match.group('end') != '.':
+        return True
+    preceding = text[max(0, match.start() - WORD_WINDOW):match.start()].split()
+    word = preceding[-1] if preceding and not text[match.start() - 1].isspace() else ''
+    word = word.lstrip('(["\'“‘').replace('.', '').lower()
+    # Single letters are initials, as in "J. Smith"
+    return len(word) > 1 and word not in ABBREVIATIONS
+
+
+def split_sentences(text):
+    """
+    Split text into sentences with precompiled rules, without any data files
+    
+    A sentence ends at '.', '!' or '?' followed by whitespace and a word that
+    does not start lowercase, unless the period ends a known abbreviation or
+    an initial, and at every paragraph break.
+    
+    Returns:
+        list: The sentences, stripped, each a substring of text
+    """
+    sentences = []
+    start = 0
+    for match in BOUNDARY_PATTERN.finditer(text):
+        if not is_sentence_end(text, match):
+            continue
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    
+    sentence = text[start:].strip()
+    if sentence:
+        sentences.append(sentence)
+    return sentences
@@ -0,0 +1,98 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+
+def cosine_matrix(weighted_rows):
+    """
+    Calculate the cosine similarity of every pair of L2-normalized rows
+    
+    Returns:
+        numpy.ndarray: N x N similarity percentages
+    """
+    return (weighted_rows @ weighted_rows.T).toarray() * 100
+
+
+def fingerprint_containment_matrix(fingerprints):
+    """
+    Calculate the containment of every pair of fingerprints in one pass
+    
+    Each fingerprint becomes a row of a sparse membership matrix over all
+    distinct hashes, so one product counts the hashes every pair shares. A
+    pair scores the larger of its two containments, the share of the smaller
+    fingerprint found in the other, so the matrix stays symmetric and a text
+    copied whole into a longer one scores high.
+    
+    Args:
+        fingerprints (list): Sorted, duplicate-free uint64 arrays
+    
+    Returns:
+        numpy.ndarray: N x N similarity percentages
+    """
+    count = len(fingerprints)
+    lengths = np.array([len(fingerprint) for fingerprint in fingerprints], dtype=np.int64)
+    if not lengths.sum():
+        return np.zeros((count, count))
+    
+    hashes, columns = np.unique(np.concatenate(fingerprints), return_inverse=True)
+    rows = np.repeat(np.arange(count), lengths)
+    membership = sp.csr_matrix(
+        (np.ones(len(columns), dtype=np.float32), (rows, columns)),
+        shape=(count, len(hashes))
+    )
+    
+    common = (membership @ membership.T).toarray()
+    smaller = np.minimum(lengths[:, None], lengths[None, :])
+    containment = np.zeros((count, count))
+    np.divide(common, smaller, out=containment, where=smaller > 0)
+    
+    return containment * 100
+
+
+def pack_upper_triangle(matrix):
+    """Serialize the pairs above the diagonal of a symmetric matrix as float16"""
+    rows, cols = np.triu_indices(len(matrix), k=1)
+    return matrix[rows, cols].astype('<f2').tobytes()
+
+
+def unpack_upper_triangle(data):
+    """Deserialize pairs stored with pack_upper_triangle as a float32 array"""
+    return np.frombuffer(data, dtype='<f2').astype(np.float32)
+
+
+def top_pairs(scores, count, threshold=0, limit=None):
+    """
+    Find the most similar pairs of a packed upper triangle
+    
+    Returns:
+        list: (row, col, score) tuples, most similar first
+    """
+    rows, cols = np.triu_indices(count, k=1)
+    selected = np.flatnonzero(scores >= threshold)
+    # Stable sort keeps pairs with equal scores in row order
+    selected = selected[np.argsort(-scores[selected], kind='stable')]
+    if limit is not None:
+        selected = selected[:limit]
+    return [(int(rows[i]), int(cols[i]), float(scores[i])) for i in selected]
+
+
+def similarity_clusters(scores, count, threshold):
+    """
+    Group rows connected by pairs at least as similar as the threshold
+    
+    Returns:
+        list: Lists of row numbers, one per group of two or more rows,
+        largest group first
+    """
+    rows, cols = np.triu_indices(count, k=1)
+    selected = scores >= threshold
+    graph = sp.coo_matrix(
+        (np.ones(np.count_nonzero(selected)), (rows[selected], cols[selected])),
+        shape=(count, count)
+    )
+    _, labels = connected_components(graph, directed=False)
+    
+    clusters = [np.flatnonzero(labels == label).tolist() for label in np.unique(labels)]
+    clusters = [cluster for cluster in clusters if len(cluster) > 1]
+    clusters.sort(key=lambda cluster: (-len(cluster), cluster[0]))
+    return clusters
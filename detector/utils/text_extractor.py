@@ -1,58 +1,158 @@
+import multiprocessing
 import os
+import time
 import PyPDF2
 import docx
-import re
 
 
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF files"""
-    text = ""
+# Content types browsers report for the supported formats
+MIME_TYPE_EXTENSIONS = {
+    'application/pdf': 'pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+    'text/plain': 'txt',
+}
+
+
+class ExtractionTimeout(Exception):
+    """Raised when a document takes longer than allowed to extract"""
+
+
+def count_pdf_pages(file_path):
+    """Return the number of pages of a PDF file"""
     with open(file_path, 'rb') as file:
-        pdf_reader = PyPDF2.PdfReader(file)
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text()
-    return text
+        return len(PyPDF2.PdfReader(file).pages)
 
 
-def extract_text_from_docx(file_path):
-    """Extract text from DOCX files"""
+# PDF reader of a page extraction worker process, set up by _init_pdf_worker
+_pdf_worker_state = {}
+
+
+def _init_pdf_worker(file_path):
+    """Open and parse the PDF once per worker process"""
+    _pdf_worker_state['reader'] = PyPDF2.PdfReader(open(file_path, 'rb'))
+
+
+def _count_pdf_pages():
+    return len(_pdf_worker_state['reader'].pages)
+
+
+def _extract_pdf_page_range(page_range):
+    """Extract the text of a (start, stop) range of pages in a worker"""
+    pdf_reader = _pdf_worker_state['reader']
+    return [pdf_reader.pages[page_num].extract_text() for page_num in range(*page_range)]
+
+
+def iter_text_from_pdf(file_path, workers=1, max_pages=None, timeout=None, pages_per_task=8):
+    """
+    Yield the text of a PDF file page by page, in page order
+    
+    Args:
+        file_path (str): Path of the PDF file
+        workers (int): Processes extracting page ranges in parallel
+        max_pages (int): Stop after this many pages
+        timeout (float): Seconds the whole document may take. Extraction then
+            runs in child processes, which are killed when time runs out, so a
+            pathological PDF cannot stall the caller.
+        pages_per_task (int): Pages extracted by a worker at a time
+        
+    Raises:
+        ExtractionTimeout: If the timeout expires
+    """
+    if workers <= 1 and timeout is None:
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            for page_num, page in enumerate(pdf_reader.pages):
+                if max_pages is not None and page_num >= max_pages:
+                    break
+                yield page.extract_text()
+        return
+    
+    deadline = None if timeout is None else time.monotonic() + timeout
+    
+    def remaining():
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+    
+    # Spawned rather than forked: callers run in threads of a web or worker
+    # process, and a forked child would inherit locks other threads hold
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(max(workers, 1), initializer=_init_pdf_worker, initargs=(file_path,))
+    try:
+        page_count = pool.apply_async(_count_pdf_pages).get(remaining())
+        if max_pages is not None:
+            page_count = min(page_count, max_pages)
+        
+        page_ranges = [
+            (start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)
+        ]
+        # imap hands back the ranges in order, whichever worker finishes first
+        results = pool.imap(_extract_pdf_page_range, page_ranges)
+        for _ in page_ranges:
+            yield from results.next(remaining())
+    except multiprocessing.TimeoutError:
+        raise ExtractionTimeout(f"Extraction took longer than {timeout} seconds")
+    finally:
+        pool.terminate()
+
+
+def iter_text_from_docx(file_path):
+    """Yield the text of a DOCX file paragraph by paragraph"""
     doc = docx.Document(file_path)
-    text = ""
     for paragraph in doc.paragraphs:
-        text += paragraph.text + "\n"
-    return text
+        yield paragraph.text + "\n"
+
+
+def iter_text_from_txt(file_path, chunk_size=1024 * 1024):
+    """Yield the text of a TXT file in chunks"""
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+        for chunk in iter(lambda: file.read(chunk_size), ''):
+            yield chunk
+
+
+def extract_text_from_pdf(file_path, **options):
+    """Extract text from PDF files"""
+    return "".join(iter_text_from_pdf(file_path, **options))
+
+
+def extract_text_from_docx(file_path):
+    """Extract text from DOCX files"""
+    return "".join(iter_text_from_docx(file_path))
 
 
 def extract_text_from_txt(file_path):
     """Extract text from TXT files"""
-    with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-        text = file.read()
-    return text
+    return "".join(iter_text_from_txt(file_path))
 
 
-def extract_text_from_file(file_path, file_type=None):
-    """Extract text from various file types"""
-    if not file_type:
-        file_type = os.path.splitext(file_path)[1].lower()
-    
-    if file_type.endswith('pdf'):
-        return extract_text_from_pdf(file_path)
-    elif file_type.endswith('docx'):
-        return extract_text_from_docx(file_path)
-    elif file_type.endswith('txt'):
-        return extract_text_from_txt(file_path)
-    else:
-        raise ValueError(f"Unsupported file type: {file_type}")
+def get_file_extension(file_path, file_type=None):
+    """Resolve a file type, an extension or a content type, to an extension"""
+    if file_type:
+        file_type = file_type.split(';')[0].strip().lower()
+        file_type = MIME_TYPE_EXTENSIONS.get(file_type, file_type)
+        for extension in ('pdf', 'docx', 'txt'):
+            if file_type.endswith(extension):
+                return extension
+    return os.path.splitext(file_path)[1].lower().lstrip('.')
 
 
-def preprocess_text(text):
-    """Preprocess text for plagiarism detection"""
-    # Convert to lowercase
-    text = text.lower()
+def iter_text_from_file(file_path, file_type=None, **pdf_options):
+    """
+    Yield the text of a file piece by piece (pages, paragraphs or chunks)
     
-    # Remove special characters and extra whitespace
-    text = re.sub(r'[^\w\s]', '', text)
-    text = re.sub(r'\s+', ' ', text).strip()
+    pdf_options are passed to iter_text_from_pdf for PDF files.
+    """
+    extension = get_file_extension(file_path, file_type)
     
-    return text
+    if extension == 'pdf':
+        return iter_text_from_pdf(file_path, **pdf_options)
+    elif extension == 'docx':
+        return iter_text_from_docx(file_path)
+    elif extension == 'txt':
+        return iter_text_from_txt(file_path)
+    else:
+        raise ValueError(f"Unsupported file type: {file_type or extension}")
+
+
+def extract_text_from_file(file_path, file_type=None, **pdf_options):
+    """Extract text from various file types"""
+    return "".join(iter_text_from_file(file_path, file_type, **pdf_options))
@@ -5,3 +5,18 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'plagiarism_detector.settings')
 
 application = get_asgi_application()
+
+# Load the detection stack when the worker starts instead of in its first check
+from django.conf import settings
+
+if settings.PLAGIARISM_WARM_UP:
+    from detector.services import warm_up
+    warm_up()
+
+# Restart the extractions and fail the checks left running by a stopped
+# process, and run the pending and queued ones, once the first request
+# arrives in each worker process
+from django.core.signals import request_started
+from detector.jobs import recover_on_first_request
+
+request_started.connect(recover_on_first_request)
@@ -107,6 +107,61 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Plagiarism detection indexes
+PLAGIARISM_INDEX_DIR = os.getenv('PLAGIARISM_INDEX_DIR', os.path.join(BASE_DIR, 'plagiarism_index'))
+
+# MinHash LSH candidate retrieval for archive-wide checks. Pairs with k-gram
+# Jaccard similarity J are retrieved with probability 1 - (1 - J**rows)**bands:
+# more bands or fewer rows favour recall, the reverse favours speed.
+PLAGIARISM_LSH_BANDS = int(os.getenv('PLAGIARISM_LSH_BANDS', 64))
+PLAGIARISM_LSH_ROWS = int(os.getenv('PLAGIARISM_LSH_ROWS', 2))
+
+# Threads running queued plagiarism checks and extractions inside each web
+# process. Checks are CPU-bound and would compete with requests in every web
+# process, so outside DEBUG the queue is left to
+# `python manage.py run_plagiarism_worker` processes by default; runserver
+# runs it in-process so that development needs no separate worker.
+PLAGIARISM_JOB_WORKERS = int(os.getenv('PLAGIARISM_JOB_WORKERS', 2 if DEBUG else 0))
+
+# Seconds after its last heartbeat that a running check is taken to
+# have been left behind by a crashed or restarted process, and failed. An
+# extraction running for longer than this and PLAGIARISM_PDF_TIMEOUT is
+# started again.
+PLAGIARISM_JOB_STALE_AFTER = int(os.getenv('PLAGIARISM_JOB_STALE_AFTER', 600))
+
+# Processes each check spreads its reference comparisons over (1 disables
+# parallel detection), and how many references a worker takes at a time.
+# Workers are spawned for each check, which takes a few seconds, so this
+# only pays off for checks against large reference sets.
+PLAGIARISM_DETECTION_WORKERS = int(os.getenv('PLAGIARISM_DETECTION_WORKERS', 1))
+PLAGIARISM_DETECTION_CHUNK_SIZE = int(os.getenv('PLAGIARISM_DETECTION_CHUNK_SIZE', 16))
+
+# Reference assignments fetched from the database at a time during a check,
+# and the number of highest-scoring matches kept per result
+PLAGIARISM_REFERENCE_CHUNK_SIZE = int(os.getenv('PLAGIARISM_REFERENCE_CHUNK_SIZE', 200))
+PLAGIARISM_MAX_MATCHES = int(os.getenv('PLAGIARISM_MAX_MATCHES', 100))
+
+# Pair comparisons cached across checks, least recently used ones are
+# evicted beyond this many (0 disables the cache)
+PLAGIARISM_PAIR_CACHE_SIZE = int(os.getenv('PLAGIARISM_PAIR_CACHE_SIZE', 100000))
+
+# Token a Prometheus scraper sends in the X-Metrics-Token header to read
+# /api/metrics/ (staff users can always read it)
+PLAGIARISM_METRICS_TOKEN = os.getenv('PLAGIARISM_METRICS_TOKEN', '')
+
+# Load the detection stack and indexes when a WSGI/ASGI worker starts rather
+# than in its first check. Off by default so that workers start quickly;
+# run_plagiarism_worker always warms up.
+PLAGIARISM_WARM_UP = os.getenv('PLAGIARISM_WARM_UP', 'False') == 'True'
+
+# PDF extraction: processes extracting page ranges in parallel, an optional
+# cap on pages read per document, and an optional limit on the seconds a
+# document may take before its extraction is killed and marked failed. Pages
+# are extracted in child processes when there are several workers or a limit.
+PLAGIARISM_PDF_WORKERS = int(os.getenv('PLAGIARISM_PDF_WORKERS', 1))
+PLAGIARISM_PDF_MAX_PAGES = int(os.getenv('PLAGIARISM_PDF_MAX_PAGES')) if os.getenv('PLAGIARISM_PDF_MAX_PAGES') else None
+PLAGIARISM_PDF_TIMEOUT = float(os.getenv('PLAGIARISM_PDF_TIMEOUT')) if os.getenv('PLAGIARISM_PDF_TIMEOUT') else None
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -1,7 +0,0 @@
-#!/usr/bin/env python
-import nltk
-
-# Download necessary NLTK data
-nltk.download('punkt')
-
-print("Setup complete!")